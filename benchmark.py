@@ -0,0 +1,729 @@
+"""Simple timing benchmarks for the pycsf core.
+
+Usage::
+
+    python benchmark.py              # run all benchmarks
+    python benchmark.py lookup ...   # run only the named benchmarks
+"""
+import os, sys, time, subprocess, json, tempfile, tracemalloc, shutil
+from collections import OrderedDict
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import numpy as np
+from pycsf.core import SolutionDatabase, Recipe, RecipeSet, IONS
+from pycsf.snapshot import openSnapshot
+
+
+benchmarks = OrderedDict()
+
+def benchmark(fn):
+    benchmarks[fn.__name__] = fn
+    return fn
+
+
+def timeit(fn, repeat=5, setup=None):
+    """Return the best wall-clock time (in seconds) of *repeat* calls to fn().
+
+    If *setup* is given, it is called (untimed) before each repeat and its
+    return value is passed to fn.
+    """
+    best = np.inf
+    for i in range(repeat):
+        args = () if setup is None else (setup(),)
+        start = time.perf_counter()
+        fn(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def mkReagentTable(n, ngroups=20):
+    """Return a list of *n* synthetic reagent records, as stored in a database file.
+    """
+    rng = np.random.RandomState(0)
+    recs = []
+    for i in range(n):
+        rec = OrderedDict([
+            ('group', 'group %d' % (i % ngroups)),
+            ('name', 'reagent %d' % i),
+            ('formula', 'R%d' % i),
+            ('molweight', float(rng.uniform(20, 500))),
+            ('osmconst', float(rng.uniform(1, 3))),
+        ])
+        for ion in IONS:
+            rec[ion] = int(rng.randint(0, 3))
+        rec['notes'] = ''
+        recs.append(rec)
+    return recs
+
+
+def mkDatabase(nreagents):
+    db = SolutionDatabase()
+    db.reagents.restore(mkReagentTable(nreagents))
+    return db
+
+
+@benchmark
+def lookup():
+    """Reagent lookup cost should not depend on the size of the catalog.
+    """
+    print("%10s  %14s  %14s  %16s" % ('reagents', 'getitem (us)', 'field (us)', 'getRecArray (us)'))
+    for n in (100, 1000, 5000, 20000):
+        db = mkDatabase(n)
+        reagents = db.reagents
+        names = ['reagent %d' % i for i in np.linspace(0, n-1, 20).astype(int)]
+        t1 = timeit(lambda: [reagents[name] for name in names]) / len(names)
+        t2 = timeit(lambda: [reagents[name]['molweight'] for name in names]) / len(names)
+        t3 = timeit(lambda: reagents.getRecArray(names))
+        print("%10d  %14.2f  %14.2f  %16.2f" % (n, t1*1e6, t2*1e6, t3*1e6))
+
+
+@benchmark
+def bulkInsert():
+    """Compare adding reagents one at a time against a single addMany() call.
+    """
+    base = mkReagentTable(5000)
+    print("%10s  %12s  %12s" % ('new rows', 'add (ms)', 'addMany (ms)'))
+    for n in (100, 500, 2000):
+        recs = [dict(r, name='new ' + r['name']) for r in mkReagentTable(n, ngroups=25)]
+        def setup():
+            db = mkDatabase(0)
+            db.reagents.restore(base)
+            return db
+        def addEach(db):
+            for rec in recs:
+                db.reagents.add(**rec)
+        def addMany(db):
+            db.reagents.addMany(recs)
+        t1 = timeit(addEach, repeat=1, setup=setup)
+        t2 = timeit(addMany, repeat=3, setup=setup)
+        print("%10d  %12.1f  %12.1f" % (n, t1*1e3, t2*1e3))
+
+
+
+def mkSolutions(db, n, nreagents=(5, 20)):
+    """Add *n* random solutions to *db*, each referencing the next as its comparison.
+    """
+    rng = np.random.RandomState(1)
+    names = db.reagents.names()
+    state = []
+    for i in range(n):
+        k = rng.randint(*nreagents)
+        reagents = {str(names[j]): float(rng.uniform(0.1, 150)) for j in rng.choice(len(names), k, replace=False)}
+        state.append({'name': 'solution %d' % i, 'group': 'group %d' % (i % 10), 'reagents': reagents,
+                      'type': 'internal' if i % 2 else 'external',
+                      'compareAgainst': 'solution %d' % ((i + 1) % n), 'notes': ''})
+    db.solutions.restore(state)
+    return db
+
+
+def referenceRecalculate(db, solutions, temperature):
+    """Per-solution calculation of ion concentrations, osmolarity and reversal
+    potentials, as done before Solutions.recalculate was vectorized.
+    """
+    def calc(soln):
+        reagents = db.reagents.getRecArray(soln._reagents.keys())
+        concs = np.array([soln._reagents[n] for n in reagents['name']])
+        ions = {ion: np.sum(reagents[ion] * concs) for ion in IONS}
+        return ions, np.sum(concs * reagents['osmconst'])
+
+    results = {}
+    R, F, T = 8.31446, 96485.333, temperature + 273.15
+    for soln in solutions:
+        ions, osm = calc(soln)
+        against = calc(db.solutions[soln.compareAgainst])[0]
+        external, internal = (ions, against) if soln.type == 'external' else (against, ions)
+        revs = {}
+        for ion, z in IONS.items():
+            if internal[ion] == 0 and external[ion] == 0:
+                revs[ion] = None
+            else:
+                revs[ion] = 1000 * ((R * T) / (z * F)) * np.log((external[ion]+1e-6) / (internal[ion]+1e-6))
+        results[soln.name] = [ions, osm, revs]
+    return results
+
+
+@benchmark
+def recalculate():
+    """Vectorized Solutions.recalculate versus the per-solution calculation.
+    """
+    print("%10s  %16s  %16s  %6s" % ('solutions', 'reference (ms)', 'vectorized (ms)', 'equal'))
+    for n in (100, 1000, 10000):
+        db = mkSolutions(mkDatabase(1000), n)
+        solns = list(db.solutions)
+        t1 = timeit(lambda: referenceRecalculate(db, solns, 25.0), repeat=1)
+        t2 = timeit(lambda: db.solutions.recalculate(solns, 25.0), repeat=3)
+        equal = referenceRecalculate(db, solns, 25.0) == db.solutions.recalculate(solns, 25.0)
+        print("%10d  %16.1f  %16.1f  %6s" % (n, t1*1e3, t2*1e3, equal))
+
+
+
+@benchmark
+def editCache():
+    """Simulate editing one of 40 displayed solutions: each edit is followed by
+    a recalculation of all displayed solutions and their comparison partners.
+    """
+    db = mkSolutions(mkDatabase(1000), 1000)
+    solns = list(db.solutions)[:40]
+    names = db.reagents.names()
+    def edit(useCache):
+        for i in range(200):
+            soln = solns[i % len(solns)]
+            soln[str(names[i])] = float(i + 1)
+            if not useCache:
+                db.solutions._calcCache.clear()
+            db.solutions.recalculate(solns, 25.0)
+    for useCache in (False, True):
+        db.solutions.cacheStats(reset=True)
+        t = timeit(lambda: edit(useCache), repeat=1)
+        stats = db.solutions.cacheStats()
+        hitRate = stats['hits'] / float(stats['hits'] + stats['misses'])
+        print("cache %-3s  %8.3f ms/edit   hit rate %5.1f%%" % ('on' if useCache else 'off', t*1e3/200, hitRate*100))
+
+
+
+@benchmark
+def startup():
+    """Time and memory needed to import the core and load the default database,
+    with pure-Python signals versus Qt signals.
+    """
+    code = ("import time, resource; start = time.perf_counter(); "
+            "from pycsf.core import SolutionDatabase; db = SolutionDatabase(); db.loadDefault(); "
+            "print(time.perf_counter() - start, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)")
+    root = os.path.dirname(os.path.abspath(__file__))
+    print("%8s  %10s  %14s" % ('signals', 'time (ms)', 'max RSS (MB)'))
+    for useQt in ('0', '1'):
+        env = dict(os.environ, PYCSF_QT=useQt, PYTHONPATH=root)
+        times = []
+        for i in range(5):
+            out = subprocess.check_output([sys.executable, '-c', code], env=env, cwd=root)
+            t, rss = out.split()
+            times.append(float(t))
+        print("%8s  %10.1f  %14.1f" % ('Qt' if useQt == '1' else 'Python', min(times)*1e3, int(rss)/1024.))
+
+
+
+@benchmark
+def guiStartup():
+    """Time to import the GUI modules with and without cached .ui templates.
+    """
+    code = ("import time; start = time.perf_counter(); import pycsf.editor; "
+            "print(time.perf_counter() - start)")
+    root = os.path.dirname(os.path.abspath(__file__))
+    cacheDir = os.path.join(root, 'pycsf', '__pycache__')
+    env = dict(os.environ, PYTHONPATH=root, QT_QPA_PLATFORM='offscreen')
+    def clearCache():
+        if os.path.isdir(cacheDir):
+            for f in os.listdir(cacheDir):
+                if f.endswith('.uic'):
+                    os.remove(os.path.join(cacheDir, f))
+    print("%8s  %10s" % ('cache', 'time (ms)'))
+    for cached in (False, True):
+        times = []
+        for i in range(5):
+            if not cached:
+                clearCache()
+            out = subprocess.check_output([sys.executable, '-c', code], env=env, cwd=root)
+            times.append(float(out))
+        print("%8s  %10.1f" % ('warm' if cached else 'cold', min(times)*1e3))
+
+
+
+@benchmark
+def reagentIO():
+    """Time to convert a 50k-reagent table to and from JSON-ready objects.
+    """
+    rows = mkReagentTable(50000)
+    db = mkDatabase(0)
+    db.reagents.restore(rows)
+    columns = db.reagents.save(columnar=True)
+    print("%10s  %10s  %10s" % ('layout', 'load (ms)', 'save (ms)'))
+    for layout, data in (('rows', rows), ('columns', columns)):
+        t1 = timeit(lambda: db.reagents.restore(data), repeat=3)
+        t2 = timeit(lambda: db.reagents.save(columnar=layout == 'columns'), repeat=3)
+        print("%10s  %10.1f  %10.1f" % (layout, t1*1e3, t2*1e3))
+
+
+
+@benchmark
+def saveFile():
+    """Time to write a large database with the stdlib json module and with
+    SolutionDatabase.saveFile, and check that repeated saves are identical.
+    """
+    db = mkSolutions(mkDatabase(20000), 5000)
+    fd, filename = tempfile.mkstemp(suffix='.json')
+    os.close(fd)
+    def stdlib():
+        with open(filename, 'w') as fh:
+            json.dump(db.save(), fh, indent=2, default=lambda o: o.item())
+    try:
+        t1 = timeit(stdlib, repeat=3)
+        t2 = timeit(lambda: db.saveFile(filename), repeat=3)
+        first = open(filename, 'rb').read()
+        db2 = SolutionDatabase()
+        db2.loadFile(filename)
+        db2.saveFile(filename)
+        stable = open(filename, 'rb').read() == first
+    finally:
+        os.remove(filename)
+    print("json.dump: %0.1f ms   saveFile: %0.1f ms   (%0.1f MB, byte-stable after reload: %s)" % (
+        t1*1e3, t2*1e3, len(first)/1e6, stable))
+
+
+
+@benchmark
+def loadFile():
+    """Time and peak memory needed to load a large database file with
+    json.load() + restore() versus the incremental SolutionDatabase.loadFile.
+    """
+    fd, filename = tempfile.mkstemp(suffix='.json')
+    os.close(fd)
+    try:
+        mkSolutions(mkDatabase(50000), 2000).saveFile(filename)
+        def wholeFile():
+            db = SolutionDatabase()
+            db.restore(json.load(open(filename, 'rb')))
+            return db
+        def streaming():
+            db = SolutionDatabase()
+            db.loadFile(filename)
+            return db
+        print("%.1f MB file" % (os.path.getsize(filename) / 1e6))
+        print("%10s  %10s  %16s" % ('method', 'time (ms)', 'peak alloc (MB)'))
+        for name, fn in (('json.load', wholeFile), ('loadFile', streaming)):
+            t = timeit(fn, repeat=3)
+            tracemalloc.start()
+            db = fn()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print("%10s  %10.1f  %16.1f" % (name, t*1e3, peak / 1e6))
+    finally:
+        os.remove(filename)
+
+
+
+@benchmark
+def journal():
+    """Latency of saving a single edit to a large database, with a complete
+    snapshot versus a journaled save.
+    """
+    db = mkSolutions(mkDatabase(20000), 2000)
+    names = db.reagents.names()
+    solns = list(db.solutions)
+    tmpdir = tempfile.mkdtemp()
+    filename = os.path.join(tmpdir, 'db.json')
+    counter = [0]
+    def editAndSave(journal):
+        i = counter[0] = counter[0] + 1
+        solns[i % len(solns)][str(names[i % len(names)])] = float(i)
+        db.saveFile(filename, journal=journal)
+    try:
+        db.saveFile(filename)
+        t1 = timeit(lambda: editAndSave(False), repeat=5)
+        db.saveFile(filename, journal=True)
+        t2 = timeit(lambda: editAndSave(True), repeat=20)
+    finally:
+        for f in os.listdir(tmpdir):
+            os.remove(os.path.join(tmpdir, f))
+        os.rmdir(tmpdir)
+    print("snapshot save: %0.1f ms   journaled save: %0.3f ms" % (t1*1e3, t2*1e3))
+
+
+
+@benchmark
+def sqlite():
+    """Time to read one solution (and calculate its composition) from a large
+    database stored as JSON versus SQLite.
+    """
+    db = mkSolutions(mkDatabase(5000), 2000)
+    tmpdir = tempfile.mkdtemp()
+    jsonFile = os.path.join(tmpdir, 'db.json')
+    sqlFile = os.path.join(tmpdir, 'db.sqlite')
+    def fromJson():
+        db = SolutionDatabase()
+        db.loadFile(jsonFile)
+        return db.solutions['solution 1000'].recalculate()
+    def fromSQLite():
+        db = SolutionDatabase()
+        db.openSQLite(sqlFile)
+        return db.solutions['solution 1000'].recalculate()
+    try:
+        db.saveFile(jsonFile)
+        t1 = timeit(lambda: db.saveSQLite(sqlFile), repeat=3)
+        t2 = timeit(fromJson, repeat=3)
+        t3 = timeit(fromSQLite, repeat=3)
+        (ions1, osm1), (ions2, osm2) = fromJson(), fromSQLite()
+        # JSON files store 12 significant digits; SQLite stores exact values
+        same = np.allclose(list(ions1.values()) + [osm1], list(ions2.values()) + [osm2], rtol=1e-10)
+    finally:
+        for f in os.listdir(tmpdir):
+            os.remove(os.path.join(tmpdir, f))
+        os.rmdir(tmpdir)
+    print("saveSQLite: %0.1f ms   query via JSON: %0.1f ms   query via SQLite: %0.1f ms   (same result: %s)" % (
+        t1*1e3, t2*1e3, t3*1e3, same))
+
+
+
+@benchmark
+def snapshot():
+    """Time to load a large database from JSON versus a binary snapshot, and
+    to calculate all compositions from a memory-mapped snapshot.
+    """
+    db = mkSolutions(mkDatabase(50000), 2000)
+    tmpdir = tempfile.mkdtemp()
+    jsonFile = os.path.join(tmpdir, 'db.json')
+    snapDir = os.path.join(tmpdir, 'db.snap')
+    def mapped():
+        return openSnapshot(snapDir).calculate()
+    try:
+        db.saveFile(jsonFile)
+        t1 = timeit(lambda: db.saveSnapshot(snapDir), repeat=3)
+        t2 = timeit(lambda: SolutionDatabase().loadFile(jsonFile), repeat=3)
+        t3 = timeit(lambda: SolutionDatabase().loadSnapshot(snapDir), repeat=3)
+        t4 = timeit(mapped, repeat=3)
+    finally:
+        shutil.rmtree(tmpdir)
+    print("saveSnapshot: %0.1f ms   loadFile: %0.1f ms   loadSnapshot: %0.1f ms   mmap + calculate: %0.1f ms" % (
+        t1*1e3, t2*1e3, t3*1e3, t4*1e3))
+
+
+
+@benchmark
+def solutionIndex():
+    """Restoring, looking up and renaming solutions should scale linearly
+    (restore) or not at all (lookup, rename) with the number of solutions.
+    """
+    db = mkDatabase(1000)
+    print("%10s  %12s  %12s  %12s" % ('solutions', 'restore (ms)', 'lookup (us)', 'rename (us)'))
+    for n in (1000, 10000, 100000):
+        state = mkSolutions(db, n).solutions.save()
+        t1 = timeit(lambda: db.solutions.restore(state), repeat=3)
+        names = ['solution %d' % i for i in np.linspace(0, n-1, 20).astype(int)]
+        t2 = timeit(lambda: [db.solutions[name] for name in names]) / len(names)
+        soln = db.solutions[names[10]]
+        def rename():
+            soln.setName(names[10] + ' (renamed)')
+            soln.setName(names[10])
+        t3 = timeit(rename) / 2
+        print("%10d  %12.1f  %12.2f  %12.2f" % (n, t1*1e3, t2*1e6, t3*1e6))
+
+
+
+@benchmark
+def whereUsed():
+    """Cost of reagent renames, data edits and "where used" queries; these
+    should depend on how many solutions use the reagent, not on the total.
+    """
+    print("%10s  %16s  %14s  %16s" % ('solutions', 'whereUsed (us)', 'rename (us)', 'setData (us)'))
+    for n in (1000, 10000, 50000):
+        db = mkSolutions(mkDatabase(1000), n)
+        solns = list(db.solutions)
+        db.solutions.calculate(solns)
+        names = [str(name) for name in db.reagents.names()[:20]]
+        t1 = timeit(lambda: [db.whereUsed(name) for name in names]) / len(names)
+        def rename():
+            for name in names:
+                db.reagents.rename(name, name + ' (renamed)')
+                db.reagents.rename(name + ' (renamed)', name)
+        t2 = timeit(rename) / (2 * len(names))
+        t3 = timeit(lambda: [db.reagents.setData(name, 'Na', 1) for name in names]) / len(names)
+        print("%10d  %16.1f  %14.1f  %16.1f" % (n, t1*1e6, t2*1e6, t3*1e6))
+
+
+@benchmark
+def solutionTree():
+    """Latency and widget churn of solution-tree updates in the solution
+    editor (40 solutions shown, all 1000 reagents), compared to rebuilding
+    the tree on every update.
+    """
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    from pycsf import qt
+    from pycsf.solutionEditor import SolutionEditorWidget
+    app = qt.QApplication.instance() or qt.QApplication([])
+
+    class Editor(SolutionEditorWidget):
+        # counts rows created; optionally rebuilds the whole tree on every update
+        rebuild = False
+        created = 0
+        def updateSolutionTree(self):
+            if self.rebuild:
+                self._treeShowGroups = None
+            SolutionEditorWidget.updateSolutionTree(self)
+            self.created += self.treeStats['created']
+
+    db = mkSolutions(mkDatabase(1000), 200)
+    se = Editor(db)
+    se.selectedSolutions = list(db.solutions)[:40]
+    se.showAllReagents = True
+    se.updateSolutionTree()
+    name = str(db.reagents.names()[10])
+    soln = list(db.solutions)[50]
+    def select():
+        se.selectedSolutions.append(soln)
+        se.updateSolutionTree()
+        se.selectedSolutions.remove(soln)
+        se.updateSolutionTree()
+    def rename():
+        db.reagents.rename(name, name + ' (renamed)')
+        db.reagents.rename(name + ' (renamed)', name)
+    def addRemove():
+        db.reagents.add('benchmark reagent', 'group 0')
+        db.reagents.remove('benchmark reagent')
+    edits = [
+        ('setData', lambda: db.reagents.setData(name, 'Na', 1), 1),
+        ('add/remove', addRemove, 2),
+        ('rename', rename, 2),
+        ('select', select, 2),
+    ]
+    print("%12s  %8s  %12s  %14s" % ('edit', 'mode', 'time (ms)', 'rows created'))
+    for rebuild in (True, False):
+        se.rebuild = rebuild
+        for label, fn, count in edits:
+            se.created = 0
+            t = timeit(fn, repeat=3) / count
+            print("%12s  %8s  %12.1f  %14.1f" % (label, "rebuild" if rebuild else "diff", t*1e3, se.created / (3. * count)))
+
+
+@benchmark
+def reagentTable():
+    """Time to build the reagent editor and to update it after single edits,
+    for increasing numbers of reagents.
+    """
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    from pycsf import qt
+    from pycsf.reagentEditor import ReagentEditorWidget
+    app = qt.QApplication.instance() or qt.QApplication([])
+    print("%10s  %10s  %12s  %12s  %14s" % ('reagents', 'build (ms)', 'setData (ms)', 'rename (ms)', 'add/rm (ms)'))
+    for n in (1000, 10000, 50000):
+        db = mkDatabase(n)
+        def build():
+            w = ReagentEditorWidget(db)
+            w.show()
+            app.processEvents()
+            return w
+        start = time.perf_counter()
+        w = build()
+        t1 = time.perf_counter() - start
+        name = 'reagent %d' % (n // 2)
+        def setData():
+            db.reagents.setData(name, 'Na', 2)
+            app.processEvents()
+        def rename():
+            db.reagents.rename(name, name + ' (renamed)')
+            db.reagents.rename(name + ' (renamed)', name)
+            app.processEvents()
+        def addRemove():
+            db.reagents.add('benchmark reagent', 'group 3')
+            app.processEvents()
+            db.reagents.remove('benchmark reagent')
+            app.processEvents()
+        t2 = timeit(setData)
+        t3 = timeit(rename) / 2
+        t4 = timeit(addRemove) / 2
+        print("%10d  %10.1f  %12.2f  %12.2f  %14.2f" % (n, t1*1e3, t2*1e3, t3*1e3, t4*1e3))
+        w.close()
+
+
+def mkRecipeSet(db, nrecipes, nvolumes):
+    """Add a recipe set with one recipe per solution (up to *nrecipes*) to *db*.
+    """
+    rs = RecipeSet('benchmark recipes', db=db)
+    for i, soln in enumerate(db.solutions):
+        if i == nrecipes:
+            break
+        rs.add(Recipe(solution=soln, volumes=[100. * (k+1) for k in range(nvolumes)], db=db))
+    db.recipes.add(rs)
+    return rs
+
+
+@benchmark
+def recipeTable():
+    """Time to show a large recipe set in the recipe editor, and to update it
+    after a volume or stock concentration edit.
+    """
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    from pycsf import qt
+    from pycsf.recipeEditor import RecipeEditorWidget
+    app = qt.QApplication.instance() or qt.QApplication([])
+    print("%10s  %10s  %12s  %12s  %12s" % ('recipes', 'columns', 'show (ms)', 'volume (ms)', 'stock (ms)'))
+    for nrecipes in (10, 50, 200):
+        db = mkSolutions(mkDatabase(1000), nrecipes, nreagents=(20, 40))
+        rs = mkRecipeSet(db, nrecipes, 4)
+        w = RecipeEditorWidget(db)
+        w.show()
+        app.processEvents()
+        def show():
+            w.recipeSet = rs
+            w.updateSolutionGroups()
+            app.processEvents()
+        t1 = timeit(show, repeat=3)
+        model = w.model
+        col = model.columnInfo(1)[0] == 'volume' and 1 or 2
+        vals = ['150', '200']
+        def editVolume():
+            model.setData(model.index(1, col), vals[0])
+            app.processEvents()
+            vals.reverse()
+        t2 = timeit(editVolume)
+        reagent = model.reagentOrder[0]
+        concs = [1000., None]
+        def editStock():
+            w.stockConcentrationChanged(reagent, concs[0])
+            app.processEvents()
+            concs.reverse()
+        t3 = timeit(editStock)
+        print("%10d  %10d  %12.1f  %12.2f  %12.2f" % (nrecipes, model.columnCount(), t1*1e3, t2*1e3, t3*1e3))
+        w.close()
+
+
+def referenceAmounts(rs, reagents):
+    """Per-cell reagent amounts, as computed before RecipeSet.amounts().
+    """
+    amounts = {}
+    for i, recipe in enumerate(rs):
+        for j, vol in enumerate(recipe.volumes):
+            for reagent, conc in recipe.solution.reagents.items():
+                if reagent not in reagents:
+                    continue
+                stock = rs.stocks.get(reagent, None)
+                if stock is None:
+                    mw = rs.db.reagents[reagent]['molweight']
+                    amounts[(reagent, i, j)] = float((vol * 1e-3) * (conc * 1e-3) * (mw * 1e3))
+                else:
+                    amounts[(reagent, i, j)] = float((vol * 1e-3) * (conc * 1e-3) / (stock * 1e-3))
+    return amounts
+
+
+@benchmark
+def recipeAmounts():
+    """Vectorized RecipeSet.amounts versus the per-cell mass calculation.
+    """
+    print("%10s  %10s  %16s  %16s  %6s" % ('reagents', 'columns', 'reference (ms)', 'vectorized (ms)', 'equal'))
+    for nrecipes, nvolumes in ((10, 5), (50, 4)):
+        db = mkSolutions(mkDatabase(200), nrecipes, nreagents=(20, 40))
+        rs = mkRecipeSet(db, nrecipes, nvolumes)
+        reagents, columns, amounts = rs.amounts()
+        for name in reagents[::10]:
+            rs.setStock(name, 1000.)
+        t1 = timeit(lambda: referenceAmounts(rs, reagents), repeat=3)
+        t2 = timeit(lambda: rs.amounts(reagents), repeat=20)
+        ref = referenceAmounts(rs, reagents)
+        reagents, columns, amounts = rs.amounts(reagents)
+        vec = {}
+        for k, name in enumerate(reagents):
+            for c, (i, j) in enumerate(columns):
+                if not np.isnan(amounts[k, c]):
+                    vec[(name, i, j)] = float(amounts[k, c])
+        print("%10d  %10d  %16.2f  %16.3f  %6s" % (len(reagents), len(columns), t1*1e3, t2*1e3, ref == vec))
+
+
+@benchmark
+def productionPlan():
+    """Time to total the reagents for many (recipeSet, recipe, volume, count) orders.
+    """
+    print("%10s  %10s  %12s" % ('recipes', 'orders', 'plan (ms)'))
+    db = mkSolutions(mkDatabase(1000), 1000, nreagents=(20, 40))
+    rs = mkRecipeSet(db, 1000, 4)
+    for name in rs.amounts()[0][::20]:
+        rs.setStock(name, 1.0)
+    for nrecipes in (10, 100, 1000):
+        orders = [(rs, recipe, vol, 2) for recipe in rs[:nrecipes] for vol in recipe.volumes]
+        t = timeit(lambda: db.recipes.plan(orders))
+        print("%10d  %10d  %12.2f" % (nrecipes, len(orders), t*1e3))
+
+
+@benchmark
+def constraintSolve():
+    """Time to solve for the concentrations of 5-20 reagents of a solution
+    given targets for all ion concentrations, osmolarity and reversal potentials.
+    """
+    from pycsf.constraints import ConstraintProblem
+    db = mkSolutions(mkDatabase(1000), 100, nreagents=(20, 40))
+    soln = db.solutions['solution 0']
+    # targets near the current values, so that most reagents stay in the solution
+    ions, osm, revs = db.solutions.recalculate([soln], 34.)[soln.name]
+    targets = dict((ion, ions[ion] * 0.9) for ion in IONS)
+    targets['osmolarity'] = osm * 0.9
+    targets['E_K'] = revs['K'] + 5
+    targets['E_Cl'] = revs['Cl'] - 5
+    print("%10s  %10s  %12s  %12s  %8s" % ('reagents', 'targets', 'setup (ms)', 'solve (ms)', 'nonzero'))
+    for nadjust in (5, 10, 20):
+        reagents = soln.reagentList()[:nadjust]
+        t1 = timeit(lambda: ConstraintProblem(db, soln, reagents, targets, temperature=34.))
+        problem = ConstraintProblem(db, soln, reagents, targets, temperature=34.)
+        t2 = timeit(problem.solve)
+        nonzero = sum(c > 0 for c in problem.solve().concentrations.values())
+        print("%10d  %10d  %12.2f  %12.2f  %8d" % (nadjust, len(targets), t1*1e3, t2*1e3, nonzero))
+
+
+@benchmark
+def batchSolve():
+    """Time to solve constraint problems for many solutions, serially and in
+    a process pool with one worker per CPU.
+    """
+    from pycsf.constraints import ConstraintProblem, solveMany
+    db = mkSolutions(mkDatabase(1000), 2000, nreagents=(20, 40))
+    problems = []
+    for soln in db.solutions:
+        ions, osm, revs = db.solutions.recalculate([soln], 34.)[soln.name]
+        targets = {'Na': ions['Na'] * 1.1, 'K': ions['K'] * 0.9, 'osmolarity': osm * 0.9, 'E_Cl': revs['Cl'] - 5}
+        problems.append(ConstraintProblem(db, soln, soln.reagentList()[:15], targets, temperature=34.))
+    ncpu = os.cpu_count() or 1
+    print("%10s  %10s  %12s" % ('problems', 'workers', 'solve (ms)'))
+    for n in (200, 2000):
+        for workers in sorted(set([1, ncpu])):
+            t = timeit(lambda: solveMany(problems[:n], workers=workers), repeat=3)
+            print("%10d  %10d  %12.1f" % (n, workers, t*1e3))
+
+
+@benchmark
+def parameterSweep():
+    """Time to compute reversal potentials over a grid of internal solutions,
+    an external reagent concentration and temperature.
+    """
+    from pycsf.sweep import sweep
+    db = mkSolutions(mkDatabase(1000), 100, nreagents=(20, 40))
+    solns = list(db.solutions)
+    external = solns[-1]
+    reagent = external.reagentList()[0]
+    print("%10s  %10s  %10s  %12s  %10s" % ('internals', 'concs', 'temps', 'points', 'time (ms)'))
+    for ninternal, nconc, ntemp in ((1, 100, 100), (20, 100, 100), (50, 100, 100)):
+        concs = {('external', reagent): np.linspace(0, 10, nconc)}
+        temps = np.linspace(20, 37, ntemp)
+        t = timeit(lambda: sweep(db, solns[:ninternal], external, temperature=temps, concentrations=concs))
+        print("%10d  %10d  %10d  %12d  %10.1f" % (ninternal, nconc, ntemp, ninternal*nconc*ntemp, t*1e3))
+
+
+@benchmark
+def reversalMatrix():
+    """Time to compute reversal potentials for every pair of internal and
+    external solutions, compared to looping over the pairs.
+    """
+    from pycsf.core import IONS
+    from pycsf import composition
+    db = mkSolutions(mkDatabase(1000), 1000, nreagents=(20, 40))
+    solutions = list(db.solutions)
+    valence = np.array(list(IONS.values()))
+
+    def pairwise(internal, external):
+        ions, osm = db.solutions.calculate(internal + external)
+        revs = np.empty((len(internal), len(external), len(IONS)))
+        for i in range(len(internal)):
+            for j in range(len(external)):
+                revs[i, j] = composition.reversalPotentials(ions[i], ions[len(internal)+j], valence, 34.)
+        return revs
+
+    print("%10s  %10s  %12s  %12s" % ('internal', 'external', 'loop (ms)', 'matrix (ms)'))
+    for n in (20, 100, 500):
+        internal = solutions[0:2*n:2]
+        external = solutions[1:2*n:2]
+        t1 = timeit(lambda: pairwise(internal, external), repeat=1) if n <= 100 else float('nan')
+        t2 = timeit(lambda: db.solutions.reversalMatrix(internal, external, 34.))
+        print("%10d  %10d  %12.1f  %12.2f" % (n, n, t1*1e3, t2*1e3))
+
+
+if __name__ == '__main__':
+    names = sys.argv[1:] or list(benchmarks.keys())
+    for name in names:
+        print("== %s ==" % name)
+        benchmarks[name]()
+        print("")
@@ -0,0 +1,131 @@
+"""Vectorized calculation of ion concentrations, osmolarity, and reversal potentials.
+
+Solution compositions are represented as a sparse (solutions x reagents)
+concentration matrix, and reagent properties as a dense (reagents x ions)
+dissociation matrix built from the Reagents table. Ion concentrations and
+osmolarity for any number of solutions are then a single matrix product.
+"""
+import numpy as np
+
+# gas constant (J / (K mol)) and Faraday constant (C / mol)
+R = 8.31446
+F = 96485.333
+
+
+def dissociationMatrix(data, ions):
+    """Return a (reagents x ions+1) array built from a Reagents structured array.
+
+    Each row gives the number of free ions of each type contributed by one
+    molecule of the reagent; the last column is the osmotic constant.
+    """
+    cols = [data[ion] for ion in ions] + [data['osmconst']]
+    return np.column_stack(cols).astype(float)
+
+
+class ConcentrationMatrix(object):
+    """Sparse (solutions x reagents) matrix of reagent concentrations.
+
+    Only nonzero entries are stored, as (row, column, value) triplets ordered
+    by row. Reagents that do not appear in *index* (a dict mapping reagent
+    name to column) are ignored. The triplets can be handed directly to
+    ``scipy.sparse.coo_matrix((values, (rows, cols)), shape)`` if needed.
+    """
+    def __init__(self, solutions, index, nreagents):
+        rows = []
+        cols = []
+        values = []
+        for i, soln in enumerate(solutions):
+            for name, conc in soln._reagents.items():
+                j = index.get(name)
+                if j is None:
+                    continue
+                rows.append(i)
+                cols.append(j)
+                values.append(conc)
+        self.shape = (len(solutions), nreagents)
+        self.rows = np.array(rows, dtype=int)
+        self.cols = np.array(cols, dtype=int)
+        self.values = np.array(values, dtype=float)
+
+    @classmethod
+    def fromArrays(cls, rows, cols, values, shape):
+        """Create a matrix from (row, column, value) triplets, which must be
+        ordered by row.
+        """
+        mat = cls.__new__(cls)
+        mat.shape = shape
+        mat.rows = np.asarray(rows, dtype=int)
+        mat.cols = np.asarray(cols, dtype=int)
+        mat.values = np.asarray(values, dtype=float)
+        return mat
+
+    def toarray(self):
+        """Return the dense (solutions x reagents) array.
+        """
+        arr = np.zeros(self.shape)
+        arr[self.rows, self.cols] = self.values
+        return arr
+
+    def dot(self, matrix):
+        """Return the product of this matrix with a dense (reagents x k) array.
+        """
+        out = np.zeros((self.shape[0], matrix.shape[1]))
+        if len(self.values) == 0:
+            return out
+        # Solutions are processed in blocks that contain the same number of
+        # reagents, so that each block is a dense (solutions x reagents x k)
+        # array of products that can be summed along the reagent axis. This
+        # gives exactly the same rounding as summing each solution separately.
+        counts = np.bincount(self.rows, minlength=self.shape[0])
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        for n in np.unique(counts[counts > 0]):
+            sel = np.flatnonzero(counts == n)
+            inds = starts[sel][:, None] + np.arange(n)
+            products = matrix[self.cols[inds]] * self.values[inds][..., None]
+            out[sel] = np.ascontiguousarray(products.transpose(2, 0, 1)).sum(axis=2).T
+        return out
+
+
+def reversalPotentials(internal, external, valence, temperature):
+    """Return Nernst reversal potentials (mV).
+
+    *internal* and *external* are arrays of ion concentrations (mM) that
+    broadcast against *valence*; *temperature* is given in degrees C.
+    """
+    T = temperature + 273.15
+    return 1000 * ((R * T) / (valence * F)) * np.log((external + 1e-6) / (internal + 1e-6))
+
+
+def recipeAmounts(concentrations, volumes, molweights, stocks):
+    """Return the amount of each reagent needed to make a set of solutions.
+
+    *concentrations* is a (reagents x columns) array of reagent concentrations
+    (mM; nan where a reagent is not used) and *volumes* gives the volume (ml)
+    to make for each column. *stocks* gives the stock concentration (M) of
+    each reagent, or nan for reagents that are weighed out.
+
+    Returns a (reagents x columns) array of masses (mg) or, for reagents that
+    have a stock, volumes of stock solution (ml).
+    """
+    concentrations = np.asarray(concentrations, dtype=float)
+    stocks = np.asarray(stocks, dtype=float)
+    isStock = ~np.isnan(stocks)
+    moles = (np.asarray(volumes, dtype=float) * 1e-3)[None, :] * (concentrations * 1e-3)
+    masses = moles * (np.asarray(molweights, dtype=float) * 1e3)[:, None]
+    stockVolumes = moles / np.where(isStock, stocks * 1e-3, 1.0)[:, None]
+    return np.where(isStock[:, None], stockVolumes, masses)
+
+
+def reversalConcentration(potential, other, valence, temperature, external=True):
+    """Return the ion concentration (mM) that gives a Nernst reversal
+    *potential* (mV); the inverse of reversalPotentials().
+
+    *other* is the concentration on the other side of the membrane. If
+    *external* is True, the external concentration is returned, otherwise
+    the internal one.
+    """
+    T = temperature + 273.15
+    ratio = np.exp(potential * (valence * F) / (1000 * R * T))
+    if external:
+        return (other + 1e-6) * ratio - 1e-6
+    return (other + 1e-6) / ratio - 1e-6
@@ -1,10 +1,221 @@
+from collections import OrderedDict
 from . import qt
+from .constraints import ConstraintProblem, targetNames
+from .format_float import formatFloat
 
 Ui_constraintEditor = qt.importTemplate('.constraintEditorTemplate')
 
 
 class ConstraintEditorWidget(qt.QWidget):
-    def __init__(self, parent=None):
+    """Adjusts the concentrations of selected reagents in a solution to meet
+    targets for ion concentrations, osmolarity and reversal potentials.
+
+    The problem is re-solved (see constraints.ConstraintProblem) whenever a
+    target, the set of adjusted reagents or the solution changes; the
+    proposed concentrations are only written to the solution when "Apply" is
+    clicked.
+    """
+    def __init__(self, db, parent=None):
+        self.db = db
+        self.solution = None
+        self.result = None
+        self._updating = False
+        # reagents added to the list that the solution does not contain yet
+        self._extraReagents = []
+
         qt.QWidget.__init__(self, parent)
         self.ui = Ui_constraintEditor()
         self.ui.setupUi(self)
+        self.ui.hsplitter.setStretchFactor(0, 1)
+        self.ui.hsplitter.setStretchFactor(1, 1)
+        self.ui.constraintTree.setEditTriggers(qt.QAbstractItemView.NoEditTriggers)
+
+        self.targetItems = OrderedDict()
+        for key in targetNames():
+            if key == 'osmolarity':
+                label = 'Osmolarity (mOsm)'
+            elif key.startswith('E_'):
+                label = 'E %s (mV)' % key[2:]
+            else:
+                label = '%s (mM)' % key
+            item = qt.QTreeWidgetItem([label, '', '', ''])
+            item.setFlags(item.flags() | qt.Qt.ItemIsEditable | qt.Qt.ItemIsUserCheckable)
+            item.setCheckState(0, qt.Qt.Unchecked)
+            item.key = key
+            self.ui.constraintTree.addTopLevelItem(item)
+            self.targetItems[key] = item
+        self.reagentItems = OrderedDict()
+
+        self.updateSolutionList()
+
+        self.db.solutions.solutionListChanged.connect(self.updateSolutionList)
+        self.ui.solutionCombo.currentIndexChanged.connect(self.solutionSelected)
+        self.ui.tempSpin.valueChanged.connect(self.updateCurrentValues)
+        self.ui.constraintTree.itemClicked.connect(self.targetItemClicked)
+        self.ui.constraintTree.itemChanged.connect(self.targetChanged)
+        self.ui.reagentTree.itemChanged.connect(self.reagentItemChanged)
+        self.ui.addReagentEdit.returnPressed.connect(self.addReagent)
+        self.ui.applyBtn.clicked.connect(self.apply)
+
+    def updateSolutionList(self):
+        combo = self.ui.solutionCombo
+        current = combo.currentText()
+        names = sorted(self.db.solutions.names())
+        combo.blockSignals(True)
+        try:
+            combo.clear()
+            combo.addItems(names)
+            if current in names:
+                combo.setCurrentIndex(names.index(current))
+        finally:
+            combo.blockSignals(False)
+        self.solutionSelected()
+
+    def solutionSelected(self):
+        name = self.ui.solutionCombo.currentText()
+        soln = self.db.solutions[name] if self.db.solutions.hasName(name) else None
+        if soln is self.solution:
+            return
+        if self.solution is not None:
+            qt.disconnect(self.solution.sigSolutionChanged, self.solutionChanged)
+        self.solution = soln
+        self._extraReagents = []
+        if soln is not None:
+            soln.sigSolutionChanged.connect(self.solutionChanged)
+        self.updateReagentList()
+        self.updateCurrentValues()
+
+    def solutionChanged(self):
+        self.updateReagentList()
+        self.updateCurrentValues()
+
+    def updateReagentList(self):
+        """Rebuild the list of reagents that may be adjusted, keeping the
+        check state of reagents that are still listed.
+        """
+        checked = set(name for name, item in self.reagentItems.items() if item.checkState(0) == qt.Qt.Checked)
+        names = [] if self.solution is None else self.solution.reagentList()
+        names += [name for name in self._extraReagents if name not in names]
+        tree = self.ui.reagentTree
+        self._updating = True
+        try:
+            tree.clear()
+            self.reagentItems = OrderedDict()
+            for name in names:
+                conc = self.solution[name]
+                item = qt.QTreeWidgetItem([name, '' if conc is None else formatFloat(conc), ''])
+                item.setFlags(item.flags() | qt.Qt.ItemIsUserCheckable)
+                item.setCheckState(0, qt.Qt.Checked if name in checked else qt.Qt.Unchecked)
+                tree.addTopLevelItem(item)
+                self.reagentItems[name] = item
+        finally:
+            self._updating = False
+        tree.resizeColumnToContents(0)
+
+    def updateCurrentValues(self):
+        """Show the current properties of the solution, then re-solve.
+        """
+        current = {}
+        if self.solution is not None:
+            ions, osm, revs = self.db.solutions.recalculate([self.solution], self.ui.tempSpin.value())[self.solution.name]
+            current.update(ions)
+            current['osmolarity'] = osm
+            current.update(('E_' + ion, rev) for ion, rev in revs.items())
+        self._updating = True
+        try:
+            for key, item in self.targetItems.items():
+                value = current.get(key)
+                item.setText(2, '' if value is None else formatFloat(value))
+        finally:
+            self._updating = False
+        self.solve()
+
+    def targetItemClicked(self, item, col):
+        if col == 1:
+            self.ui.constraintTree.editItem(item, col)
+
+    def targetChanged(self, item, col):
+        if self._updating:
+            return
+        if col == 1 and item.text(1).strip() != '' and item.checkState(0) != qt.Qt.Checked:
+            # entering a target enables it
+            item.setCheckState(0, qt.Qt.Checked)
+            return
+        self.solve()
+
+    def reagentItemChanged(self, item, col):
+        if not self._updating:
+            self.solve()
+
+    def addReagent(self):
+        name = str(self.ui.addReagentEdit.text()).strip()
+        if name == '' or self.solution is None:
+            return
+        if name not in self.db.reagents._index:
+            self.ui.statusLabel.setText('No reagent named "%s"' % name)
+            return
+        if name not in self.reagentItems:
+            self._extraReagents.append(name)
+            self.updateReagentList()
+        self.reagentItems[name].setCheckState(0, qt.Qt.Checked)
+        self.ui.addReagentEdit.clear()
+
+    def targets(self):
+        """Return {target key: value} for all enabled targets with a valid value.
+        """
+        targets = OrderedDict()
+        for key, item in self.targetItems.items():
+            if item.checkState(0) != qt.Qt.Checked:
+                continue
+            try:
+                targets[key] = float(item.text(1))
+            except ValueError:
+                continue
+        return targets
+
+    def adjustedReagents(self):
+        return [name for name, item in self.reagentItems.items() if item.checkState(0) == qt.Qt.Checked]
+
+    def solve(self):
+        self.result = None
+        targets = self.targets()
+        reagents = self.adjustedReagents()
+        status = ''
+        if self.solution is None:
+            pass
+        elif len(targets) == 0 or len(reagents) == 0:
+            status = 'Select targets and reagents to adjust.'
+        else:
+            try:
+                problem = ConstraintProblem(self.db, self.solution, reagents, targets, temperature=self.ui.tempSpin.value())
+                self.result = problem.solve()
+                status = 'Residual: %s' % formatFloat(self.result.residual)
+            except (ValueError, KeyError, RuntimeError) as exc:
+                status = str(exc)
+        self.ui.statusLabel.setText(status)
+
+        result = self.result
+        self._updating = True
+        try:
+            for key, item in self.targetItems.items():
+                value = None if result is None else result.achieved.get(key)
+                item.setText(3, '' if value is None else formatFloat(value))
+            for name, item in self.reagentItems.items():
+                value = None if result is None else result.concentrations.get(name)
+                item.setText(2, '' if value is None else formatFloat(value))
+        finally:
+            self._updating = False
+        self.ui.applyBtn.setEnabled(result is not None)
+
+    def apply(self):
+        """Write the proposed concentrations into the solution.
+        """
+        if self.result is None or self.solution is None:
+            return
+        for name, conc in self.result.concentrations.items():
+            # keep reagents that are removed from the solution in the list
+            if conc == 0 and name not in self._extraReagents:
+                self._extraReagents.append(name)
+        with self.db.batch():
+            for name, conc in self.result.concentrations.items():
+                self.solution[name] = conc
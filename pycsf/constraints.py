@@ -0,0 +1,270 @@
+"""Find reagent concentrations that meet targets for ion concentrations,
+osmolarity and reversal potentials.
+
+Estimated ion concentrations and osmolarity are linear in the reagent
+concentrations (see composition.py), so a solution's properties can be
+written as ``fixed + x . D``, where *x* holds the concentrations of the
+reagents being adjusted, *D* their rows of the dissociation matrix, and
+*fixed* the contribution of all other reagents. A reversal potential target
+is converted to a target for the concentration of the ion, given the
+solution's compareAgainst solution. The concentrations are then found by
+weighted least squares with x >= 0::
+
+    problem = ConstraintProblem(db, db.solutions['ACSF'], ['KCl', 'NaCl'],
+                                {'K': 2.5, 'osmolarity': 300, 'E_K': -100})
+    result = problem.solve()
+    print(result.concentrations, result.achieved)
+
+Target keys are ion names (from IONS; mM), 'osmolarity' (mOsm) and 'E_' +
+ion name for reversal potentials (mV). By default each target is weighted by
+the inverse of its value, so that relative errors are minimized.
+
+ConstraintProblem only holds arrays and names once constructed, so problems
+can be solved in other processes without access to the database. solveMany()
+distributes the solves for many solutions over a process pool and
+changeTable() collects the proposed changes::
+
+    jobs = [(soln, ['NaCl', 'KCl'], {'osmolarity': 300}) for soln in acsfVariants]
+    results = solveSolutions(db, jobs, temperature=34)
+    table = changeTable(results)
+
+Workers are started with the "spawn" method, so they are fresh interpreters
+that import only pycsf.constraints (and not any Qt state of the calling
+process). As with any use of multiprocessing, scripts that call solveMany()
+must guard their top-level code with ``if __name__ == '__main__':``.
+"""
+import os
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from . import composition
+from .core import IONS
+
+
+def nnls(A, b, maxiter=None):
+    """Return (x, residual norm) minimizing ``||A x - b||`` subject to x >= 0.
+
+    Uses the active set method of Lawson and Hanson.
+    """
+    A = np.asarray(A, dtype=float)
+    b = np.asarray(b, dtype=float)
+    m, n = A.shape
+    if maxiter is None:
+        maxiter = 3 * n
+    tol = 10 * max(m, n) * np.finfo(float).eps * max(1.0, np.abs(A).max() if A.size > 0 else 1.0)
+
+    # gradient entries below this are roundoff
+    wtol = tol * max(1.0, np.abs(b).max() if m > 0 else 1.0)
+
+    x = np.zeros(n)
+    passive = np.zeros(n, dtype=bool)
+    # variables that were dropped again immediately after entering the passive
+    # set; they are not retried until x changes (otherwise the solver can
+    # cycle on degenerate problems)
+    skip = np.zeros(n, dtype=bool)
+    w = A.T.dot(b)
+    iterations = 0
+    while True:
+        candidates = ~passive & ~skip & (w > wtol)
+        if not candidates.any():
+            break
+        # move the variable that most reduces the residual into the passive set
+        j = np.argmax(np.where(candidates, w, -np.inf))
+        passive[j] = True
+        previous = x
+        while True:
+            iterations += 1
+            if iterations > maxiter:
+                raise RuntimeError("NNLS did not converge after %d iterations" % maxiter)
+            z = np.zeros(n)
+            z[passive] = np.linalg.lstsq(A[:, passive], b, rcond=None)[0]
+            if (z[passive] > tol).all():
+                x = z
+                break
+            # step back to the boundary and drop variables that reached zero
+            neg = passive & (z <= tol)
+            alpha = np.min(x[neg] / (x[neg] - z[neg]))
+            x = x + alpha * (z - x)
+            passive &= x > tol
+            x[~passive] = 0
+        if not passive[j] and np.array_equal(x, previous):
+            skip[j] = True
+        else:
+            skip[:] = False
+        w = A.T.dot(b - A.dot(x))
+    return x, np.linalg.norm(A.dot(x) - b)
+
+
+def targetNames():
+    """Return all valid target keys, in display order.
+    """
+    return list(IONS) + ['osmolarity'] + ['E_' + ion for ion in IONS]
+
+
+class ConstraintProblem(object):
+    """Weighted non-negative least squares problem for the concentrations of
+    *reagents* in *solution*.
+
+    *targets* maps target keys (see targetNames()) to values; *weights*
+    optionally overrides the weight of some targets. Reversal potential
+    targets require the solution to have a compareAgainst solution, and are
+    computed at *temperature* (degrees C).
+    """
+    def __init__(self, db, solution, reagents, targets, temperature=25.0, weights=None):
+        self.solution = solution.name
+        self.reagents = list(reagents)
+        self.targets = OrderedDict((key, targets[key]) for key in targetNames() if key in targets)
+        unknown = set(targets) - set(self.targets)
+        if len(unknown) > 0:
+            raise KeyError("Unknown constraint target(s): %s" % ', '.join(map(str, sorted(unknown))))
+        self.temperature = temperature
+        self.external = solution.type == 'external'
+        weights = {} if weights is None else weights
+
+        index = db.reagents._index
+        data = db.reagents._data
+        for name in self.reagents:
+            if name not in index:
+                raise KeyError('No reagent named "%s"' % name)
+        D = composition.dissociationMatrix(data[[index[name] for name in self.reagents]], IONS)
+        self.current = np.array([solution[name] or 0.0 for name in self.reagents])
+
+        # ions and osmolarity contributed by all other reagents
+        fixed = [(index[name], conc) for name, conc in solution._reagents.items() if name in index and name not in self.reagents]
+        rows = [j for j, c in fixed]
+        self.fixed = np.array([c for j, c in fixed], dtype=float).dot(composition.dissociationMatrix(data[rows], IONS))
+
+        # ion concentrations of the comparison solution, for reversal targets
+        self.other = None
+        if any(key.startswith('E_') for key in self.targets):
+            if solution.compareAgainst is None:
+                raise ValueError('Solution "%s" has no compareAgainst solution; cannot set reversal potential targets.' % solution.name)
+            ions, osm = db.solutions.calculate([db.solutions[solution.compareAgainst]])
+            self.other = ions[0]
+
+        # one row per target: the column of D it constrains and its value in
+        # concentration units
+        ionNames = list(IONS)
+        valence = np.array(list(IONS.values()), dtype=float)
+        columns = []
+        values = []
+        rowWeights = []
+        for key, value in self.targets.items():
+            if key == 'osmolarity':
+                col = len(ionNames)
+                conc = value
+            elif key.startswith('E_'):
+                col = ionNames.index(key[2:])
+                conc = composition.reversalConcentration(value, self.other[col], valence[col], temperature, external=self.external)
+            else:
+                col = ionNames.index(key)
+                conc = value
+            columns.append(col)
+            values.append(conc)
+            rowWeights.append(weights.get(key, 1.0 / max(abs(conc), 1.0)))
+        self.columns = np.array(columns, dtype=int)
+        self.values = np.array(values, dtype=float)
+        self.weights = np.array(rowWeights, dtype=float)
+        self.matrix = D[:, self.columns].T
+        self.valence = valence
+
+    def system(self):
+        """Return the weighted (A, b) for which ``||A x - b||`` is minimized.
+        """
+        A = self.matrix * self.weights[:, None]
+        b = (self.values - self.fixed[self.columns]) * self.weights
+        return A, b
+
+    def solve(self):
+        """Return a ConstraintResult with the best non-negative concentrations.
+        """
+        x, rnorm = nnls(*self.system())
+        return ConstraintResult(self, x, rnorm)
+
+
+class ConstraintResult(object):
+    """Solution of a ConstraintProblem.
+
+    Attributes:
+
+    * ``concentrations``: proposed concentration (mM) of each adjusted reagent
+    * ``changes``: proposed minus current concentration of each reagent
+    * ``achieved``: value of each target with the proposed concentrations
+    * ``residual``: norm of the weighted residuals
+    """
+    def __init__(self, problem, x, residual):
+        self.problem = problem
+        self.concentrations = OrderedDict(zip(problem.reagents, x.tolist()))
+        self.changes = OrderedDict(zip(problem.reagents, (x - problem.current).tolist()))
+        self.residual = residual
+
+        achieved = OrderedDict()
+        conc = problem.fixed[problem.columns] + problem.matrix.dot(x)
+        for k, key in enumerate(problem.targets):
+            value = conc[k]
+            if key.startswith('E_'):
+                col = problem.columns[k]
+                internal, external = (problem.other[col], value) if problem.external else (value, problem.other[col])
+                value = composition.reversalPotentials(internal, external, problem.valence[col], problem.temperature)
+            achieved[key] = float(value)
+        self.achieved = achieved
+
+
+def solveMany(problems, workers=None, chunksize=None):
+    """Solve many ConstraintProblems, distributing them over a pool of
+    *workers* processes (default: one per CPU).
+
+    Problems are sent to the workers in chunks of *chunksize* (by default,
+    about four chunks per worker) as plain arrays, so workers only run the
+    numpy solver. Workers are spawned rather than forked, so they do not
+    inherit the GUI state of this process. With one worker (or fewer), or a
+    single problem, everything is solved in this process. Returns a list of ConstraintResults in the same order
+    as *problems*.
+    """
+    problems = list(problems)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = min(workers, len(problems))
+    if workers <= 1:
+        return [p.solve() for p in problems]
+    if chunksize is None:
+        chunksize = max(1, -(-len(problems) // (workers * 4)))
+    chunks = [[p.system() for p in problems[i:i+chunksize]] for i in range(0, len(problems), chunksize)]
+    results = []
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+        for solved in pool.map(_solveChunk, chunks):
+            results.extend(solved)
+    return [ConstraintResult(p, x, rnorm) for p, (x, rnorm) in zip(problems, results)]
+
+
+def _solveChunk(systems):
+    # runs in a worker process
+    return [nnls(A, b) for A, b in systems]
+
+
+def solveSolutions(db, jobs, temperature=25.0, workers=None, chunksize=None):
+    """Solve constraint problems for many solutions at once.
+
+    *jobs* is a list of (solution, reagents, targets) or (solution, reagents,
+    targets, weights) tuples, as accepted by ConstraintProblem. Problems are
+    set up in this process and solved with solveMany().
+    """
+    problems = [ConstraintProblem(db, *job[:3], temperature=temperature, weights=job[3] if len(job) > 3 else None)
+                for job in jobs]
+    return solveMany(problems, workers=workers, chunksize=chunksize)
+
+
+def changeTable(results):
+    """Return the proposed concentration changes of many ConstraintResults as
+    a structured array with one row per (solution, reagent) and fields
+    solution, reagent, current, proposed, change and residual.
+    """
+    dtype = [('solution', object), ('reagent', object), ('current', float), ('proposed', float),
+             ('change', float), ('residual', float)]
+    rows = []
+    for result in results:
+        problem = result.problem
+        for name, current, proposed in zip(problem.reagents, problem.current, result.concentrations.values()):
+            rows.append((problem.solution, name, current, proposed, proposed - current, result.residual))
+    return np.array(rows, dtype=dtype)
@@ -1,13 +1,32 @@
 from collections import OrderedDict
-import os, json, tempfile, weakref
+import os, tempfile, weakref, contextlib, operator
 import numpy as np
-from . import qt
+from . import signals, composition, jsonio
+from .journal import Journal, readJournal, applyRecord
+from .sqlstore import SQLiteStore
+from . import snapshot
+from .production import ProductionPlan
+if signals.qtActive():
+    from .qt import QObject, Signal
+else:
+    from .signals import QObject, Signal
 
 
 IONS = OrderedDict([('Na', 1), ('K', 1), ('Cl', -1), ('Ca', 2), ('Mg', 2), ('SO4', -2), ('PO4', -3), ('Cs', 1)])
 
 
-class Reagents(qt.QObject):
+def _emit(obj, signal, *args):
+    """Emit the signal named *signal* on *obj*, unless the database that obj
+    belongs to is inside a batch() block, in which case the signal is deferred.
+    """
+    db = obj.db
+    if db is None or db._batchDepth == 0:
+        getattr(obj, signal).emit(*args)
+    else:
+        db._deferSignal(obj, signal, args)
+
+
+class Reagents(QObject):
     """A table of reagents and their properties.
 
     Fields are:
@@ -27,12 +46,13 @@ class Reagents(qt.QObject):
     database, we might have used a unique integer ID instead, but in this case
     we want the database json file to be human readable and editable.
     """
-    sigReagentListChanged = qt.Signal(object)  # self
-    sigReagentDataChanged = qt.Signal(object)  # self
-    sigReagentRenamed = qt.Signal(object, object, object)  # self, oldname, newname
+    sigReagentListChanged = Signal(object)  # self
+    sigReagentDataChanged = Signal(object)  # self
+    sigReagentRenamed = Signal(object, object, object)  # self, oldname, newname
+    sigReagentChanged = Signal(object, object, object)  # self, name, field
     
     def __init__(self, db):
-        qt.QObject.__init__(self)
+        QObject.__init__(self)
         self.db = db
         self._dtype = [
             ('group', object),
@@ -43,25 +63,47 @@ class Reagents(qt.QObject):
         ] + [(ion, float) for ion in IONS] + [('notes', object)]
         self._null = (None, None, '', 0, 0) + (0,)*len(IONS) + ('',)
         self._data = np.empty(0, dtype=self._dtype)
+        # maps reagent name to row index in self._data
+        self._index = {}
+        # incremented whenever rows are added or removed; Reagent handles use
+        # this to decide whether their cached row index is still valid
+        self._generation = 0
+        # Reagent handles, reused by __getitem__
+        self._handles = {}
 
     def remove(self, name):
-        try:
-            i = np.argwhere(self._data['name'] == name)[0, 0]
-        except IndexError:
-            raise KeyError('No reagent named "%s"' % name)
+        self.removeMany([name])
+
+    def removeMany(self, names):
+        """Remove all named reagents, emitting sigReagentListChanged only once.
+        """
+        names = list(names)
         mask = np.ones(len(self._data), dtype=bool)
-        mask[i] = False
+        for name in names:
+            try:
+                mask[self._index[name]] = False
+            except KeyError:
+                raise KeyError('No reagent named "%s"' % name)
         self._data = self._data[mask]
+        self._reindex()
+        self.db._modified()
+        self.db.reagentDataChanged(names)
 
-        self.sigReagentListChanged.emit(self)
+        _emit(self, 'sigReagentListChanged', self)
 
-    def save(self):
-        return _saveArray(self._data)
+    def save(self, columnar=False):
+        """Return the reagent table as a list of dicts, or as a dict of
+        per-field lists if *columnar* is True. restore() accepts either form.
+        """
+        return _saveArray(self._data, columnar=columnar)
     
     def restore(self, data):
         self._data = _loadArray(data, self._dtype)
-        self.sigReagentListChanged.emit(self)
-        self.sigReagentDataChanged.emit(self)
+        self._reindex()
+        self.db._modified()
+        self.db.reagentDataChanged(None)
+        _emit(self, 'sigReagentListChanged', self)
+        _emit(self, 'sigReagentDataChanged', self)
 
     def groups(self):
         return np.unique(self._data['group'])
@@ -69,71 +111,164 @@ class Reagents(qt.QObject):
     def names(self):
         return self._data['name'].copy()
 
+    def dissociationMatrix(self):
+        """Return a (reagents x IONS) array of ion dissociation constants, with
+        the osmotic constant of each reagent appended as the last column.
+        """
+        return composition.dissociationMatrix(self._data, IONS)
+
     def add(self, name, group, **kwds):
-        pos = np.argwhere(self._data['group'] == group)
-        if len(pos) == 0:
-            pos = len(self._data)
-        else:
-            pos = pos[-1, 0] + 1
-        
-        data = np.empty(len(self._data)+1, dtype=self._dtype)
-        data[:pos] = self._data[:pos]
-        data[pos+1:] = self._data[pos:]
-        data[pos] = self._null
-        data[pos]['name'] = name
-        data[pos]['group'] = group
-        for k,v in kwds.items():
-            data[pos][k] = v
+        kwds['name'] = name
+        kwds['group'] = group
+        self.addMany([kwds])
+
+    def addMany(self, records):
+        """Add many reagents at once.
+
+        Each item in *records* is a dict of field values that must include at
+        least 'name' and 'group'. New reagents are placed after the last
+        existing member of their group; reagents in new groups are appended
+        to the end of the table. The table is rebuilt in a single pass and
+        sigReagentListChanged is emitted only once.
+        """
+        records = list(records)
+        if len(records) == 0:
+            return
+        n = len(self._data)
+        m = len(records)
+
+        # insertion point (in the current table) for each group
+        groupEnd = {}
+        for group in set(rec['group'] for rec in records):
+            pos = np.flatnonzero(self._data['group'] == group)
+            if len(pos) > 0:
+                groupEnd[group] = pos[-1] + 1
+        newGroups = {}
+
+        names = set()
+        order = []
+        for i, rec in enumerate(records):
+            name, group = rec['name'], rec['group']
+            if name in self._index or name in names:
+                raise NameError("A reagent named '%s' already exists." % name)
+            names.add(name)
+            if group in groupEnd:
+                order.append((groupEnd[group], 0, i))
+            else:
+                # keep reagents from each new group together, in order of appearance
+                grpOrder = newGroups.setdefault(group, len(newGroups) + 1)
+                order.append((n, grpOrder, i))
+        order.sort()
+        inserts = np.array([o[0] for o in order], dtype=int)
+        srcRecords = [records[o[2]] for o in order]
+
+        # fill new rows one column at a time
+        new = np.empty(m, dtype=self._dtype)
+        new[:] = self._null
+        fields = set()
+        for rec in records:
+            fields.update(rec.keys())
+        for field in fields:
+            rows = [i for i, rec in enumerate(srcRecords) if field in rec]
+            col = new[field]
+            for i in rows:
+                col[i] = srcRecords[i][field]
+
+        # final position of each old and new row
+        data = np.empty(n + m, dtype=self._dtype)
+        oldPos = np.arange(n) + np.searchsorted(inserts, np.arange(n), side='right')
+        newPos = inserts + np.arange(m)
+        data[oldPos] = self._data
+        data[newPos] = new
         self._data = data
-        
-        self.sigReagentListChanged.emit(self)
-    
+        self._reindex()
+        self.db._modified()
+        self.db.reagentDataChanged(names)
+
+        _emit(self, 'sigReagentListChanged', self)
+
     def rename(self, n1, n2):
         if n1 == n2:
             return
-        if n2 in self._data['name']:
+        if n2 in self._index:
             raise NameError("A reagent named '%s' already exists." % n2)
         ind = self._getIndex(n1)
         self._data[ind]['name'] = n2
+        del self._index[n1]
+        self._index[n2] = ind
+        handle = self._handles.pop(n1, None)
+        if handle is not None:
+            handle.name = n2
+            self._handles[n2] = handle
+        self.db._record('renameReagent', n1, n2)
         self.db.reagentRenamed(n1, n2)
-        self.sigReagentRenamed.emit(self, n1, n2)
-        self.sigReagentListChanged.emit(self)
+        self.db.reagentDataChanged([n1, n2])
+        _emit(self, 'sigReagentRenamed', self, n1, n2)
+        _emit(self, 'sigReagentListChanged', self)
         
     def setData(self, name, item, value):
+        if item == 'name':
+            self.rename(name, value)
+            return
         ind = self._getIndex(name)
         self._data[ind][item] = value
-        self.sigReagentDataChanged.emit(self)
+        self.db._record('reagent', name, item, value)
+        if item in IONS or item == 'osmconst':
+            self.db.reagentDataChanged([name])
+        _emit(self, 'sigReagentChanged', self, name, item)
+        _emit(self, 'sigReagentDataChanged', self)
 
     def __getitem__(self, name):
-        if name not in self._data['name']:
-            raise NameError("No reagent named '%s'" % name)
-        return Reagent(self, name)
+        try:
+            return self._handles[name]
+        except KeyError:
+            if name not in self._index:
+                raise NameError("No reagent named '%s'" % name)
+            handle = Reagent(self, name)
+            self._handles[name] = handle
+            return handle
     
     def __iter__(self):
         for name in self._data['name']:
             yield self[name]
     
     def getRecArray(self, names):
-        inds = []
-        for n in names:
-            r = np.argwhere(self._data['name'] == n)[:,0]
-            if r.shape[0] == 0:
-                continue
-            inds.append(int(r[0]))
+        """Return a record array containing the named reagents, in the order given.
 
+        Unknown names are silently skipped.
+        """
+        index = self._index
+        inds = [index[n] for n in names if n in index]
         return self._data[inds]
     
     def _getIndex(self, reagent):
-        r = np.argwhere(self._data['name'] == reagent)[:,0]
-        if r.shape[0] == 0:
+        try:
+            return self._index[reagent]
+        except KeyError:
             raise NameError('No reagent named "%s".' % reagent)
-        return r[0]
+
+    def _reindex(self):
+        # Rebuild the name -> row lookup after rows have been added or removed.
+        # If a name is duplicated, the first row wins (matching the old linear search).
+        names = self._data['name']
+        self._index = dict(zip(names[::-1], range(len(names)-1, -1, -1)))
+        self._generation += 1
+        for name in [n for n in self._handles if n not in self._index]:
+            del self._handles[name]
         
 
 class Reagent(object):
+    """Handle to a single reagent in a Reagents table.
+
+    The row index of the reagent is cached and only looked up again after the
+    table has changed shape (see Reagents._generation). Handles are shared;
+    use ``reagents[name]`` rather than creating them directly.
+    """
     def __init__(self, reagents, name):
         self.reagents = reagents
         self.name = name
+        self._row = None
+        self._generation = None
         
     def __setitem__(self, item, val):
         if item == 'name':
@@ -143,8 +278,17 @@ class Reagent(object):
             self.reagents.setData(self.name, item, val)
 
     def __getitem__(self, item):
-        ind = self.reagents._getIndex(self.name)
-        return self.reagents._data[ind][item]
+        return self.reagents._data[item][self.row]
+
+    @property
+    def row(self):
+        """Index of this reagent in the Reagents table.
+        """
+        reagents = self.reagents
+        if self._generation != reagents._generation:
+            self._row = reagents._getIndex(self.name)
+            self._generation = reagents._generation
+        return self._row
 
     @property
     def fields(self):
@@ -152,139 +296,395 @@ class Reagent(object):
         return OrderedDict([(n, dtype[n]) for n in dtype.names])
     
 
-class Solutions(qt.QObject):
+class Solutions(QObject):
     """Collection of grouped Solutions.
+
+    Solutions may be loaded lazily from a storage backend (see setBackend()).
     """
-    solutionListChanged = qt.Signal(object)  # self
-    solutionDataChanged = qt.Signal(object, object)  # self, solution
+    solutionListChanged = Signal(object)  # self
+    solutionDataChanged = Signal(object, object)  # self, solution
     
     def __init__(self, db):
         self.db = db
-        qt.QObject.__init__(self)
+        QObject.__init__(self)
         self._data = []
+        # maps name -> Solution
+        self._byName = {}
+        # maps solution name -> set of Solutions whose compareAgainst refers to it
+        self._referrers = {}
+        # maps reagent name -> set of Solutions that contain it, and
+        # Solution -> the reagent names it was last indexed under
+        self._usage = {}
+        self._usedReagents = {}
+        # cached results of calculate(), keyed by Solution
+        self._calcCache = {}
+        self._cacheHits = 0
+        self._cacheMisses = 0
+        # storage backend for lazy loading; _unloaded maps the names of
+        # solutions that have not been loaded yet to their stored position
+        self._backend = None
+        self._unloaded = OrderedDict()
+        self._storedPosition = {}
+
+    def setBackend(self, backend):
+        """Replace all solutions with those stored in *backend*, loading each
+        solution only when it is first accessed.
+
+        *backend* must provide solutionNames(), loadSolution(name) and
+        loadSolutions(names), returning solution states as used by restore()
+        (see sqlstore.SQLiteStore). Accessing a single solution by name loads
+        only that solution; iterating, saving or renaming loads all of them.
+        """
+        self._data = []
+        self._byName = {}
+        self._referrers = {}
+        self._usage = {}
+        self._usedReagents = {}
+        self._calcCache.clear()
+        self.db._modified()
+        self._backend = backend
+        self._unloaded = OrderedDict((name, i) for i, name in enumerate(backend.solutionNames()))
+        self._storedPosition = {}
+        _emit(self, 'solutionListChanged', self)
+
+    def _load(self, state):
+        # add a solution that was read from the backend
+        sol = Solution(db=self.db)
+        sol.restore(state)
+        self._storedPosition[sol] = self._unloaded.pop(sol.name)
+        self._insert(sol)
+        return sol
+
+    def _insert(self, soln):
+        self._data.append(soln)
+        self._byName[soln.name] = soln
+        soln._setSolutionList(self)
+        self.compareAgainstChanged(soln, None, soln.compareAgainst)
+        self._updateUsage(soln)
+
+    def _updateUsage(self, soln, remove=False):
+        # bring the reagent -> solutions index up to date for one solution
+        old = self._usedReagents.pop(soln, set())
+        new = set() if remove else set(soln._reagents)
+        for name in old - new:
+            users = self._usage[name]
+            users.discard(soln)
+            if len(users) == 0:
+                del self._usage[name]
+        for name in new - old:
+            self._usage.setdefault(name, set()).add(soln)
+        if not remove:
+            self._usedReagents[soln] = new
+
+    def whereUsed(self, reagent):
+        """Return the list of solutions that contain *reagent*, sorted by name.
+
+        Solutions that have not been loaded from a storage backend yet are
+        included if the backend supports solutionsUsing(reagent).
+        """
+        if len(self._unloaded) > 0 and hasattr(self._backend, 'solutionsUsing'):
+            for name in self._backend.solutionsUsing(reagent):
+                if name in self._unloaded:
+                    self[name]
+        return sorted(self._usage.get(reagent, ()), key=lambda soln: soln.name)
+
+    def _loadAll(self):
+        # load all remaining solutions from the backend, in their stored order
+        if len(self._unloaded) == 0:
+            return
+        for state in self._backend.loadSolutions(list(self._unloaded)):
+            self._load(state)
+        n = len(self._storedPosition)
+        order = [self._storedPosition.get(sol, n + i) for i, sol in enumerate(self._data)]
+        self._data = [self._data[i] for i in sorted(range(len(order)), key=order.__getitem__)]
+        self._backend = None
+        self._storedPosition = {}
+
+    def names(self):
+        """Return the names of all solutions, including those not loaded yet.
+        """
+        return [soln.name for soln in self._data] + list(self._unloaded)
 
     def add(self, soln=None, name=None, group=None, signal=True):
         if soln is None:
             soln = Solution(name=name, group=group, db=self.db)
         else:
             soln.db = self.db
-        for s in self._data:
-            if s.name == soln.name:
-                raise NameError('Cannot add solution "%s"; another solution with this name already exists.' % soln.name)
-        self._data.append(soln)
-        soln._setSolutionList(self)
-        soln.sigRenamed.connect(self.solutionRenamed)
+        if self.hasName(soln.name):
+            raise NameError('Cannot add solution "%s"; another solution with this name already exists.' % soln.name)
+        self._insert(soln)
+        self.db._modified()
         if signal:
-            self.solutionListChanged.emit(self)
+            _emit(self, 'solutionListChanged', self)
     
+    def hasName(self, name):
+        """Return True if a solution with this name exists (loaded or not).
+        """
+        return name in self._byName or name in self._unloaded
+
     def solutionRenamed(self, soln, old):
+        # called by soln.setName()
         new = soln.name
-        for soln in self._data:
-            if soln.compareAgainst == old:
-                soln.compareAgainst = new
-        self.solutionListChanged.emit(self)
+        del self._byName[old]
+        self._byName[new] = soln
+        # unloaded solutions may also refer to the old name
+        self._loadAll()
+        for ref in list(self._referrers.get(old, ())):
+            ref.compareAgainst = new
+        _emit(self, 'solutionListChanged', self)
+
+    def compareAgainstChanged(self, soln, old, new):
+        # called when soln.compareAgainst is set; keeps the reverse index current
+        if old is not None:
+            refs = self._referrers.get(old)
+            if refs is not None:
+                refs.discard(soln)
+                if len(refs) == 0:
+                    del self._referrers[old]
+        if new is not None:
+            self._referrers.setdefault(new, set()).add(soln)
+
+    def referrers(self, name):
+        """Return the list of (loaded) solutions whose compareAgainst is *name*.
+        """
+        return list(self._referrers.get(name, ()))
     
     def remove(self, soln):
         self._data.remove(soln)
-        self.solutionListChanged.emit(self)
+        del self._byName[soln.name]
+        self.compareAgainstChanged(soln, soln.compareAgainst, None)
+        self._updateUsage(soln, remove=True)
+        soln._solutionList = None
+        self._calcCache.pop(soln, None)
+        self.db._modified()
+        _emit(self, 'solutionListChanged', self)
     
     def __getitem__(self, name):
-        for sol in self._data:
-            if sol.name == name:
-                return sol
+        sol = self._byName.get(name)
+        if sol is not None:
+            return sol
+        if name in self._unloaded:
+            return self._load(self._backend.loadSolution(name))
         raise KeyError(name)
 
     def __iter__(self):
+        self._loadAll()
         for soln in self._data:
             yield soln
     
     def restore(self, data):
-        self._data = []
+        solutions = []
         for d in data:
             sol = Solution(db=self.db)
             sol.restore(d)
+            solutions.append(sol)
+        self.replace(solutions)
+
+    def replace(self, solutions):
+        """Replace all solutions with new Solution objects (see restore()).
+        """
+        self._data = []
+        self._byName = {}
+        self._referrers = {}
+        self._usage = {}
+        self._usedReagents = {}
+        self._calcCache.clear()
+        self._backend = None
+        self._unloaded = OrderedDict()
+        self._storedPosition = {}
+        self.db._modified()
+        for sol in solutions:
             self.add(sol, signal=False)
-            #self._data.append(sol)
-        self.solutionListChanged.emit(self)
+        _emit(self, 'solutionListChanged', self)
+
+    def restoreSolution(self, state, signal=True):
+        """Create a new Solution from its saved *state* and add it to the list.
+        """
+        sol = Solution(db=self.db)
+        sol.restore(state)
+        self.add(sol, signal=signal)
+        return sol
     
     def save(self):
+        self._loadAll()
         state = []
         for sol in self._data:
             state.append(sol.save())
         return state
 
+    def calculate(self, solutions):
+        """Return estimated ion concentrations and osmolarity for many solutions.
+
+        Returns a (solutions x IONS) array of ion concentrations and an array
+        of osmolarities, computed together from the composition matrix.
+
+        Results for solutions in this list are cached until the solution, or
+        the properties of a reagent it uses, are changed. See cacheStats().
+        """
+        solutions = list(solutions)
+        cache = self._calcCache
+        missing = OrderedDict()
+        for soln in solutions:
+            if soln not in cache:
+                missing[soln] = None
+
+        computed = {}
+        if len(missing) > 0:
+            reagents = self.db.reagents
+            conc = composition.ConcentrationMatrix(list(missing), reagents._index, len(reagents._data))
+            result = conc.dot(reagents.dissociationMatrix())
+            for soln, row in zip(missing, result):
+                computed[soln] = row
+                # only cache solutions that will tell us when they change
+                if soln._solutionList is not None and soln._solutionList() is self:
+                    cache[soln] = row
+        self._cacheMisses += len(missing)
+        self._cacheHits += len(solutions) - len(missing)
+
+        result = np.array([computed[s] if s in computed else cache[s] for s in solutions])
+        result = result.reshape(len(solutions), len(IONS) + 1)
+        return result[:, :-1], result[:, -1]
+
+    def cacheStats(self, reset=False):
+        """Return a dict with the number of hits and misses of the calculate()
+        cache, and the number of cached solutions.
+
+        If *reset* is True, the hit and miss counters are set back to zero.
+        """
+        stats = {'hits': self._cacheHits, 'misses': self._cacheMisses, 'size': len(self._calcCache)}
+        if reset:
+            self._cacheHits = 0
+            self._cacheMisses = 0
+        return stats
+
+    def solutionChanged(self, soln):
+        # the composition of soln has changed; forget cached results
+        self._calcCache.pop(soln, None)
+        self._updateUsage(soln)
+
+    def reagentDataChanged(self, names):
+        # Properties of the named reagents have changed (or all reagents, if
+        # names is None); forget cached results for solutions that use them.
+        if names is None:
+            self._calcCache.clear()
+            return
+        for name in names:
+            for soln in self._usage.get(name, ()):
+                self._calcCache.pop(soln, None)
+
     def recalculate(self, solutions, temperature):
         """Return estimated ion concentrations, osmolarity, and reversal potentials."""
-        results = {}
-        for soln in solutions:
-            ions, osm = soln.recalculate()
+        solutions = list(solutions)
+        against = [self[soln.compareAgainst] for soln in solutions if soln.compareAgainst is not None]
+        ions, osm = self.calculate(solutions + against)
+
+        # reversal potentials for all solutions that have a comparison solution
+        compared = [i for i, soln in enumerate(solutions) if soln.compareAgainst is not None]
+        revs = np.empty((len(solutions), len(IONS)))
+        noIons = np.zeros((len(solutions), len(IONS)), dtype=bool)
+        if len(compared) > 0:
+            own = ions[compared]
+            other = ions[len(solutions):]
+            isExternal = np.array([solutions[i].type == 'external' for i in compared])[:, None]
+            external = np.where(isExternal, own, other)
+            internal = np.where(isExternal, other, own)
+            valence = np.array(list(IONS.values()))
+            revs[compared] = composition.reversalPotentials(internal, external, valence, temperature)
+            noIons[compared] = (internal == 0) & (external == 0)
 
+        results = {}
+        for i, soln in enumerate(solutions):
+            ionConcs = dict(zip(IONS, ions[i]))
             if soln.compareAgainst is None:
-                revs = {ion: None for ion in IONS}
+                solnRevs = {ion: None for ion in IONS}
             else:
-                against = self[soln.compareAgainst].recalculate()[0]
-                if soln.type == 'external':
-                    external = ions
-                    internal = against
-                else:
-                    external = against
-                    internal = ions
-                R = 8.31446
-                T = temperature + 273.15
-                F = 96485.333
-                revs = {}
-                for ion, z in IONS.items():
-                    if internal[ion] == 0 and external[ion] == 0:
-                        revs[ion] = None
-                    else:
-                        revs[ion] = 1000 * ((R * T) / (z * F)) * np.log((external[ion]+1e-6) / (internal[ion]+1e-6))
-        
-            results[soln.name] = [ions, osm, revs]
+                solnRevs = {ion: None if noIons[i, j] else revs[i, j] for j, ion in enumerate(IONS)}
+            results[soln.name] = [ionConcs, osm[i], solnRevs]
             
         return results
 
+    def reversalMatrix(self, internal=None, external=None, temperature=25.0):
+        """Return reversal potentials for every pair of internal and external solutions.
+
+        By default, all solutions of type 'internal' are compared against all
+        solutions of type 'external'. Returns (internal, external, revs), where
+        revs is an (internal x external x IONS) array in mV, with nan for ions
+        that are absent from both solutions.
+        """
+        if internal is None or external is None:
+            solutions = list(self)
+            if internal is None:
+                internal = [soln for soln in solutions if soln.type == 'internal']
+            if external is None:
+                external = [soln for soln in solutions if soln.type != 'internal']
+        internal = list(internal)
+        external = list(external)
+        ions, osm = self.calculate(internal + external)
+        inside = ions[:len(internal), None, :]
+        outside = ions[len(internal):][None, :, :]
+        valence = np.array(list(IONS.values()))
+        revs = composition.reversalPotentials(inside, outside, valence, temperature)
+        revs[(inside == 0) & (outside == 0)] = np.nan
+        return internal, external, revs
+
     def reagentRenamed(self, old, new):
-        for sol in self._data:
+        for sol in self.whereUsed(old):
             sol.reagentRenamed(old, new)
+            self._updateUsage(sol)
 
 
-class Solution(qt.QObject):
+class Solution(QObject):
     """Defines the list of reagents and their concentrations in a solution.
     """
-    sigSolutionChanged = qt.Signal(object)  # self
-    sigRenamed = qt.Signal(object, object)  # self, old_name
+    sigSolutionChanged = Signal(object)  # self
+    sigRenamed = Signal(object, object)  # self, old_name
     
     def __init__(self, name=None, group=None, against=None, db=None):
-        qt.QObject.__init__(self)
+        QObject.__init__(self)
         self.db = db
+        self._solutionList = None
         self._name = name
         self.group = group
         self.notes = ''
         self.type = 'internal' if group is not None and 'internal' in group.lower() else 'external'
-        self.compareAgainst = against
+        self._compareAgainst = against
         self._reagents = {}
         
         # empirically determined values:
         self.ionConcentrations = {}
         self.osmolarity = None
         
-        self._solutionList = None
-        
     @property
     def name(self):
         return self._name
+
+    @property
+    def compareAgainst(self):
+        """Name of the solution used to calculate reversal potentials.
+        """
+        return self._compareAgainst
+
+    @compareAgainst.setter
+    def compareAgainst(self, name):
+        old = self._compareAgainst
+        self._compareAgainst = name
+        sl = self._getSolutionList()
+        if sl is not None and name != old:
+            sl.compareAgainstChanged(self, old, name)
     
     def setName(self, name):
         old = self._name
         if name == old:
             return
-        if self._solutionList is not None:
-            sl = self._solutionList()
-            for s in sl:
-                if s.name == name:
-                    raise NameError('Cannot rename to "%s"; another solution with this name already exists.' % name)
+        sl = self._getSolutionList()
+        if sl is not None:
+            if sl.hasName(name):
+                raise NameError('Cannot rename to "%s"; another solution with this name already exists.' % name)
         self._name = name
-        self.sigRenamed.emit(self, old)
+        if sl is not None:
+            self._record('renameSolution', old, name)
+            sl.solutionRenamed(self, old)
+        _emit(self, 'sigRenamed', self, old)
         
     def __setitem__(self, name, concentration):
         """Set the concentration of a particular reagent.
@@ -293,7 +693,8 @@ class Solution(qt.QObject):
             self._reagents.pop(name, None)
         else:
             self._reagents[name] = concentration
-        self.sigSolutionChanged.emit(self)
+        self._record('concentration', self.name, name, concentration)
+        self._changed()
         
     def __getitem__(self, name):
         """Return the concentration of a reagent, or None if the solution does
@@ -301,6 +702,17 @@ class Solution(qt.QObject):
         """
         return self._reagents.get(name, None)
     
+    def setField(self, field, value):
+        """Set the group, type, compareAgainst or notes of this solution.
+
+        Unlike setting the attribute directly, this change is recorded in
+        the database journal.
+        """
+        if field not in ('group', 'type', 'compareAgainst', 'notes'):
+            raise AttributeError("Solution has no field '%s'" % field)
+        setattr(self, field, value)
+        self._record('solution', self.name, field, value)
+
     def reagentList(self):
         return list(self._reagents.keys())
     
@@ -331,27 +743,36 @@ class Solution(qt.QObject):
         self.compareAgainst = state['compareAgainst']
         self.notes = state['notes']
         self.setName(state['name'])
-        self.sigSolutionChanged.emit(self)
+        if self._solutionList is not None and self.db is not None:
+            self.db._modified()
+        self._changed()
+
+    def _changed(self):
+        # let the solution list drop any cached calculations before views are updated
+        if self._solutionList is not None:
+            sl = self._solutionList()
+            if sl is not None:
+                sl.solutionChanged(self)
+        _emit(self, 'sigSolutionChanged', self)
 
     def recalculate(self):
         """Calculate ion concentrations and osmolarity.
         """
-        reagents = self.db.reagents
-        allReagents = reagents.names()
-        knownReagents = [r for r in self._reagents.keys() if r in allReagents]
-        reagents = reagents.getRecArray(knownReagents)
-        concs = np.array([self._reagents[n] for n in reagents['name']])
-        ions = {}
-        for ion in IONS:
-            ions[ion] = np.sum(reagents[ion] * concs)
-        
-        osm = np.sum(concs * reagents['osmconst'])
-        return ions, osm
+        ions, osm = self.db.solutions.calculate([self])
+        return dict(zip(IONS, ions[0])), osm[0]
 
     def _setSolutionList(self, sl):
         # Just allows solution to ensure that its name is unique when renamed
         self._solutionList = weakref.ref(sl)
 
+    def _getSolutionList(self):
+        return None if self._solutionList is None else self._solutionList()
+
+    def _record(self, *rec):
+        # journal an edit, if this solution belongs to a database
+        if self._solutionList is not None and self.db is not None:
+            self.db._record(*rec)
+
     def reagentRenamed(self, old, new):
         changed = False
         if old in self._reagents:
@@ -362,41 +783,64 @@ class Solution(qt.QObject):
             #self.sigSolutionChanged.emit(self)
 
 
-def _saveArray(data):
-    return [_recToDict(rec) for rec in data]
-    
-def _recToDict(rec):
-    od = OrderedDict()
-    for field in rec.dtype.names:
-        if rec.dtype.fields[field][0].names is None:
-            od[field] = rec[field]
+def _saveArray(data, columnar=False):
+    """Convert a structured array to a list of dicts (one per record), or to a
+    dict of lists (one per field) if *columnar* is True.
+    """
+    columns = _saveColumns(data)
+    if columnar:
+        return columns
+    return _columnsToRecords(columns, len(data))
+
+def _saveColumns(data):
+    columns = OrderedDict()
+    for field in data.dtype.names:
+        if data.dtype.fields[field][0].names is None:
+            columns[field] = data[field].tolist()
         else:
-            od[field] = _recToDict(rec[field])
-    return od
+            columns[field] = _saveColumns(data[field])
+    return columns
+
+def _columnsToRecords(columns, n):
+    names = list(columns.keys())
+    values = [v if isinstance(v, list) else _columnsToRecords(v, n) for v in columns.values()]
+    return [dict(zip(names, row)) for row in zip(*values)]
     
 
 def _loadArray(data, dtype):
-    arr = np.empty(len(data), dtype=dtype)
-    for i,rec in enumerate(data):
-        _loadRec(arr[i], rec)
+    """Convert a list of dicts, or a dict of lists as generated by
+    _saveArray(columnar=True), to a structured array.
+    """
+    if isinstance(data, dict):
+        fields = list(data.values())
+        n = len(fields[0]) if len(fields) > 0 else 0
+    else:
+        n = len(data)
+    arr = np.empty(n, dtype=dtype)
+    _loadColumns(arr, data)
     return arr
         
-def _loadRec(arr, rec):
+def _loadColumns(arr, data):
     for field in arr.dtype.names:
+        if isinstance(data, dict):
+            column = data[field]
+        else:
+            column = list(map(operator.itemgetter(field), data))
         if arr.dtype.fields[field][0].names is None:
-            arr[field] = rec[field]
+            arr[field] = column
         else:
-            _loadRec(arr[field], rec[field])
+            _loadColumns(arr[field], column)
         
 
-class Recipe(qt.QObject):
+class Recipe(QObject):
     """Defines a list of volumes for which reagent masses should be calculated
     for a particular solution.
     """
-    sigChanged = qt.Signal(object)  # self
+    sigChanged = Signal(object)  # self
+    sigVolumesChanged = Signal(object)  # self
     
     def __init__(self, solution=None, volumes=None, notes=None, db=None):
-        qt.QObject.__init__(self)
+        QObject.__init__(self)
         self.db = db
         self._solution = None
         self.volumes = [] if volumes is None else volumes
@@ -409,6 +853,8 @@ class Recipe(qt.QObject):
         return self._solution
 
     def setSolution(self, sol):
+        if self.db is not None:
+            self.db._modified()
         if self._solution is not None:
             self._solution.sigSolutionChanged.disconnect(self.solutionChanged)
         self._solution = sol
@@ -416,7 +862,35 @@ class Recipe(qt.QObject):
         self.solutionChanged()
         
     def solutionChanged(self):
-        self.sigChanged.emit(self)
+        _emit(self, 'sigChanged', self)
+
+    def setVolumes(self, volumes):
+        """Set the list of volumes to make, recording the change in the
+        database journal.
+        """
+        self.volumes = list(volumes)
+        self._record('volumes', self.volumes)
+        _emit(self, 'sigVolumesChanged', self)
+
+    def setNotes(self, notes):
+        self.notes = notes
+        self._record('recipeNotes', notes)
+
+    def _record(self, op, value):
+        # journal an edit, if this recipe belongs to a database. A recipe may
+        # be listed in several recipe sets (or several times in one), and
+        # each listing is restored as a separate Recipe, so each gets a record.
+        if self.db is None:
+            return
+        found = False
+        for i, rset in enumerate(self.db.recipes):
+            for j, recipe in enumerate(rset._recipes):
+                if recipe is self:
+                    self.db._record(op, i, j, value)
+                    found = True
+        if not found:
+            # not reachable from the recipe book; the edit cannot be journaled
+            self.db._modified()
 
     def save(self):
         return {'solution': self.solution.name, 'volumes': self.volumes, 'notes': self.notes}
@@ -427,23 +901,26 @@ class Recipe(qt.QObject):
         self.setSolution(self.db.solutions[state['solution']])
 
     def copy(self):
-        r = Recipe()
+        r = Recipe(db=self.db)
         r.volumes = self.volumes[:]
         r.notes = self.notes
         r.setSolution(self._solution)
         return r
 
 
-class RecipeSet(qt.QObject):
+class RecipeSet(QObject):
     """Multiple Recipes meant to be displayed together.
     """
-    sigRecipeListChanged = qt.Signal(object)  # self
+    sigRecipeListChanged = Signal(object)  # self
+    sigStocksChanged = Signal(object)  # self
     
     def __init__(self, name=None, recipes=None, order=None, stocks=None, db=None):
-        qt.QObject.__init__(self)
+        QObject.__init__(self)
         self.db = db
         self.name = name
         self._recipes = [] if recipes is None else recipes
+        for r in self._recipes:
+            r.db = db
         self.reagentOrder = [] if order is None else order
         # concentrations of stock solutions per reagent
         self.stocks = {} if stocks is None else stocks  
@@ -451,12 +928,44 @@ class RecipeSet(qt.QObject):
         self.showConcentration = False
 
     def add(self, r):
+        r.db = self.db
         self._recipes.append(r)
-        self.sigRecipeListChanged.emit(self)
+        self._modified()
+        _emit(self, 'sigRecipeListChanged', self)
         
     def remove(self, r):
         self._recipes.remove(r)
-        self.sigRecipeListChanged.emit(self)
+        self._modified()
+        _emit(self, 'sigRecipeListChanged', self)
+
+    def setField(self, field, value):
+        """Set the name, showMW or showConcentration of this recipe set,
+        recording the change in the database journal.
+        """
+        if field not in ('name', 'showMW', 'showConcentration'):
+            raise AttributeError("RecipeSet has no field '%s'" % field)
+        setattr(self, field, value)
+        self._record('recipeSet', field, value)
+
+    def setStock(self, reagent, conc):
+        """Set the stock concentration of a reagent (None to remove it).
+        """
+        if conc is None:
+            self.stocks.pop(reagent, None)
+        else:
+            self.stocks[reagent] = conc
+        self._record('stock', reagent, conc)
+        self._usageChanged()
+        _emit(self, 'sigStocksChanged', self)
+
+    def _record(self, op, *args):
+        # journal an edit, if this recipe set belongs to a database
+        if self.db is not None and self in self.db.recipes._recipeSets:
+            self.db._record(op, self.db.recipes._recipeSets.index(self), *args)
+
+    def _modified(self):
+        if self.db is not None:
+            self.db._modified()
 
     def __iter__(self):
         for r in self._recipes:
@@ -481,7 +990,9 @@ class RecipeSet(qt.QObject):
             r = Recipe(db=self.db)
             r.restore(rstate)
             self._recipes.append(r)
-        self.sigRecipeListChanged.emit(self)
+        self._modified()
+        self._usageChanged()
+        _emit(self, 'sigRecipeListChanged', self)
 
     def copy(self, name):
         rs = RecipeSet(db=self.db)
@@ -498,102 +1009,396 @@ class RecipeSet(qt.QObject):
             self.stocks[new] = self.stocks[old]
             del self.stocks[old]
             changed = True
+        self._usageChanged()
+
+    def reagentNames(self):
+        """Return the set of reagent names this recipe set refers to directly
+        (in its reagent order or stock concentrations).
+        """
+        return set(self.reagentOrder) | set(self.stocks)
+
+    def amounts(self, reagents=None):
+        """Return the amount of each reagent needed to make every volume of
+        every recipe in this set.
+
+        Returns (reagents, columns, amounts), where *columns* is a list of
+        (recipe index, volume index) and *amounts* is a (reagents x columns)
+        array of masses (mg), or stock volumes (ml) for reagents listed in
+        ``stocks``; nan where a recipe does not use a reagent. By default,
+        *reagents* are all reagents used by the recipes that appear in the
+        reagent table, in table order.
+        """
+        index = self.db.reagents._index
+        if reagents is None:
+            used = set()
+            for recipe in self._recipes:
+                used.update(recipe.solution._reagents)
+            reagents = sorted([name for name in used if name in index], key=index.get)
+        rows = dict((name, k) for k, name in enumerate(reagents))
 
+        conc = np.full((len(reagents), len(self._recipes)), np.nan)
+        columns = []
+        volumes = []
+        for i, recipe in enumerate(self._recipes):
+            for name, c in recipe.solution._reagents.items():
+                k = rows.get(name)
+                if k is not None:
+                    conc[k, i] = c
+            columns.extend((i, j) for j in range(len(recipe.volumes)))
+            volumes.extend(recipe.volumes)
 
-class RecipeBook(qt.QObject):
+        molweights = self.db.reagents._data['molweight'][[index[name] for name in reagents]]
+        stocks = [self.stocks.get(name, np.nan) for name in reagents]
+        recipeIndex = np.array([i for i, j in columns], dtype=int)
+        amounts = composition.recipeAmounts(conc[:, recipeIndex], volumes, molweights, stocks)
+        return reagents, columns, amounts
+
+    def _usageChanged(self):
+        if self.db is not None:
+            self.db.recipes._updateUsage(self)
+
+
+class RecipeBook(QObject):
     """A simple collection of RecipeSets.
     """
-    sigRecipeSetListChanged = qt.Signal(object)  # self
+    sigRecipeSetListChanged = Signal(object)  # self
     
     def __init__(self, db=None):
-        qt.QObject.__init__(self)
+        QObject.__init__(self)
         self.db = db
         self._recipeSets = []
+        # storage backend for lazy loading (see setBackend())
+        self._backend = None
+        # maps reagent name -> set of RecipeSets that refer to it, and
+        # RecipeSet -> the reagent names it was last indexed under
+        self._usage = {}
+        self._usedReagents = {}
+
+    def setBackend(self, backend):
+        """Replace all recipe sets with those stored in *backend*, which are
+        loaded when the recipe book is first accessed.
+
+        *backend* must provide loadRecipeSets() (see sqlstore.SQLiteStore).
+        """
+        self._recipeSets = []
+        self._usage = {}
+        self._usedReagents = {}
+        self._backend = backend
+        self.db._modified()
+        _emit(self, 'sigRecipeSetListChanged', self)
+
+    def _loadAll(self):
+        if self._backend is None:
+            return
+        backend = self._backend
+        self._backend = None
+        for s in backend.loadRecipeSets():
+            rs = RecipeSet(db=self.db)
+            rs.restore(s)
+            self._recipeSets.append(rs)
+            self._updateUsage(rs)
+
+    def _updateUsage(self, rs, remove=False):
+        # bring the reagent -> recipe sets index up to date for one recipe set
+        if not remove and rs not in self._recipeSets:
+            return
+        old = self._usedReagents.pop(rs, set())
+        new = set() if remove else rs.reagentNames()
+        for name in old - new:
+            users = self._usage[name]
+            users.discard(rs)
+            if len(users) == 0:
+                del self._usage[name]
+        for name in new - old:
+            self._usage.setdefault(name, set()).add(rs)
+        if not remove:
+            self._usedReagents[rs] = new
+
+    def whereUsed(self, reagent):
+        """Return the list of recipe sets that refer to *reagent* directly
+        (see RecipeSet.reagentNames()).
+        """
+        self._loadAll()
+        users = self._usage.get(reagent, ())
+        return [rs for rs in self._recipeSets if rs in users]
 
     def save(self):
+        self._loadAll()
         return [r.save() for r in self._recipeSets]
 
     def add(self, rs):
+        self._loadAll()
         self._recipeSets.append(rs)
         rs.db = self.db
-        self.sigRecipeSetListChanged.emit(self)
+        for r in rs:
+            r.db = self.db
+        self._updateUsage(rs)
+        self.db._modified()
+        _emit(self, 'sigRecipeSetListChanged', self)
 
     def remove(self, rs):
+        self._loadAll()
         self._recipeSets.remove(rs)
-        self.sigRecipeSetListChanged.emit(self)
+        self._updateUsage(rs, remove=True)
+        self.db._modified()
+        _emit(self, 'sigRecipeSetListChanged', self)
 
     def restore(self, state):
         self._recipeSets = []
+        self._usage = {}
+        self._usedReagents = {}
+        self._backend = None
         for s in state:
             rs = RecipeSet(db=self.db)
             rs.restore(s)
             self._recipeSets.append(rs)
-        self.sigRecipeSetListChanged.emit(self)
+            self._updateUsage(rs)
+        self.db._modified()
+        _emit(self, 'sigRecipeSetListChanged', self)
 
     def __getitem__(self, i):
+        self._loadAll()
         return self._recipeSets[i]
 
     def __len__(self):
+        self._loadAll()
         return len(self._recipeSets)
 
     def __iter__(self):
+        self._loadAll()
         for rs in self._recipeSets:
             yield rs
 
     def reagentRenamed(self, old, new):
-        for rset in self._recipeSets:
+        for rset in self.whereUsed(old):
             rset.reagentRenamed(old, new)
 
+    def plan(self, orders):
+        """Return the total reagent amounts needed to fill a list of
+        (recipeSet, recipe, volume, count) orders, as a
+        production.ProductionPlan.
+
+        Each order uses the stock concentrations of its recipe set.
+        """
+        return ProductionPlan(self.db.reagents, orders)
+
 
-class SolutionDatabase(qt.QObject):
+class SolutionDatabase(QObject):
     def __init__(self):
-        qt.QObject.__init__(self)
+        QObject.__init__(self)
         self.reagents = Reagents(db=self)
         self.solutions = Solutions(db=self)
         self.recipes = RecipeBook(db=self)
+        self._batchDepth = 0
+        self._pendingSignals = OrderedDict()
+        # edits made since the file was last loaded or saved (see journal.py)
+        self._journal = None
+
+    @contextlib.contextmanager
+    def batch(self):
+        """Context manager that defers all signals emitted by objects in this
+        database until the block exits.
+
+        Repeated signals are coalesced so that each object emits each signal at
+        most once, in the order the signals were first emitted. This avoids
+        rebuilding views after every individual change in scripted edits::
+
+            with db.batch():
+                for soln in db.solutions:
+                    soln['glucose'] = 10
+
+        Batches may be nested; signals are delivered when the outermost batch exits.
+        """
+        self._batchDepth += 1
+        try:
+            yield self
+        finally:
+            self._batchDepth -= 1
+            if self._batchDepth == 0:
+                self._flushSignals()
+
+    def _deferSignal(self, obj, signal, args):
+        if signal == 'sigReagentRenamed':
+            # chain successive renames of one reagent into a single old -> new rename
+            _, old, new = args
+            prev = self._pendingSignals.pop((id(obj), signal, old), None)
+            if prev is not None:
+                old = prev[2][1]
+            if old != new:
+                self._pendingSignals[(id(obj), signal, new)] = (obj, signal, (obj, old, new))
+            return
+        key = (id(obj), signal)
+        if signal == 'sigReagentChanged':
+            # one signal per changed reagent field
+            key = key + args[1:]
+        if signal == 'sigRenamed' and key in self._pendingSignals:
+            # report the name the solution had before the batch
+            args = self._pendingSignals[key][2]
+        self._pendingSignals[key] = (obj, signal, args)
+
+    def _flushSignals(self):
+        pending = self._pendingSignals
+        self._pendingSignals = OrderedDict()
+        for obj, signal, args in pending.values():
+            getattr(obj, signal).emit(*args)
         
-    def save(self):
+    def save(self, columnar=False):
+        """Return the state of the database as JSON-serializable objects.
+
+        If *columnar* is True, the reagent table is stored as one list per
+        field rather than one dict per reagent, which is more compact and
+        faster to load.
+        """
         return {
-            'reagents': self.reagents.save(),
+            'reagents': self.reagents.save(columnar=columnar),
             'solutions': self.solutions.save(),
             'recipes': self.recipes.save(),
         }
         
     def restore(self, state):
-        self.reagents.restore(state['reagents'])
-        self.solutions.restore(state['solutions'])
-        self.recipes.restore(state['recipes'])
+        with self.batch():
+            self.reagents.restore(state['reagents'])
+            self.solutions.restore(state['solutions'])
+            self.recipes.restore(state['recipes'])
 
-    def saveFile(self, filename):
+    def saveFile(self, filename, columnar=False, journal=False):
         """Save the state of this database to a JSON-formatted file.
+
+        See save() for the meaning of *columnar*.
+
+        If *journal* is True and the database was last loaded from or saved to
+        the same file, edits made since then are appended to a journal file
+        next to it (``filename + '.journal'``) instead of rewriting the whole
+        database. A complete snapshot is still written when the journal
+        becomes too long, or when the changes cannot be journaled (see
+        journal.py). Saving with *journal* False always writes a complete
+        snapshot and removes the journal.
         """
-        fh, tmpfile = tempfile.mkstemp()
+        if journal and self._journal is not None and not self._journal.needsSnapshot(filename):
+            self._journal.flush()
+            return
+
+        # write to a temporary file in the same directory, then move it into
+        # place so that a failed save never leaves a truncated database
+        fd, tmpfile = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(filename)))
         try:
-            try:
-                os.close(fh)
-                fh = open(tmpfile, 'wb')
-                # temporarily override json float encoder
-                try:
-                    orig = json.encoder.FLOAT_REPR
-                    json.encoder.FLOAT_REPR = lambda o: format(np.round(o, 12), '.12g')
-                    json.dump(self.save(), fh, indent=2)
-                finally:
-                    json.encoder.FLOAT_REPR = orig
-            finally:
-                fh.close()
-            os.rename(tmpfile, filename)
-        except Exception as exc:
-            qt.QMessageBox.warning(None, "ERROR", "File save failed: " + exc.message)
+            with os.fdopen(fd, 'w', encoding='ascii', newline='\n') as fh:
+                jsonio.dump(self.save(columnar=columnar), fh, indent=2)
+            os.replace(tmpfile, filename)
+        except Exception:
             if os.path.isfile(tmpfile):
                 os.remove(tmpfile)
             raise
+        # the snapshot now contains all journaled edits
+        self._journal = Journal(filename)
+        self._journal.remove()
 
-    def loadFile(self, filename):
+    def _record(self, *rec):
+        # called by model objects to journal an individual edit
+        if self._journal is not None:
+            self._journal.record(rec)
+
+    def _modified(self):
+        # called by model objects after a change that cannot be journaled
+        if self._journal is not None:
+            self._journal.invalidate()
+
+    def loadFile(self, filename, progress=None):
         """Restore the database state from a JSON-formatted file.
+
+        The file is parsed incrementally: reagent records are collected
+        directly into columns and each solution is built as soon as it is
+        read, so the complete JSON object tree is never held in memory.
+        The database is only modified once the whole file has been parsed;
+        if parsing fails, it is left unchanged. If *progress* is given, it is
+        called with the fraction of the file read so far.
+
+        Any journal saved with ``saveFile(filename, journal=True)`` is
+        replayed after the file is loaded.
         """
-        state = json.load(open(filename, 'rb'))
-        self.restore(state)
+        reagents = None
+        solutions = []
+        recipes = []
+        with open(filename, 'rb') as fh:
+            for key, index, value in jsonio.iterload(fh, progress=progress):
+                if key == 'reagents':
+                    if index is None:
+                        # columnar reagent table
+                        reagents = value
+                    else:
+                        if reagents is None:
+                            reagents = OrderedDict([(field, []) for field, typ in self.reagents._dtype])
+                        for field, column in reagents.items():
+                            column.append(value[field])
+                elif key == 'solutions':
+                    sol = Solution(db=self)
+                    sol.restore(value)
+                    solutions.append(sol)
+                elif key == 'recipes':
+                    # recipe sets refer to solutions, which may appear later in the file
+                    recipes.append(value)
+
+        # the whole file has been read; replace the contents of the database
+        self._journal = None
+        with self.batch():
+            self.solutions.replace(solutions)
+            self.reagents.restore([] if reagents is None else reagents)
+            self.recipes.restore(recipes)
+            records, end = readJournal(filename)
+            for rec in records:
+                applyRecord(self, rec)
+        self._journal = Journal(filename)
+        if end > 0:
+            # keep appending to the existing journal
+            self._journal.size = len(records)
+            self._journal.end = end
+            self._journal.fresh = False
         
+    def saveSQLite(self, filename):
+        """Save the state of this database to an SQLite file (see sqlstore.py).
+        """
+        state = self.save(columnar=True)
+        store = SQLiteStore(filename)
+        try:
+            store.save(state)
+        finally:
+            store.close()
+
+    def openSQLite(self, filename, lazy=True):
+        """Load the database from an SQLite file (see sqlstore.py).
+
+        The reagent table is loaded immediately. If *lazy* is True, solutions
+        and recipe sets are read from the file only when they are accessed,
+        and the file stays open until then.
+        """
+        store = SQLiteStore(filename)
+        self._journal = None
+        if not lazy:
+            try:
+                self.restore(store.load())
+            finally:
+                store.close()
+            return
+        with self.batch():
+            self.reagents.restore(store.loadReagents())
+            self.solutions.setBackend(store)
+            self.recipes.setBackend(store)
+
+    def saveSnapshot(self, dirname):
+        """Save this database as a binary snapshot directory (see snapshot.py).
+        """
+        snapshot.writeSnapshot(self, dirname)
+
+    def loadSnapshot(self, dirname):
+        """Restore the database state from a binary snapshot directory.
+        """
+        snap = snapshot.openSnapshot(dirname, mmap=False)
+        self._journal = None
+        with self.batch():
+            self.reagents.restore(snap.reagentColumns())
+            self.solutions.restore(snap.solutionStates())
+            self.recipes.restore(snap.meta['recipes'])
+
     def loadDefault(self):
         deffile = os.path.join(os.path.dirname(__file__), 'default.json')
         self.loadFile(deffile)
@@ -601,3 +1406,23 @@ class SolutionDatabase(qt.QObject):
     def reagentRenamed(self, old, new):
         self.solutions.reagentRenamed(old, new)
         self.recipes.reagentRenamed(old, new)
+
+    def whereUsed(self, reagent):
+        """Return the solutions and recipe sets that use *reagent*.
+
+        Returns a dict with keys 'solutions' (solutions that contain the
+        reagent) and 'recipeSets' (recipe sets that refer to the reagent
+        directly, or contain a recipe for one of those solutions).
+        """
+        solutions = self.solutions.whereUsed(reagent)
+        users = set(solutions)
+        direct = set(self.recipes.whereUsed(reagent))
+        recipeSets = [rs for rs in self.recipes if rs in direct or any(r.solution in users for r in rs)]
+        return {'solutions': solutions, 'recipeSets': recipeSets}
+
+    def reagentDataChanged(self, names):
+        """Called when reagents are added, removed, renamed, or have their
+        ion / osmotic constants changed. *names* is None if all reagents
+        may have changed.
+        """
+        self.solutions.reagentDataChanged(names)
@@ -5,6 +5,7 @@ from .reagentEditor import ReagentEditorWidget
 from .solutionEditor import SolutionEditorWidget
 from .recipeEditor import RecipeEditorWidget
 from .constraintEditor import ConstraintEditorWidget
+from .productionPlanner import ProductionPlannerWidget
 
 
 class SolutionEditorWindow(qt.QMainWindow):
@@ -34,7 +35,10 @@ class SolutionEditorWindow(qt.QMainWindow):
         self.recipeEditor = RecipeEditorWidget(self.db)
         self.tabs.addTab(self.recipeEditor, 'Recipes')
         
-        self.constraintEditor = ConstraintEditorWidget()
+        self.productionPlanner = ProductionPlannerWidget(self.db)
+        self.tabs.addTab(self.productionPlanner, 'Production')
+        
+        self.constraintEditor = ConstraintEditorWidget(self.db)
         self.tabs.addTab(self.constraintEditor, 'Constraints')
         self.tabs.setCurrentWidget(self.solutionEditor)
 
@@ -42,6 +46,10 @@ class SolutionEditorWindow(qt.QMainWindow):
         self.fileMenu.addAction('Open', self.loadFile)
         self.fileMenu.addAction('Save', self.save)
         self.fileMenu.addAction('Save As', self.saveAs)
+        self.fileMenu.addSeparator()
+        # append edits to a journal file rather than rewriting the database on every save
+        self.journalAction = self.fileMenu.addAction('Journaled save')
+        self.journalAction.setCheckable(True)
 
     def loadReagents(self, data):
         self.reagents.restore(data)
@@ -56,7 +64,14 @@ class SolutionEditorWindow(qt.QMainWindow):
         if self.currentFile is None:
             self.saveAs()
         else:
-            self.db.saveFile(self.currentFile)
+            try:
+                if isSQLite(self.currentFile):
+                    self.db.saveSQLite(self.currentFile)
+                else:
+                    self.db.saveFile(self.currentFile, journal=self.journalAction.isChecked())
+            except Exception as exc:
+                qt.QMessageBox.warning(self, "ERROR", "File save failed: " + str(exc))
+                raise
         
     def saveAs(self):
         fname = qt.QFileDialog.getSaveFileName()
@@ -70,10 +85,21 @@ class SolutionEditorWindow(qt.QMainWindow):
             fname = str(qt.QFileDialog.getOpenFileName()[0])
             if fname == '':
                 return
-        self.db.loadFile(fname)
+        if isSQLite(fname):
+            self.db.openSQLite(fname)
+        else:
+            dlg = qt.QProgressDialog('Loading %s' % os.path.basename(fname), None, 0, 1000, self)
+            dlg.setMinimumDuration(500)
+            try:
+                self.db.loadFile(fname, progress=lambda frac: dlg.setValue(int(frac * 1000)))
+            finally:
+                dlg.close()
         self.currentFile = fname
         self.setWindowTitle('Solution Editor: ' + fname)
         self.reagentEditor.updateReagentList()
         self.solutionEditor.updateSolutionList()
         self.solutionEditor.updateSolutionTree()
-        
\ No newline at end of file
+
+
+def isSQLite(fname):
+    return os.path.splitext(fname)[1].lower() in ('.sqlite', '.sqlite3', '.db')
@@ -0,0 +1,192 @@
+"""Append-only journal of edits made to a SolutionDatabase.
+
+When a database is saved with ``saveFile(filename, journal=True)``, small
+edits made since the last save are appended to a sidecar file
+(``filename + '.journal'``) as one JSON record per line, rather than
+rewriting the whole database. loadFile() replays the journal on top of the
+snapshot.
+
+Only edits made through the model's methods are journaled:
+
+* ``Reagents.setData`` / ``Reagents.rename``
+* ``Solution.__setitem__`` (concentrations), ``Solution.setName`` and
+  ``Solution.setField``
+* ``RecipeSet.setField``, ``RecipeSet.setStock``, ``Recipe.setVolumes`` and
+  ``Recipe.setNotes``
+
+Any other change (adding or removing reagents, solutions or recipes, or
+restoring state) cannot be expressed as a journal record, so the next save
+writes a complete snapshot instead. A complete snapshot is also written once
+the journal grows beyond *limit* records; this folds the journal back into the
+snapshot and removes the sidecar file. Consecutive edits of the same value
+(such as typing in a notes field) are kept as a single record.
+
+The first line of the journal identifies the snapshot it applies to (by a
+hash of its contents), so that a journal left over from a different version
+of the snapshot is never replayed; a warning is issued when such a journal is
+ignored. Only complete lines are replayed. An incomplete final line (for
+example, from a crash while appending) is ignored, and overwritten by the
+next record appended.
+"""
+import os, json, hashlib, warnings
+
+
+class Journal(object):
+    """Pending and saved journal records for one database file.
+    """
+    def __init__(self, filename, limit=1000):
+        self.filename = os.path.abspath(filename)
+        self.path = self.filename + '.journal'
+        self.limit = limit
+        # records not yet written to the journal file
+        self.pending = []
+        # number of records already in the journal file
+        self.size = 0
+        # False if a change has been made that cannot be journaled
+        self.valid = True
+        # if True, the journal file is (re)started on the next flush
+        self.fresh = True
+        # length in bytes of the complete records in the journal file
+        self.end = 0
+        self.snapshot = snapshotId(self.filename)
+
+    def record(self, rec):
+        if not self.valid:
+            return
+        pending = self.pending
+        if len(pending) > 0 and pending[-1][0] in _replaceable and pending[-1][:-1] == rec[:-1]:
+            # a repeated edit of the same value (e.g. typing in a notes field)
+            # only needs its final value
+            pending[-1] = rec
+            return
+        if self.size + len(pending) >= self.limit:
+            # the next save writes a snapshot anyway; don't keep collecting
+            # records while journaling is not in use
+            self.invalidate()
+            return
+        pending.append(rec)
+
+    def invalidate(self):
+        self.valid = False
+        self.pending = []
+
+    def needsSnapshot(self, filename):
+        """Return True if saving to *filename* requires a complete snapshot.
+        """
+        return (not self.valid or
+                os.path.abspath(filename) != self.filename or
+                self.size + len(self.pending) > self.limit or
+                snapshotId(self.filename) != self.snapshot)
+
+    def flush(self):
+        """Append all pending records to the journal file.
+        """
+        lines = [encodeRecord(rec) for rec in self.pending]
+        if self.fresh:
+            lines.insert(0, encodeRecord({'sha1': contentHash(self.filename)}))
+            self.end = 0
+        data = ''.join(lines).encode('utf-8')
+        with open(self.path, 'wb' if self.fresh else 'r+b') as fh:
+            # drop anything after the last complete record
+            fh.seek(self.end)
+            fh.truncate()
+            fh.write(data)
+            fh.flush()
+            os.fsync(fh.fileno())
+        self.end += len(data)
+        self.fresh = False
+        self.size += len(self.pending)
+        self.pending = []
+
+    def remove(self):
+        """Delete the journal file, if any.
+        """
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+# record types whose last element is the complete new value of the field
+# addressed by the other elements
+_replaceable = ('reagent', 'concentration', 'solution', 'recipeSet', 'stock', 'volumes', 'recipeNotes')
+
+
+def snapshotId(filename):
+    """Return a value identifying the current version of a database file.
+    """
+    try:
+        st = os.stat(filename)
+    except OSError:
+        return None
+    return [st.st_size, st.st_mtime_ns]
+
+
+def contentHash(filename):
+    """Return the SHA-1 hash of the contents of a database file.
+    """
+    h = hashlib.sha1()
+    with open(filename, 'rb') as fh:
+        for chunk in iter(lambda: fh.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def encodeRecord(rec):
+    return json.dumps(rec, separators=(',', ':'), default=_toPython) + '\n'
+
+
+def _toPython(obj):
+    # numpy scalars and arrays
+    if hasattr(obj, 'tolist'):
+        return obj.tolist()
+    raise TypeError("Object of type %s is not JSON serializable" % type(obj).__name__)
+
+
+def readJournal(filename):
+    """Return (records, end) for the journal of database *filename*: the
+    records to replay on top of the snapshot, and the length in bytes of the
+    part of the journal file they were read from.
+
+    Returns ([], 0) if there is no journal, or if it belongs to a different
+    version of the database file. A final line that is incomplete (for
+    example, because of a crash while appending) is ignored.
+    """
+    path = os.path.abspath(filename) + '.journal'
+    if not os.path.exists(path):
+        return [], 0
+    with open(path, 'rb') as fh:
+        data = fh.read()
+    end = data.rfind(b'\n') + 1
+    records = [json.loads(line) for line in data[:end].decode('utf-8').split('\n') if line != '']
+    if len(records) == 0:
+        return [], 0
+    header = records[0]
+    if not isinstance(header, dict) or header.get('sha1') != contentHash(filename):
+        warnings.warn("Ignoring journal %s; it does not belong to the current version of %s." % (path, filename))
+        return [], 0
+    return records[1:], end
+
+
+def applyRecord(db, rec):
+    """Apply a single journal record to *db*.
+    """
+    op = rec[0]
+    if op == 'reagent':
+        db.reagents.setData(*rec[1:])
+    elif op == 'renameReagent':
+        db.reagents.rename(*rec[1:])
+    elif op == 'concentration':
+        db.solutions[rec[1]][rec[2]] = rec[3]
+    elif op == 'renameSolution':
+        db.solutions[rec[1]].setName(rec[2])
+    elif op == 'solution':
+        db.solutions[rec[1]].setField(rec[2], rec[3])
+    elif op == 'recipeSet':
+        db.recipes[rec[1]].setField(rec[2], rec[3])
+    elif op == 'stock':
+        db.recipes[rec[1]].setStock(rec[2], rec[3])
+    elif op == 'volumes':
+        db.recipes[rec[1]][rec[2]].setVolumes(rec[3])
+    elif op == 'recipeNotes':
+        db.recipes[rec[1]][rec[2]].setNotes(rec[3])
+    else:
+        raise ValueError("Unknown journal record type '%s'" % op)
@@ -0,0 +1,330 @@
+"""JSON serialization for database files.
+
+The standard library encoder falls back to a slow pure-Python path when
+indenting, ignores float formatting overrides, and does not know about numpy
+types. The writer here produces the same layout as ``json.dump(obj, fh,
+indent=2)`` but
+
+* writes numpy scalars and arrays directly,
+* formats floats with 12 significant digits (so that values like 0.1+0.2
+  do not produce noisy diffs), and
+* streams its output to the file in large chunks.
+
+The output depends only on the data, so saving an unchanged database always
+produces identical bytes.
+
+iterload() is the reading counterpart: it parses a database file one record
+at a time rather than building the complete object tree in memory.
+"""
+import os, io, re, json, codecs
+from json.encoder import encode_basestring_ascii
+import numpy as np
+
+_INF = float('inf')
+
+# characters that may continue a number (matched up to the end of the buffer)
+_NUMBER_TAIL = re.compile(r'[0-9.eE+-]*\Z')
+
+
+def floatRepr(x):
+    """Return the JSON representation of a float, rounded to 12 significant
+    digits (and 12 decimal places).
+    """
+    if -1.0 < x < 1.0:
+        # rounding to 12 decimal places only matters for small values
+        x = round(x, 12)
+    elif x != x:
+        return 'NaN'
+    elif x in (_INF, -_INF):
+        return 'Infinity' if x > 0 else '-Infinity'
+    return '%.12g' % x
+
+
+def dump(obj, fh, indent=2, chunkSize=65536):
+    """Write *obj* as JSON to the text file *fh*.
+
+    Output is accumulated and written in chunks of about *chunkSize*
+    characters; only one top-level record (for example, a single reagent or
+    solution) is held in memory as a string at any time.
+    """
+    parts = []
+    size = 0
+    for part in _Encoder(indent).iterencode(obj):
+        parts.append(part)
+        size += len(part)
+        if size >= chunkSize:
+            fh.write(''.join(parts))
+            parts = []
+            size = 0
+    fh.write(''.join(parts))
+
+
+def dumps(obj, indent=2):
+    """Return *obj* encoded as a JSON string.
+    """
+    return _Encoder(indent).encode(obj, 0)
+
+
+def _encodeBool(b):
+    return 'true' if b else 'false'
+
+def _encodeNone(o):
+    return 'null'
+
+def _encodeInt(i):
+    return str(int(i))
+
+def _encodeFloat(x):
+    return floatRepr(float(x))
+
+# encoders for scalar types, looked up by exact type
+_SCALARS = {
+    str: encode_basestring_ascii,
+    float: floatRepr,
+    int: int.__repr__,
+    bool: _encodeBool,
+    type(None): _encodeNone,
+    np.str_: encode_basestring_ascii,
+    np.bool_: _encodeBool,
+}
+for _t in (np.float16, np.float32, np.float64, np.longdouble):
+    _SCALARS[_t] = _encodeFloat
+for _t in (np.int8, np.int16, np.int32, np.int64, np.uint8, np.uint16, np.uint32, np.uint64):
+    _SCALARS[_t] = _encodeInt
+
+
+class _Encoder(object):
+    def __init__(self, indent):
+        self.indent = ' ' * indent
+        self.newlines = ['\n']
+
+    def newline(self, level):
+        # cached newline + indentation strings
+        while len(self.newlines) <= level:
+            self.newlines.append('\n' + self.indent * len(self.newlines))
+        return self.newlines[level]
+
+    def iterencode(self, obj, level=0, depth=2):
+        """Yield the encoded pieces of obj, descending *depth* levels into
+        containers before encoding whole sub-objects at once.
+        """
+        if depth == 0 or not isinstance(obj, (dict, list, tuple)) or len(obj) == 0:
+            yield self.encode(obj, level)
+            return
+        inner = self.newline(level + 1)
+        if isinstance(obj, dict):
+            sep = '{' + inner
+            for key, val in obj.items():
+                yield sep + encode_basestring_ascii(self.encodeKey(key)) + ': '
+                for part in self.iterencode(val, level + 1, depth - 1):
+                    yield part
+                sep = ',' + inner
+            yield self.newline(level) + '}'
+        else:
+            sep = '[' + inner
+            for val in obj:
+                yield sep
+                for part in self.iterencode(val, level + 1, depth - 1):
+                    yield part
+                sep = ',' + inner
+            yield self.newline(level) + ']'
+
+    def encode(self, obj, level):
+        """Return the complete encoding of obj as a string.
+        """
+        enc = _SCALARS.get(type(obj))
+        if enc is not None:
+            return enc(obj)
+        if isinstance(obj, dict):
+            if len(obj) == 0:
+                return '{}'
+            inner = self.newline(level + 1)
+            encodeKey = self.encodeKey
+            items = []
+            for key, val in obj.items():
+                enc = _SCALARS.get(type(val))
+                key = encode_basestring_ascii(key if type(key) is str else encodeKey(key))
+                items.append(key + ': ' + (enc(val) if enc is not None else self.encode(val, level + 1)))
+            return '{' + inner + (',' + inner).join(items) + self.newline(level) + '}'
+        if isinstance(obj, (list, tuple)):
+            if len(obj) == 0:
+                return '[]'
+            inner = self.newline(level + 1)
+            items = []
+            for val in obj:
+                enc = _SCALARS.get(type(val))
+                items.append(enc(val) if enc is not None else self.encode(val, level + 1))
+            return '[' + inner + (',' + inner).join(items) + self.newline(level) + ']'
+        if isinstance(obj, np.ndarray):
+            return self.encode(obj.tolist(), level)
+        # subclasses of the basic types
+        if isinstance(obj, str):
+            return encode_basestring_ascii(obj)
+        if isinstance(obj, (bool, np.bool_)):
+            return _encodeBool(obj)
+        if isinstance(obj, (int, np.integer)):
+            return _encodeInt(obj)
+        if isinstance(obj, (float, np.floating)):
+            return _encodeFloat(obj)
+        raise TypeError("Object of type %s is not JSON serializable" % type(obj).__name__)
+
+    def encodeKey(self, key):
+        # same key conversions as the json module
+        if isinstance(key, str):
+            return key
+        if isinstance(key, (bool, np.bool_)):
+            return _encodeBool(key)
+        if key is None:
+            return 'null'
+        if isinstance(key, (int, np.integer)):
+            return _encodeInt(key)
+        if isinstance(key, (float, np.floating)):
+            return _encodeFloat(key)
+        raise TypeError("keys must be str, int, float, bool or None, not %s" % type(key).__name__)
+
+
+def iterload(fh, chunkSize=65536, progress=None):
+    """Incrementally parse a JSON file whose top level is an object.
+
+    Yields ``(key, index, value)`` for each top-level key. If the value of a
+    key is an array, its items are parsed and yielded one at a time with
+    their index in the array; otherwise the whole value is yielded with
+    index None. Only one item is held in memory at a time (plus the read
+    buffer), which keeps memory overhead small for very large files.
+
+    *fh* must be opened in binary mode. If *progress* is given, it is called
+    with the fraction of the file read so far after each chunk is read.
+
+    Invalid JSON raises a JSONDecodeError giving the position of the error
+    in the file.
+    """
+    return _StreamParser(fh, chunkSize, progress).items()
+
+
+class JSONDecodeError(json.JSONDecodeError):
+    """json.JSONDecodeError raised by iterload(), with *pos*, *lineno* and
+    *colno* counted from the start of the file.
+    """
+    def __init__(self, msg, pos, lineno, colno):
+        ValueError.__init__(self, '%s: line %d column %d (char %d)' % (msg, lineno, colno, pos))
+        self.msg = msg
+        self.doc = None
+        self.pos = pos
+        self.lineno = lineno
+        self.colno = colno
+
+    def __reduce__(self):
+        return self.__class__, (self.msg, self.pos, self.lineno, self.colno)
+
+
+class _StreamParser(object):
+    def __init__(self, fh, chunkSize, progress):
+        self.fh = fh
+        self.chunkSize = chunkSize
+        self.progress = progress
+        self.decoder = json.JSONDecoder()
+        self.textDecoder = codecs.getincrementaldecoder('utf-8')()
+        self.buf = ''
+        self.pos = 0
+        # number of characters and lines dropped from the start of the
+        # buffer, and the file offset of the first character of the line
+        # containing the start of the buffer (for error positions)
+        self.offset = 0
+        self.lines = 0
+        self.lineStart = 0
+        self.eof = False
+        self.bytesRead = 0
+        try:
+            self.size = os.fstat(fh.fileno()).st_size
+        except (AttributeError, OSError, io.UnsupportedOperation):
+            self.size = None
+
+    def read(self, n=None):
+        # append at least n more characters to the buffer, dropping what has already been parsed
+        data = self.fh.read(max(n or 0, self.chunkSize))
+        self.bytesRead += len(data)
+        if len(data) == 0:
+            self.eof = True
+        dropped = self.buf[:self.pos]
+        n = dropped.count('\n')
+        if n > 0:
+            self.lines += n
+            self.lineStart = self.offset + dropped.rfind('\n') + 1
+        self.offset += self.pos
+        self.buf = self.buf[self.pos:] + self.textDecoder.decode(data, final=self.eof)
+        self.pos = 0
+        if self.progress is not None and self.size:
+            self.progress(min(1.0, self.bytesRead / float(self.size)))
+
+    def peek(self):
+        # return the next non-whitespace character (without consuming it)
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in ' \t\r\n':
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if self.eof:
+                raise self.error("Unexpected end of JSON data", self.pos)
+            self.read()
+
+    def expect(self, chars):
+        c = self.peek()
+        if c not in chars:
+            raise self.error("Expecting one of %r, found %r" % (chars, c), self.pos)
+        self.pos += 1
+        return c
+
+    def value(self):
+        # parse one complete JSON value, reading more data as needed
+        self.peek()
+        while True:
+            try:
+                val, end = self.decoder.raw_decode(self.buf, self.pos)
+                # a number at the end of the buffer may be incomplete (this
+                # includes "0." or "1e" followed only by more of the number)
+                incomplete = type(val) in (int, float) and _NUMBER_TAIL.match(self.buf, end) is not None
+                if self.eof or not incomplete:
+                    self.pos = end
+                    return val
+            except json.JSONDecodeError as exc:
+                # only a value cut off by the end of the buffer can become valid
+                # with more data: the error is then within the last token (at
+                # most 9 characters, for -Infinity), or in a string whose
+                # closing quote has not been read yet. Anything else is invalid
+                # data, reported without reading the rest of the file.
+                truncated = exc.pos >= len(self.buf) - 10 or exc.msg.startswith('Unterminated string')
+                if self.eof or not truncated:
+                    raise self.error(exc.msg, exc.pos)
+            # grow geometrically so that very large values are not re-parsed too often
+            self.read(len(self.buf) - self.pos)
+
+    def error(self, msg, pos):
+        # return a JSONDecodeError for position *pos* in the buffer
+        before = self.buf[:pos]
+        newline = before.rfind('\n')
+        lineStart = self.lineStart if newline < 0 else self.offset + newline + 1
+        filePos = self.offset + pos
+        return JSONDecodeError(msg, filePos, self.lines + before.count('\n') + 1, filePos - lineStart + 1)
+
+    def items(self):
+        self.expect('{')
+        if self.peek() == '}':
+            return
+        while True:
+            key = self.value()
+            self.expect(':')
+            if self.peek() == '[':
+                self.pos += 1
+                if self.peek() == ']':
+                    self.pos += 1
+                else:
+                    index = 0
+                    while True:
+                        yield key, index, self.value()
+                        index += 1
+                        if self.expect(',]') == ']':
+                            break
+            else:
+                yield key, None, self.value()
+            if self.expect(',}') == '}':
+                return
@@ -0,0 +1,98 @@
+"""Total reagent amounts needed to make a list of recipe orders.
+
+An order is a (recipeSet, recipe, volume, count) tuple: *count* batches of
+*volume* ml of a Recipe from a RecipeSet. Reagents are weighed out, unless
+the order's recipe set lists a stock concentration for them, in which case
+they are pipetted from that stock. A recipe that belongs to several recipe
+sets may be pipetted from different stocks depending on the set it is
+ordered from; *recipeSet* may be None to weigh out every reagent::
+
+    plan = db.recipes.plan([(rs, acsf, 500, 4), (rs, internal, 50, 1)])
+    for name, grams in zip(plan.reagents, plan.grams):
+        print(name, grams)
+    for (name, stock), ml in zip(plan.stocks, plan.stockVolumes):
+        print('%s (%g M)' % (name, stock), ml)
+
+All orders are summed in one vectorized pass over a sparse (order, reagent)
+list, so plans with thousands of orders are cheap to recompute.
+"""
+import numpy as np
+from . import composition
+
+
+class ProductionPlan(object):
+    """Total reagent amounts for a list of orders.
+
+    Attributes:
+
+    * ``reagents``, ``grams``: names of the reagents to weigh out (in reagent
+      table order) and the total mass (g) of each
+    * ``stocks``, ``stockVolumes``: (reagent name, stock concentration (M))
+      for each stock solution used, and the total volume (ml) of each
+    * ``orders``: the orders the plan was made for
+
+    Reagents that are not in the reagent table are left out.
+    """
+    def __init__(self, reagents, orders):
+        """*reagents* is the Reagents table.
+        """
+        self.orders = list(orders)
+        index = reagents._index
+
+        # composition of each distinct (recipe set, recipe) pair, and the
+        # stocks that apply to it
+        recipeIds = {}
+        solutions = []
+        stockIds = {}
+        stockSets = []
+        recipeStocks = []
+        orderRecipe = np.empty(len(self.orders), dtype=int)
+        orderVolume = np.empty(len(self.orders), dtype=float)
+        for k, (rs, recipe, volume, count) in enumerate(self.orders):
+            key = (id(rs), id(recipe))
+            i = recipeIds.get(key)
+            if i is None:
+                i = recipeIds[key] = len(solutions)
+                solutions.append(recipe.solution)
+                s = stockIds.get(id(rs))
+                if s is None:
+                    s = stockIds[id(rs)] = len(stockSets)
+                    stockSets.append({} if rs is None else rs.stocks)
+                recipeStocks.append(s)
+            orderRecipe[k] = i
+            orderVolume[k] = volume * count
+        mat = composition.ConcentrationMatrix(solutions, index, len(index))
+        indptr = np.concatenate([[0], np.cumsum(np.bincount(mat.rows, minlength=len(solutions)))])
+        cols = mat.cols
+        concs = mat.values
+        stockConcs = np.full(len(cols), np.nan)
+        entryStocks = np.array(recipeStocks, dtype=int)[mat.rows]
+        for s, stocks in enumerate(stockSets):
+            for name, conc in stocks.items():
+                j = index.get(name)
+                if j is not None:
+                    stockConcs[(entryStocks == s) & (cols == j)] = conc
+
+        # expand to one entry per (order, reagent)
+        counts = np.diff(indptr)[orderRecipe]
+        entryOrder = np.repeat(np.arange(len(self.orders)), counts)
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        entry = np.repeat(indptr[:-1][orderRecipe], counts) + offsets
+        reagent = cols[entry]
+        stock = stockConcs[entry]
+        moles = (orderVolume[entryOrder] * 1e-3) * (concs[entry] * 1e-3)
+
+        names = reagents._data['name']
+        weighed = np.isnan(stock)
+        mg = moles[weighed] * (reagents._data['molweight'][reagent[weighed]] * 1e3)
+        rows = np.flatnonzero(np.bincount(reagent[weighed], minlength=len(names)))
+        self.grams = np.bincount(reagent[weighed], weights=mg, minlength=len(names))[rows] * 1e-3
+        self.reagents = [names[j] for j in rows]
+
+        # one total per (reagent, stock concentration) pair
+        pipetted = ~weighed
+        ml = moles[pipetted] / (stock[pipetted] * 1e-3)
+        values, stockIndex = np.unique(stock[pipetted], return_inverse=True)
+        keys, inverse = np.unique(reagent[pipetted] * len(values) + stockIndex.ravel(), return_inverse=True)
+        self.stockVolumes = np.bincount(inverse.ravel(), weights=ml, minlength=len(keys))
+        self.stocks = [(names[k // len(values)], float(values[k % len(values)])) for k in keys.tolist()]
@@ -0,0 +1,154 @@
+from . import qt
+from .format_float import formatFloat
+
+Ui_productionPlanner = qt.importTemplate('.productionPlannerTemplate')
+
+
+class ProductionPlannerWidget(qt.QWidget):
+    """Summary of the reagents needed to make a number of batches of the
+    recipes in the recipe book.
+
+    Each volume of each recipe is listed as an order with an editable volume
+    and count; totals for all orders with a nonzero count are recomputed
+    (see RecipeBook.plan) whenever an order changes.
+    """
+    def __init__(self, db, parent=None):
+        self.db = db
+        self.plan = None
+        qt.QWidget.__init__(self, parent)
+        self.ui = Ui_productionPlanner()
+        self.ui.setupUi(self)
+        self.ui.hsplitter.setStretchFactor(0, 1)
+        self.ui.hsplitter.setStretchFactor(1, 1)
+        # only the volume and count columns are edited (see itemClicked)
+        self.ui.orderTree.setEditTriggers(qt.QAbstractItemView.NoEditTriggers)
+
+        # id(OrderItem) -> OrderItem, for all items with a nonzero count
+        self._orders = {}
+        self._updating = False
+
+        self.updateOrderList()
+
+        self.db.recipes.sigRecipeSetListChanged.connect(self.updateOrderList)
+        self.ui.orderTree.itemChanged.connect(self.orderItemChanged)
+        self.ui.orderTree.itemClicked.connect(self.itemClicked)
+        self.ui.clearBtn.clicked.connect(self.clearOrders)
+
+    def showEvent(self, ev):
+        # recipes and volumes may have been edited in the recipe editor
+        self.updateOrderList()
+        qt.QWidget.showEvent(self, ev)
+
+    def updateOrderList(self):
+        """Rebuild the list of orders from the recipe book, keeping the volume
+        and count of orders that still exist.
+        """
+        tree = self.ui.orderTree
+        old = dict(((id(item.recipeSet), id(item.recipe), item.index), item) for item in self._orders.values())
+        expanded = set(tree.topLevelItem(i).text(0) for i in range(tree.topLevelItemCount()) if tree.topLevelItem(i).isExpanded())
+        self._updating = True
+        try:
+            tree.clear()
+            self._orders = {}
+            for rs in self.db.recipes:
+                rsItem = qt.QTreeWidgetItem([rs.name or '', '', ''])
+                tree.addTopLevelItem(rsItem)
+                for recipe in rs:
+                    for j, vol in enumerate(recipe.volumes):
+                        item = OrderItem(rs, recipe, j, vol)
+                        prev = old.get((id(rs), id(recipe), j))
+                        if prev is not None:
+                            item.setOrder(prev.volume, prev.count)
+                            self._orders[id(item)] = item
+                        rsItem.addChild(item)
+                rsItem.setExpanded(rsItem.text(0) in expanded or len(expanded) == 0)
+        finally:
+            self._updating = False
+        for col in range(tree.columnCount()):
+            tree.resizeColumnToContents(col)
+        self.updatePlan()
+
+    def itemClicked(self, item, col):
+        if isinstance(item, OrderItem) and col in (1, 2):
+            self.ui.orderTree.editItem(item, col)
+
+    def orderItemChanged(self, item, col):
+        if self._updating or not isinstance(item, OrderItem):
+            return
+        self._updating = True
+        try:
+            item.readOrder()
+        finally:
+            self._updating = False
+        if item.count > 0:
+            self._orders[id(item)] = item
+        else:
+            self._orders.pop(id(item), None)
+        self.updatePlan()
+
+    def clearOrders(self):
+        self._updating = True
+        try:
+            for item in self._orders.values():
+                item.setOrder(item.recipe.volumes[item.index], 0)
+        finally:
+            self._updating = False
+        self._orders = {}
+        self.updatePlan()
+
+    def updatePlan(self):
+        """Recompute the total amounts for all current orders.
+        """
+        orders = [(item.recipeSet, item.recipe, item.volume, item.count) for item in self._orders.values()]
+        self.plan = self.db.recipes.plan(orders)
+
+        tree = self.ui.totalsTree
+        tree.clear()
+        items = [qt.QTreeWidgetItem([name, formatFloat(float(g)), 'g']) for name, g in zip(self.plan.reagents, self.plan.grams)]
+        for (name, stock), ml in zip(self.plan.stocks, self.plan.stockVolumes):
+            items.append(qt.QTreeWidgetItem(['%s (%sM)' % (name, formatFloat(stock)), formatFloat(float(ml)), 'ml']))
+        for item in items:
+            item.setTextAlignment(1, qt.Qt.AlignRight | qt.Qt.AlignVCenter)
+        tree.addTopLevelItems(items)
+        for col in range(tree.columnCount()):
+            tree.resizeColumnToContents(col)
+
+        nbatches = sum(item.count for item in self._orders.values())
+        self.ui.summaryLabel.setText('%d batches of %d solutions' % (nbatches, len(set(id(o[1]) for o in orders))))
+
+
+class OrderItem(qt.QTreeWidgetItem):
+    """One volume of one recipe in a recipe set, with the volume and number
+    of batches to make.
+    """
+    def __init__(self, recipeSet, recipe, index, volume):
+        self.recipeSet = recipeSet
+        self.recipe = recipe
+        self.index = index
+        self.volume = volume
+        self.count = 0
+        qt.QTreeWidgetItem.__init__(self, [recipe.solution.name, '', ''])
+        self.setFlags(self.flags() | qt.Qt.ItemIsEditable)
+        self.setOrder(volume, 0)
+
+    def setOrder(self, volume, count):
+        self.volume = volume
+        self.count = count
+        self.setText(1, formatFloat(volume))
+        self.setText(2, '%d' % count)
+
+    def readOrder(self):
+        """Parse the volume and count entered by the user; invalid values
+        are reverted.
+        """
+        volume = self.volume
+        if self.text(1) != formatFloat(volume):
+            try:
+                volume = float(self.text(1))
+            except ValueError:
+                pass
+        try:
+            count = max(0, int(self.text(2)))
+        except ValueError:
+            count = self.count
+        self.setOrder(volume, count)
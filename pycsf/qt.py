@@ -4,6 +4,10 @@
 """
 import os
 import sys
+import hashlib
+import marshal
+import tempfile
+from importlib.util import MAGIC_NUMBER
 
 import pyqtgraph as pg
 
@@ -23,6 +27,46 @@ disconnect = pg.disconnect
 
 
 def loadUiType(uiFile, package=None):
+    """Return the (form class, base class) generated from a .ui file.
+
+    The code generated by uic is cached as bytecode in a __pycache__ directory
+    next to the .ui file, so it is only regenerated when the .ui file (or the
+    Qt binding) changes.
+    """
+    widget_class, form_class, pyc = _compileUi(uiFile)
+
+    if package is None:
+        globalns = {}
+    else:
+        globalns = {'__package__': package}
+    exec(pyc, globalns)
+
+    # Fetch the base_class and form class based on their type in the xml from designer
+    form_class = globalns[f'Ui_{form_class}']
+    base_class = getattr(QtWidgets, widget_class)
+
+    return form_class, base_class
+
+
+def _compileUi(uiFile):
+    """Return (widget class name, form class name, code object) for a .ui file,
+    using the bytecode cache when possible.
+    """
+    with open(uiFile, 'rb') as fh:
+        source = fh.read()
+    binding = '%s-%s' % (QT_LIB, getattr(QtCore, 'PYQT_VERSION_STR', QtCore.qVersion()))
+    key = hashlib.sha1(source + binding.encode()).hexdigest()[:16]
+    cacheDir = os.path.join(os.path.dirname(uiFile), '__pycache__')
+    cacheFile = os.path.join(cacheDir, '%s.%s.%s.uic' % (os.path.basename(uiFile), QT_LIB, key))
+
+    try:
+        with open(cacheFile, 'rb') as fh:
+            data = fh.read()
+        if data[:len(MAGIC_NUMBER)] == MAGIC_NUMBER:
+            return marshal.loads(data[len(MAGIC_NUMBER):])
+    except (OSError, EOFError, ValueError, TypeError):
+        pass
+
     if QT_LIB == PYQT5:
         from PyQt5 import uic
     elif QT_LIB == PYQT6:
@@ -37,22 +81,32 @@ def loadUiType(uiFile, package=None):
     widget_class = parsed.find('widget').get('class')
     form_class = parsed.find('class').text
 
-    if package is None:
-        globalns = {}
-    else:
-        globalns = {'__package__': package}
-
-    # load, compile, and execute ui code
+    # compile ui code
     o = _StringIO()
     uic.compileUi(open(uiFile, 'r'), o, indent=0)
     pyc = compile(o.getvalue(), uiFile, 'exec')
-    exec(pyc, globalns)
+    result = (widget_class, form_class, pyc)
 
-    # Fetch the base_class and form class based on their type in the xml from designer
-    form_class = globalns[f'Ui_{form_class}']
-    base_class = getattr(QtWidgets, widget_class)
+    # write to a temporary file first so that concurrent readers never see a partial cache file
+    tmpFile = None
+    try:
+        os.makedirs(cacheDir, exist_ok=True)
+        fd, tmpFile = tempfile.mkstemp(dir=cacheDir)
+        with os.fdopen(fd, 'wb') as fh:
+            fh.write(MAGIC_NUMBER + marshal.dumps(result))
+        os.replace(tmpFile, cacheFile)
+        # remove entries compiled from older versions of this .ui file
+        prefix = '%s.%s.' % (os.path.basename(uiFile), QT_LIB)
+        for name in os.listdir(cacheDir):
+            stale = os.path.join(cacheDir, name)
+            if name.startswith(prefix) and name.endswith('.uic') and stale != cacheFile:
+                os.remove(stale)
+    except OSError:
+        # caching is optional (the package directory may be read-only)
+        if tmpFile is not None and os.path.exists(tmpFile):
+            os.remove(tmpFile)
 
-    return form_class, base_class
+    return result
 
 
 def importTemplate(templateName):
@@ -1,7 +1,5 @@
-from collections import OrderedDict
-import pyqtgraph as pg
+import numpy as np
 from . import qt
-from .treeWidget import GroupItem, ItemDelegate
 
 Ui_reagentEditor = qt.importTemplate('.reagentEditorTemplate')
 
@@ -16,12 +14,21 @@ class ReagentEditorWidget(qt.QWidget):
         self.ui.splitter.setStretchFactor(0, 4)
         self.ui.splitter.setStretchFactor(1, 1)
 
+        # shows which solutions / recipes use the selected reagent
+        self.usageLabel = qt.QLabel()
+        self.usageLabel.setWordWrap(True)
+        self.ui.gridLayout.addWidget(self.usageLabel, 1, 0)
+
+        self.model = ReagentModel(self.reagents)
         tree = self.ui.reagentTree
+        tree.setUniformRowHeights(True)
+        tree.setModel(self.model)
         tree.setSelectionBehavior(qt.QAbstractItemView.SelectItems)
-        self.itemDelegate = ItemDelegate(tree)  # allow items to specify their own editors
-        tree.itemSelectionChanged.connect(self.selectionChanged)
+        tree.selectionModel().selectionChanged.connect(self.selectionChanged)
+        tree.clicked.connect(self.itemClicked)
+        self.model.modelReset.connect(self.modelReset)
+        self.model.rowsInserted.connect(self.rowsInserted)
         self.ui.reagentNotes.textChanged.connect(self.notesChanged)
-        self.reagents.sigReagentListChanged.connect(self.updateReagentList)
         
         self.updateReagentList()
         
@@ -30,109 +37,389 @@ class ReagentEditorWidget(qt.QWidget):
         selection = tree.selectionModel().selection().indexes()
         if len(selection) != 1:
             return
-        item, col = tree.itemFromIndex(selection[0])
-        if item.flags() & qt.Qt.ItemIsEditable == qt.Qt.ItemIsEditable:
-            tree.editItem(item, col)
+        index = selection[0]
+        if self.model.flags(index) & qt.Qt.ItemIsEditable == qt.Qt.ItemIsEditable:
+            tree.edit(index)
             
-        if isinstance(item, ReagentItem):
-            self.ui.reagentNotes.setHtml(item.reagent['notes'])
+        name = self.model.reagentName(index)
+        if name is not None:
+            self.ui.reagentNotes.setHtml(self.reagents[name]['notes'])
+            self.showUsage(name)
         else:
             self.ui.reagentNotes.setHtml("")
+            self.usageLabel.setText("")
+
+    def itemClicked(self, index):
+        group = self.model.adderGroup(index)
+        if group is not None:
+            self.addReagent(group)
+
+    def showUsage(self, name):
+        used = self.db.whereUsed(name)
+        solns = [s.name for s in used['solutions']]
+        rsets = [rs.name for rs in used['recipeSets']]
+        if len(solns) + len(rsets) == 0:
+            self.usageLabel.setText("%s is not used by any solution or recipe." % name)
+            return
+        text = "Used by %d solution(s): %s" % (len(solns), ', '.join(solns))
+        if len(rsets) > 0:
+            text += "<br>and %d recipe set(s): %s" % (len(rsets), ', '.join(map(str, rsets)))
+        self.usageLabel.setText(text)
 
     def notesChanged(self):
-        items = self.ui.reagentTree.selectedItems()
-        if len(items) == 0:
+        indexes = self.ui.reagentTree.selectionModel().selectedIndexes()
+        if len(indexes) == 0:
             return
-        item = items[0]
-        item.reagent['notes'] = str(self.ui.reagentNotes.toHtml())
+        name = self.model.reagentName(indexes[0])
+        if name is None:
+            return
+        self.reagents[name]['notes'] = str(self.ui.reagentNotes.toHtml())
 
-    def addReagent(self, item):
-        names = self.db.reagents.names()
+    def addReagent(self, group):
+        names = set(self.db.reagents.names())
         i = 0
         while True:
             name = 'new_reagent_%d' % i
             if name not in names:
                 break
             i += 1
-        self.db.reagents.add(name=name, group=str(item.text(0)))
+        self.db.reagents.add(name=name, group=group)
 
     def updateReagentList(self):
+        """Reload the entire reagent table into the view.
+
+        This is only needed after the table has been replaced; ordinary edits
+        update the view incrementally through ReagentModel.
+        """
+        self.model.reset()
+
+    def modelReset(self):
         tree = self.ui.reagentTree
-        vpos = tree.verticalScrollBar().value()
-        hpos = tree.horizontalScrollBar().value()
-        
-        #items = [tree.topLevelItem(i) for i in range(tree.topLevelItemCount())]
-        #oldGroups = OrderedDict([(item.text(0), item) for item in items])
-        #newGroups = self.reagents.groups()
-        tree.clear()
-
-        colNames = {
-            'name': 'Reagent',
-            'formula': 'Formula',
-            'molweight': 'MW (g/mol)',
-            'osmconst': 'Osmotic const.',
-        }
-        cols = [colNames.get(f[0], f[0]) for f in self.db.reagents._dtype if f[0] not in ('group', 'notes')]
-        tree.setHeaderLabels(cols)
-        
-        grpItems = {}
-        for reagent in self.reagents:
-            item = ReagentItem(reagent)
-            item.sigChanged.connect(self.itemChanged)
-            group = reagent['group']
-            if group not in grpItems:
-                grpItems[group] = GroupItem(group, adder='add reagent')
-                tree.addTopLevelItem(grpItems[group])
-                tree.setFirstItemColumnSpanned(grpItems[group], True)
-                grpItems[group].sigAddClicked.connect(self.addReagent)
-            grpItem = grpItems[group]
-            grpItem.addChild(item)
-
-        for i in range(self.ui.reagentTree.columnCount()):
-            self.ui.reagentTree.resizeColumnToContents(i)
-
-        tree.verticalScrollBar().setValue(vpos)
-        tree.horizontalScrollBar().setValue(hpos)
-
-    def itemChanged(self, item, field, value):
-        try:
-            self.reagents.sigReagentListChanged.disconnect(self.updateReagentList)
-            item.reagent[field] = value
-        finally:
-            self.reagents.sigReagentListChanged.connect(self.updateReagentList)
-            
+        for i in range(self.model.rowCount()):
+            self._initGroup(i)
+        # only rows near the top of the table are measured
+        for i in range(self.model.columnCount()):
+            tree.resizeColumnToContents(i)
 
+    def rowsInserted(self, parent, first, last):
+        if not parent.isValid():
+            for i in range(first, last+1):
+                self._initGroup(i)
 
-class ReagentItem(qt.QTreeWidgetItem):
-    def __init__(self, reagent):
-        class SigProxy(qt.QObject):
-            sigChanged = qt.Signal(object, object, object)  # self, field, value
-        self._sigprox = SigProxy()
-        self.sigChanged = self._sigprox.sigChanged
+    def _initGroup(self, row):
+        tree = self.ui.reagentTree
+        tree.setFirstColumnSpanned(row, qt.QModelIndex(), True)
+        tree.expand(self.model.index(row, 0))
 
-        self.reagent = reagent
-        fields = reagent.fields
-        self.fields = OrderedDict([(f,fields[f]) for f in fields if f != 'group'])
-        
-        strs = [str(reagent[f]) for f in self.fields]
-        qt.QTreeWidgetItem.__init__(self, strs)
-        self.setFlags(self.flags() | qt.Qt.ItemIsEnabled | qt.Qt.ItemIsEditable | qt.Qt.ItemIsSelectable)
-
-    def createEditor(self, parent, option, col):
-        return qt.QLineEdit(parent)
-    
-    def setEditorData(self, editor, col):
-        editor.setText(self.text(col))
-    
-    def setModelData(self, editor, model, col):
-        fname, ftype = self.fields.items()[col]
 
+class _Group(object):
+    # One group of reagents in ReagentModel. *names* are the names of the
+    # group's reagents; *rows* are their indices in Reagents._data, used to
+    # locate a reagent quickly when it changes.
+    def __init__(self, name, rows, names):
+        self.name = name
+        self.rows = rows
+        self.names = names
+
+
+class ReagentModel(qt.QAbstractItemModel):
+    """Item model presenting a Reagents table as a two-level tree.
+
+    Top-level rows are reagent groups, in order of first appearance in the
+    table; each group has one child row per reagent, followed by an "add
+    reagent" row. Data are read directly from the Reagents structured array
+    as the view requests them, and edits are written through
+    Reagents.setData / Reagents.rename.
+
+    Changes to the table are translated into fine-grained model signals
+    (dataChanged, rowsInserted, rowsRemoved), so that views keep their
+    scroll position, selection and expanded state.
+    """
+    colNames = {
+        'name': 'Reagent',
+        'formula': 'Formula',
+        'molweight': 'MW (g/mol)',
+        'osmconst': 'Osmotic const.',
+    }
+
+    def __init__(self, reagents, parent=None):
+        qt.QAbstractItemModel.__init__(self, parent)
+        self.reagents = reagents
+        self.fields = [f[0] for f in reagents._dtype if f[0] not in ('group', 'notes')]
+        self._groupFont = qt.QFont()
+        self._groupFont.setWeight(qt.QFont.Bold)
+        self._groupForeground = qt.QBrush(qt.QColor(255, 255, 255))
+        self._groupBackground = qt.QBrush(qt.QColor(180, 180, 200))
+        self._adderForeground = qt.QBrush(qt.QColor(0, 0, 200))
+        self._reagentFlags = qt.Qt.ItemIsEnabled | qt.Qt.ItemIsSelectable | qt.Qt.ItemIsEditable
+        self._otherFlags = qt.Qt.ItemIsEnabled | qt.Qt.ItemIsSelectable
+        reagents.sigReagentListChanged.connect(self.reagentListChanged)
+        reagents.sigReagentChanged.connect(self.reagentChanged)
+        reagents.sigReagentRenamed.connect(self.reagentRenamed)
+        self._groups = self._readGroups()
+        self._groupIndex = dict((g.name, g) for g in self._groups)
+
+    def reset(self):
+        """Reload the entire table, discarding all view state.
+        """
+        self.beginResetModel()
+        self._groups = self._readGroups()
+        self._groupIndex = dict((g.name, g) for g in self._groups)
+        self.endResetModel()
+
+    def _readGroups(self):
+        # Reagents._generation changes whenever rows are added or removed
+        self._generation = self.reagents._generation
+        # group the rows of the reagent table, keeping table order within
+        # each group and ordering groups by first appearance
+        data = self.reagents._data
+        if len(data) == 0:
+            return []
+        _, first, inverse = np.unique(data['group'].astype(str), return_index=True, return_inverse=True)
+        order = np.argsort(first)
+        rank = np.empty(len(order), dtype=int)
+        rank[order] = np.arange(len(order))
+        groupOfRow = rank[inverse.ravel()]
+        rows = np.argsort(groupOfRow, kind='stable')
+        counts = np.bincount(groupOfRow, minlength=len(order))
+        names = data['name'][rows].tolist()
+        result = []
+        start = 0
+        for count in counts:
+            row0 = rows[start]
+            result.append(_Group(data['group'][row0], rows[start:start+count], names[start:start+count]))
+            start += count
+        return result
+
+    # -- structure
+
+    # index(), rowCount() and flags() are called for every row whenever the
+    # view lays out the tree, so they avoid any unnecessary work.
+
+    def index(self, row, column, parent=qt.QModelIndex()):
+        if row < 0 or column < 0 or column >= len(self.fields):
+            return qt.QModelIndex()
+        if not parent.isValid():
+            if row >= len(self._groups):
+                return qt.QModelIndex()
+            return self.createIndex(row, column)
+        group = self._groups[parent.row()]
+        if parent.internalPointer() is not None or row > len(group.names):
+            return qt.QModelIndex()
+        return self.createIndex(row, column, group)
+
+    def parent(self, index):
+        if not index.isValid():
+            return qt.QModelIndex()
+        group = index.internalPointer()
+        if group is None:
+            return qt.QModelIndex()
+        return self.createIndex(self._groups.index(group), 0)
+
+    def rowCount(self, parent=qt.QModelIndex()):
+        if not parent.isValid():
+            return len(self._groups)
+        if parent.column() == 0 and parent.internalPointer() is None:
+            # reagents plus the "add reagent" row
+            return len(self._groups[parent.row()].names) + 1
+        return 0
+
+    def hasChildren(self, parent=qt.QModelIndex()):
+        return not parent.isValid() or (parent.column() == 0 and parent.internalPointer() is None)
+
+    def columnCount(self, parent=qt.QModelIndex()):
+        return len(self.fields)
+
+    def headerData(self, section, orientation, role=qt.Qt.DisplayRole):
+        if orientation == qt.Qt.Horizontal and role == qt.Qt.DisplayRole:
+            f = self.fields[section]
+            return self.colNames.get(f, f)
+        return None
+
+    def reagentName(self, index):
+        """Return the name of the reagent at *index*, or None if index is not a reagent row.
+        """
+        group = index.internalPointer() if index.isValid() else None
+        if group is None or index.row() >= len(group.names):
+            return None
+        return group.names[index.row()]
+
+    def adderGroup(self, index):
+        """Return the group name if *index* is an "add reagent" row, else None.
+        """
+        group = index.internalPointer() if index.isValid() else None
+        if group is None or index.row() != len(group.names) or index.column() != 0:
+            return None
+        return group.name
+
+    # -- data
+
+    def flags(self, index):
+        group = index.internalPointer()
+        if group is not None and index.row() < len(group.names):
+            return self._reagentFlags
+        if not index.isValid():
+            return qt.Qt.NoItemFlags
+        return self._otherFlags
+
+    def data(self, index, role=qt.Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        group = index.internalPointer()
+        col = index.column()
+        if group is None:
+            if col != 0:
+                return None
+            if role == qt.Qt.DisplayRole:
+                return self._groups[index.row()].name
+            elif role == qt.Qt.FontRole:
+                return self._groupFont
+            elif role == qt.Qt.ForegroundRole:
+                return self._groupForeground
+            elif role == qt.Qt.BackgroundRole:
+                return self._groupBackground
+            return None
+        row = index.row()
+        if row == len(group.names):
+            if col == 0 and role == qt.Qt.DisplayRole:
+                return '+ add reagent'
+            elif col == 0 and role == qt.Qt.ForegroundRole:
+                return self._adderForeground
+            return None
+        if role in (qt.Qt.DisplayRole, qt.Qt.EditRole):
+            ind = self.reagents._index.get(group.names[row])
+            if ind is None:
+                return None
+            value = self.reagents._data[self.fields[col]][ind]
+            return '' if value is None else str(value)
+        return None
+
+    def setData(self, index, value, role=qt.Qt.EditRole):
+        name = self.reagentName(index)
+        if name is None or role != qt.Qt.EditRole:
+            return False
+        field = self.fields[index.column()]
+        value = str(value)
+        if field == 'name':
+            if value == name:
+                return False
+            self.reagents.rename(name, value)
+            return True
         # string / float types need to be handled differently
-        if ftype.kind in 'uif':
-            v = float(str(editor.text()))
-            self.setText(col, '%0.2f'%v)
-        else:
-            v = str(editor.text())
-            self.setText(col, v)
-        self.sigChanged.emit(self, fname, v)
+        if self.reagents._data.dtype[field].kind in 'uif':
+            try:
+                value = float(value)
+            except ValueError:
+                return False
+        self.reagents.setData(name, field, value)
+        return True
+
+    # -- updates from the reagent table
+
+    def _find(self, name, oldName=None):
+        # return (group, position) of the named reagent, or (None, None);
+        # *oldName* is the name the model still has for it, if different
+        row = self.reagents._index.get(name)
+        if row is None:
+            return None, None
+        group = self._groupIndex.get(self.reagents._data['group'][row])
+        if group is None:
+            return None, None
+        pos = np.searchsorted(group.rows, row)
+        if pos >= len(group.rows) or group.rows[pos] != row or group.names[pos] != (oldName or name):
+            return None, None
+        return group, int(pos)
+
+    def reagentChanged(self, reagents, name, field):
+        if field == 'group':
+            self.sync()
+            return
+        group, pos = self._find(name)
+        if group is None:
+            return
+        self.dataChanged.emit(self.createIndex(pos, 0, group), self.createIndex(pos, len(self.fields)-1, group))
+
+    def reagentRenamed(self, reagents, old, new):
+        group, pos = self._find(new, old)
+        if group is None:
+            self.sync()
+            return
+        group.names[pos] = new
+        self.dataChanged.emit(self.createIndex(pos, 0, group), self.createIndex(pos, len(self.fields)-1, group))
 
+    def reagentListChanged(self):
+        if self.reagents._generation == self._generation:
+            # no rows were added or removed (eg. after a rename)
+            return
+        self.sync()
+
+    def sync(self):
+        """Update the model to match the reagent table, emitting row
+        insertions and removals for the differences.
+
+        Falls back to a model reset if rows or groups were reordered.
+        """
+        newGroups = self._readGroups()
+        newIndex = dict((g.name, g) for g in newGroups)
+
+        # check that no group or reagent changed position relative to the others
+        oldNames = [g.name for g in self._groups]
+        if not _sameOrder(oldNames, [g.name for g in newGroups]):
+            self.reset()
+            return
+        for group in self._groups:
+            new = newIndex.get(group.name)
+            if new is not None and not _sameOrder(group.names, new.names):
+                self.reset()
+                return
+
+        root = qt.QModelIndex()
+        # remove groups that no longer exist
+        for first, last in reversed(_runs([i for i, name in enumerate(oldNames) if name not in newIndex])):
+            self.beginRemoveRows(root, first, last)
+            for group in self._groups[first:last+1]:
+                del self._groupIndex[group.name]
+            del self._groups[first:last+1]
+            self.endRemoveRows()
+
+        # remove and insert reagents within existing groups
+        for i, group in enumerate(self._groups):
+            new = newIndex[group.name]
+            parent = self.createIndex(i, 0)
+            keep = set(new.names)
+            for first, last in reversed(_runs([j for j, name in enumerate(group.names) if name not in keep])):
+                self.beginRemoveRows(parent, first, last)
+                del group.names[first:last+1]
+                self.endRemoveRows()
+            old = set(group.names)
+            for first, last in _runs([j for j, name in enumerate(new.names) if name not in old]):
+                self.beginInsertRows(parent, first, last)
+                group.names[first:first] = new.names[first:last+1]
+                self.endInsertRows()
+            group.rows = new.rows
+
+        # insert new groups
+        for first, last in _runs([i for i, g in enumerate(newGroups) if g.name not in self._groupIndex]):
+            self.beginInsertRows(root, first, last)
+            self._groups[first:first] = newGroups[first:last+1]
+            for group in newGroups[first:last+1]:
+                self._groupIndex[group.name] = group
+            self.endInsertRows()
+
+
+def _sameOrder(old, new):
+    # True if the items common to both sequences appear in the same order
+    oldSet = set(old)
+    newSet = set(new)
+    return [x for x in old if x in newSet] == [x for x in new if x in oldSet]
+
+
+def _runs(indices):
+    # group sorted indices into (first, last) runs of consecutive values
+    runs = []
+    for i in indices:
+        if len(runs) > 0 and runs[-1][1] == i - 1:
+            runs[-1][1] = i
+        else:
+            runs.append([i, i])
+    return runs
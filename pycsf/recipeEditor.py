@@ -1,5 +1,6 @@
 import os
 import re
+import numpy as np
 from collections import OrderedDict
 import pyqtgraph as pg
 from . import qt
@@ -22,10 +23,6 @@ class RecipeEditorWidget(qt.QWidget):
     def __init__(self, db, parent=None):
         self.db = db
         self.recipeSet = None
-        self.reagentItems = []
-        self.solutionGroups = []
-        
-        self.addSolutionItem = None
         
         qt.QWidget.__init__(self, parent)
         self.ui = Ui_recipeEditor()
@@ -34,52 +31,76 @@ class RecipeEditorWidget(qt.QWidget):
         self.ui.hsplitter.setStretchFactor(1, 5)
         self.ui.vsplitter.setStretchFactor(0, 3)
         self.ui.vsplitter.setStretchFactor(1, 1)
+        self.model = RecipeTableModel(db)
         table = self.ui.recipeTable
+        table.setModel(self.model)
         table.horizontalHeader().hide()
         table.verticalHeader().hide()
+        # measure only visible rows when resizing columns
+        table.horizontalHeader().setResizeContentsPrecision(0)
         
         rsl = self.ui.recipeSetList
         rsl.currentItemChanged.connect(self.currentRecipeSetChanged)
         rsl.setEditTriggers(rsl.SelectedClicked | rsl.DoubleClicked)
         rsl.setContextMenuPolicy(qt.Qt.CustomContextMenu)
         self.styleDelegate = StyleDelegate(table)
+        table.setItemDelegate(self.styleDelegate)
+
+        # popup menus for choosing solutions and stock concentrations
+        self.solutionMenu = SolutionMenu(removable=True)
+        self.addSolutionMenu = SolutionMenu(removable=False)
+        self.stockMenu = StockMenu()
+        self._activeRecipe = None
         
         self.updateRecipeSetList()
         self.updateRecipeTable()
         
         self.db.solutions.solutionListChanged.connect(self.solutionsChanged)
         self.db.recipes.sigRecipeSetListChanged.connect(self.updateRecipeSetList)
-        self.db.reagents.sigReagentDataChanged.connect(self.updateRecipeTable)
-        self.db.reagents.sigReagentRenamed.connect(self.updateRecipeTable)
-        self.ui.recipeTable.cellClicked.connect(self.cellClicked)
-        self.ui.recipeTable.cellChanged.connect(self.cellChanged)
+        self.model.modelReset.connect(self.tableReset)
+        self.model.dataChanged.connect(self.tableDataChanged)
+        table.clicked.connect(self.cellClicked)
+        self.solutionMenu.sigSelected.connect(self.solutionChanged)
+        self.addSolutionMenu.sigSelected.connect(self.newSolutionSelected)
+        self.stockMenu.sigStockConcentrationChanged.connect(self.stockConcentrationChanged)
         self.ui.showMWCheck.clicked.connect(self.updateRecipeTable)
         self.ui.showFormulaeCheck.clicked.connect(self.updateRecipeTable)
         self.ui.showConcentrationCheck.clicked.connect(self.updateSolutionGroups)
         self.ui.copyHtmlBtn.clicked.connect(self.copyHtml)
         rsl.itemChanged.connect(self.recipeSetItemChanged)
         rsl.customContextMenuRequested.connect(self.recipeSetMenuRequested)
+        self.solutionsChanged()
 
     def recipeSetMenuRequested(self, point):
         item = self.ui.recipeSetList.itemAt(point)
         item.showContextMenu(point)
 
-    def cellClicked(self, r, c):
-        item = self.ui.recipeTable.item(r, c)
-        if hasattr(item, 'itemClicked'):
-            item.itemClicked()
-            
-    def cellChanged(self, r, c):
-        item = self.ui.recipeTable.item(r, c)
-        if hasattr(item, 'itemChanged'):
-            item.itemChanged()
+    def cellClicked(self, index):
+        kind, recipe, volume = self.model.columnInfo(index.column())
+        row = index.row()
+        if row == 0 and kind == 'addSolution':
+            self._popup(self.addSolutionMenu, index)
+        elif row == 0 and recipe is not None:
+            self._activeRecipe = self.recipeSet[recipe]
+            self._popup(self.solutionMenu, index)
+        elif row == 1 and kind == 'addVolume':
+            self.addVolume(recipe)
+        elif kind == 'reagent' and self.model.reagentAt(row) is not None:
+            reagent = self.model.reagentAt(row)
+            self.stockMenu.setReagent(reagent, self.recipeSet.stocks.get(reagent, None))
+            self._popup(self.stockMenu, index)
+
+    def _popup(self, menu, index):
+        tw = self.ui.recipeTable
+        rect = tw.visualRect(index)
+        x = tw.verticalHeader().width() + rect.left()
+        y = tw.horizontalHeader().height() + rect.bottom()
+        menu.popup(tw.mapToGlobal(qt.QPoint(x, y)))
         
     def solutionsChanged(self):
         # list of all available solutions has changed
-        for s in self.solutionGroups:
-            s.solutionItem.setAllSolutions(self.db.solutions)
-        if self.addSolutionItem is not None:
-            self.addSolutionItem.setAllSolutions(self.db.solutions)
+        self.solutionMenu.setAllSolutions(self.db.solutions)
+        self.addSolutionMenu.setAllSolutions(self.db.solutions)
         
     def currentRecipeSetChanged(self, item):
         row = self.ui.recipeSetList.indexOfTopLevelItem(item)
@@ -90,93 +111,43 @@ class RecipeEditorWidget(qt.QWidget):
             self.recipeSet = rs
             self.updateSolutionGroups()
         
-    def mkSolutionGroup(self, recipe):
-        showConc = self.ui.showConcentrationCheck.isChecked()
-        grp = SolutionItemGroup(self.ui.recipeTable, self.recipeSet, recipe, self.db, showConc)
-        grp.sigSolutionChanged.connect(self.solutionChanged)
-        grp.sigRecipeChanged.connect(self.updateRecipeTable)
-        return grp
-    
-    def solutionChanged(self, grp, soln):
+    def solutionChanged(self, soln):
         # user selected a new solution for an existing column
-        i = self.solutionGroups.index(grp)
+        recipe = self._activeRecipe
         if soln == '[remove]':
-            self.recipeSet.remove(grp.recipe)
+            self.recipeSet.remove(recipe)
         else:
-            self.recipeSet[i].solution = self.db.solutions[soln]
-        self.updateSolutionGroups()
+            recipe.setSolution(self.db.solutions[soln])
+        self.updateNotes()
         
     def updateSolutionGroups(self):
-        self.solutionGroups = []
-        for recipe in self.recipeSet:
-            grp = self.mkSolutionGroup(recipe)
-            self.solutionGroups.append(grp)
         self.updateRecipeTable()
+        self.updateNotes()
         
     def updateRecipeTable(self):
-        # reset table
-        table = self.ui.recipeTable
-        try:
-            table.cellChanged.disconnect(self.cellChanged)
-        except TypeError:
-            pass
-        table.clear()
-        table.clearSpans()
+        self.model.setRecipeSet(self.recipeSet, 
+                                showMW=self.ui.showMWCheck.isChecked(),
+                                showConcentration=self.ui.showConcentrationCheck.isChecked(),
+                                showFormulae=self.ui.showFormulaeCheck.isChecked())
+
+    def updateNotes(self):
+        self.ui.notesTree.clear()
         if self.recipeSet is None:
             return
-        showMW = self.ui.showMWCheck.isChecked()
-        table.setColumnCount(sum([s.columns() for s in self.solutionGroups]) + 2 + int(showMW))
-        
-        # generate new reagent list
-        solns = [r.solution for r in self.recipeSet]
-        reagents = set()
-        for soln in solns:
-            reagents |= set(soln.reagentList())
-
-        # sort reagents
-        reagentOrder = []
-        allReagents = self.db.reagents.names()
-        for name in allReagents:
-            if name in reagents:
-                reagentOrder.append(name)
-        
-        for sg in self.solutionGroups:
-            sg.reagentOrder = reagentOrder
-        
-        # create first column
-        table.setRowCount(3 + len(reagentOrder))
-        for row, label in enumerate(['', '']):
-            item = TableWidgetItem(label)
-            table.setItem(row, 0, item)
-        showFormulae = self.ui.showFormulaeCheck.isChecked()
-        for row, reagent in enumerate(reagentOrder):
-            name = reagent
-            if showFormulae:
-                formula = self.db.reagents[reagent]['formula']
-                name = reagent if formula == '' else formula
-            item = ReagentItem(name, self.recipeSet.stocks.get(reagent, None))
-            table.setItem(row+2, 0, item)
-            item.sigStockConcentrationChanged.connect(self.stockConcentrationChanged)
-            
-        # optional MW column
-        col = 1
-        if showMW:
-            header = TableWidgetItem('MW')
-            table.setItem(1, col, header)
-            for row, reagent in enumerate(reagentOrder):
-                mw = self.db.reagents[reagent]['molweight']
-                ritem = TableWidgetItem(formatFloat(mw))
-                table.setItem(row+2, col, ritem)
-            col += 1
-            
-        # let each solution group fill its columns
-        for grp in self.solutionGroups:
-            grp.setupItems(col)
-            col += grp.columns()
+        for recipe in self.recipeSet:
+            item = RecipeNoteItem(recipe)
+            self.ui.notesTree.addTopLevelItem(item)
 
-        # Extra column for adding solutions
-        self.addSolutionItem = SolutionItem(removable=False)
-        table.setItem(0, col, self.addSolutionItem)
+    def tableReset(self):
+        # spans, widgets and column widths are not part of the model
+        table = self.ui.recipeTable
+        model = self.model
+        table.clearSpans()
+        if model.rowCount() == 0:
+            return
+        for start, ncols in model.recipeSpans():
+            if ncols > 1:
+                table.setSpan(0, start, 1, ncols)
 
         # Add a row for units
         label = qt.QLabel('masses in mg, <span style="color: #0000c8">stock volumes in ml</span>')
@@ -184,37 +155,19 @@ class RecipeEditorWidget(qt.QWidget):
         f = label.font()
         f.setPointSize(8)
         label.setFont(f)
-        row = len(reagentOrder) + 2
-        table.setSpan(row, 0, 1, table.columnCount())
-        table.setCellWidget(row, 0, label)
-            
-        # set header background colors
-        for col in range(table.columnCount()):
-            table.setItemDelegateForColumn(col, self.styleDelegate)
-            for row, bg in [(0, (220, 220, 220)), (1, (240, 240, 240))]:
-                item = table.item(row, col)
-                if item is None:
-                    item = TableWidgetItem()
-                    table.setItem(row, col, item)
-                item.setBackground(qt.QColor(*bg))
-                item.borders['bottom'] = qt.QPen(qt.QColor(50, 50, 50))
-
-        for row in range(2, table.rowCount()):
-            item = table.item(row, 0)
-            if item is not None:
-                item.setBackground(qt.QColor(240, 240, 240))
-
-        table.cellChanged.connect(self.cellChanged)
-        self.solutionsChanged()
-        self.addSolutionItem.sigChanged.connect(self.newSolutionSelected)
+        row = model.rowCount() - 1
+        table.setSpan(row, 0, 1, model.columnCount())
+        table.setIndexWidget(model.index(row, 0), label)
+        self.unitsLabel = label
+
         self.resizeColumns()
-        
-        # update notes table
-        self.ui.notesTree.clear()
-        for recipe in self.recipeSet:
-            item = RecipeNoteItem(recipe)
-            self.ui.notesTree.addTopLevelItem(item)
-        
+
+    def tableDataChanged(self, topLeft, bottomRight):
+        if topLeft.row() == bottomRight.row():
+            # one reagent row changed; only its label can change width noticeably
+            self.resizeColumns([0])
+        else:
+            self.resizeColumns(range(topLeft.column(), bottomRight.column()+1))
             
     def updateRecipeSetList(self):
         rsl = self.ui.recipeSetList
@@ -248,7 +201,7 @@ class RecipeEditorWidget(qt.QWidget):
         rsl.setCurrentItem(item, 0, qt.QItemSelectionModel.SelectCurrent)
             
     def recipeSetItemChanged(self, item, col):
-        item.recipeSet.name = str(item.text(0))
+        item.recipeSet.setField('name', str(item.text(0)))
 
     def recipeSetCopyClicked(self, rsetItem):
         names = [rs.name for rs in self.db.recipes]
@@ -264,74 +217,49 @@ class RecipeEditorWidget(qt.QWidget):
     def recipeSetRemoveClicked(self, rsetItem):
         self.db.recipes.remove(rsetItem.recipeSet)
             
-    def resizeColumns(self):
+    def resizeColumns(self, columns=None):
+        """Resize the given columns (default all) to fit their contents.
+
+        Only rows that are currently visible are measured, and the solution
+        names in the first row are ignored (see RecipeTableModel.data).
+        """
         table = self.ui.recipeTable
         hh = table.horizontalHeader()
-        # temporarily clear header labels to allow correct column resizing
-        xlabels = []
-        for col in range(table.columnCount()):
-            item = table.item(0, col)
-            if item is None:
-                xlabels.append(None)
+        if columns is None:
+            columns = range(self.model.columnCount())
+        for col in columns:
+            kind = self.model.columnInfo(col)[0]
+            if kind in ('addVolume', 'addSolution'):
+                hh.resizeSection(col, 20)
             else:
-                xlabels.append(str(item.text()))
-                item.setText('')
-        
-        # resize columns
-        table.resizeColumnToContents(0)
-        i = 1
-        if self.ui.showMWCheck.isChecked():
-            table.resizeColumnToContents(i)
-            i += 1
-        for sg in self.solutionGroups:
-            for j in range(sg.columns()-1):
-                table.resizeColumnToContents(i)
-                i += 1
-            hh.resizeSection(i, 20)
-            i += 1
-        hh.resizeSection(i, 20)
-        
-        # restore header labels
-        for col, label in enumerate(xlabels):
-            if label is not None:
-                table.item(0, col).setText(label)
+                table.resizeColumnToContents(col)
             
-    def newSolutionSelected(self, item, soln):
+    def newSolutionSelected(self, soln):
         soln = self.db.solutions[soln]
         recipe = Recipe(solution=soln, volumes=[100])
         self.recipeSet.add(recipe)
-        grp = self.mkSolutionGroup(recipe)
-        self.solutionGroups.append(grp)
-        self.updateRecipeTable()
+        self.updateNotes()
+
+    def addVolume(self, recipe):
+        recipe = self.recipeSet[recipe]
+        self.model.setVolumes(recipe, recipe.volumes + [100])
         
-    def stockConcentrationChanged(self, item, conc):
-        if conc is None:
-            self.recipeSet.stocks.pop(item.reagent, None)
-        else:
-            self.recipeSet.stocks[item.reagent] = conc
-        for sg in self.solutionGroups:
-            sg.updateMasses()
+    def stockConcentrationChanged(self, reagent, conc):
+        self.recipeSet.setStock(reagent, conc)
 
     def copyHtml(self):
         table = self.ui.recipeTable
+        model = self.model
         
         # decide which columns to skip
-        skip = []
-        for col in range(table.columnCount()):
-            s = False
-            for row in (0, 1):
-                item = table.item(row, col)
-                if item is not None and str(item.text()) == '+':
-                    s = True
-                    break
-            skip.append(s)
+        skip = [model.columnInfo(col)[0] in ('addVolume', 'addSolution') for col in range(model.columnCount())]
             
         # generate HTML table
         txt = '<div style="font-family: sans-serif"><h2>%s</h2><table>\n' % self.recipeSet.name
-        for row in range(table.rowCount()):
+        for row in range(model.rowCount()):
             txt += '  <tr>\n'
             spanskip = 0
-            for col in range(table.columnCount()):
+            for col in range(model.columnCount()):
                 # skip cell if a previous cell has wide span
                 if spanskip > 0:
                     spanskip -= 1
@@ -340,7 +268,7 @@ class RecipeEditorWidget(qt.QWidget):
                 if skip[col]:
                     continue
                 
-                item = table.item(row, col)
+                index = model.index(row, col)
                 span = table.columnSpan(row, col)
                 spanskip = span - 1
                 for c in range(col+1, col+span):
@@ -348,31 +276,28 @@ class RecipeEditorWidget(qt.QWidget):
                         span -= 1
                 width = table.horizontalHeader().sectionSize(col)
                 
-                if item is None:
-                    w = table.cellWidget(row, col)
-                    if w is None:
-                        t = ''
-                        style = ''
-                    else:
-                        t = str(w.text())
-                        fs = w.font().pointSize()
-                        a = w.alignment()
-                        if a & qt.Qt.AlignRight > 0:
-                            align = 'right'
-                        elif a & qt.Qt.AlignLeft > 0:
-                            align = 'left'
-                        elif a & qt.Qt.AlignCenter > 0:
-                            align = 'center'
-                        style = 'font-size: %dpt; text-align: %s' % (fs, align)
+                w = table.indexWidget(index)
+                if w is not None:
+                    t = str(w.text())
+                    fs = w.font().pointSize()
+                    a = w.alignment()
+                    if a & qt.Qt.AlignRight:
+                        align = 'right'
+                    elif a & qt.Qt.AlignLeft:
+                        align = 'left'
+                    elif a & qt.Qt.AlignCenter:
+                        align = 'center'
+                    style = 'font-size: %dpt; text-align: %s' % (fs, align)
                 else:
-                    t = str(item.text())
-                    bg = item.background().color().name()
-                    fg = item.foreground().color().name()
+                    t = model.data(index)
+                    bg = model.data(index, qt.Qt.BackgroundRole)
+                    fg = model.data(index, qt.Qt.ForegroundRole)
+                    bg = '#ffffff' if bg is None else bg.color().name()
+                    fg = '#000000' if fg is None else fg.color().name()
                     
                     style = 'color: %s; background-color: %s;' % (fg, bg)
-                    if hasattr(item, 'borders'):
-                        for k,v in item.borders.items():
-                            style += ' border-%s: 1px solid %s;' % (k, v.color().name())
+                    for k,v in model.data(index, RecipeTableModel.BorderRole).items():
+                        style += ' border-%s: 1px solid %s;' % (k, v.color().name())
                     
                     
                 txt += '    <td style="font-family: sans-serif; font-size: 10pt; vertical-align: middle; width: %dpx; %s" colspan="%s">%s</td>\n' % (width, style, span, t)
@@ -399,6 +324,300 @@ class RecipeEditorWidget(qt.QWidget):
             qt.QApplication.clipboard().setMimeData(md)
 
 
+class RecipeTableModel(qt.QAbstractTableModel):
+    """Table model showing the reagent masses needed to make each recipe in a
+    RecipeSet.
+
+    Layout:
+
+    * row 0: the solution of each recipe (spanning the recipe's columns), and
+      a final "+" cell for adding a recipe
+    * row 1: column headers (MW, mM and one editable cell per volume), and a
+      "+" cell after each recipe for adding a volume
+    * one row per reagent used by any of the recipes, in reagent table order
+    * a final row for the units label
+
+    Masses for the whole recipe set are computed in one pass by
+    RecipeSet.amounts() when first displayed, and cached until something
+    affecting them changes; a volume edit only repaints one column.
+    """
+    # dict of {'left'|'right'|'top'|'bottom': QPen} drawn by StyleDelegate
+    BorderRole = qt.Qt.UserRole + 1
+
+    def __init__(self, db, parent=None):
+        qt.QAbstractTableModel.__init__(self, parent)
+        self.db = db
+        self.recipeSet = None
+        self.showMW = False
+        self.showConcentration = False
+        self.showFormulae = False
+        self.reagentOrder = []
+        # reagent name -> table row
+        self._rows = {}
+        # (kind, recipe index, volume index) for each column
+        self._columns = []
+        # first column of each recipe
+        self._recipeStart = []
+        # (reagents x volume columns) array from RecipeSet.amounts(), and
+        # (recipe index, volume index) -> column of that array
+        self._amounts = None
+        self._amountColumns = {}
+        self._recipes = []
+        # volumes of each recipe as currently laid out, and stock
+        # concentrations of the recipe set as currently shown
+        self._volumes = []
+        self._stocks = {}
+
+        self._headerBg = [qt.QBrush(qt.QColor(220, 220, 220)), qt.QBrush(qt.QColor(240, 240, 240))]
+        self._white = qt.QBrush(qt.QColor(255, 255, 255))
+        self._black = qt.QBrush(qt.QColor(0, 0, 0))
+        self._blue = qt.QBrush(qt.QColor(0, 0, 200))
+        self._headerBorder = qt.QPen(qt.QColor(50, 50, 50))
+        self._recipeBorder = qt.QPen(qt.QColor(0, 0, 0))
+
+        db.reagents.sigReagentListChanged.connect(self.updateLayout)
+        db.reagents.sigReagentRenamed.connect(self.updateLayout)
+        db.reagents.sigReagentChanged.connect(self.reagentChanged)
+
+    def setRecipeSet(self, recipeSet, showMW=False, showConcentration=False, showFormulae=False):
+        if self.recipeSet is not None:
+            qt.disconnect(self.recipeSet.sigRecipeListChanged, self.updateLayout)
+            qt.disconnect(self.recipeSet.sigStocksChanged, self.stocksChanged)
+        self.recipeSet = recipeSet
+        self.showMW = showMW
+        self.showConcentration = showConcentration
+        self.showFormulae = showFormulae
+        if recipeSet is not None:
+            recipeSet.sigRecipeListChanged.connect(self.updateLayout)
+            recipeSet.sigStocksChanged.connect(self.stocksChanged)
+        self.updateLayout()
+
+    def updateLayout(self):
+        """Recompute the rows and columns of the table.
+
+        This is needed whenever the set of reagents, recipes or volumes
+        changes; all other changes update individual cells.
+        """
+        self.beginResetModel()
+        for recipe in self._recipes:
+            qt.disconnect(recipe.sigChanged, self.recipeChanged)
+            qt.disconnect(recipe.sigVolumesChanged, self.volumesChanged)
+        self._amounts = None
+        self._recipes = [] if self.recipeSet is None else list(self.recipeSet)
+        self._volumes = [list(recipe.volumes) for recipe in self._recipes]
+        self._stocks = {} if self.recipeSet is None else dict(self.recipeSet.stocks)
+        columns = [('reagent', None, None)]
+        if self.showMW:
+            columns.append(('mw', None, None))
+        self._recipeStart = []
+        reagents = set()
+        for i, recipe in enumerate(self._recipes):
+            recipe.sigChanged.connect(self.recipeChanged)
+            recipe.sigVolumesChanged.connect(self.volumesChanged)
+            reagents.update(recipe.solution.reagentList())
+            self._recipeStart.append(len(columns))
+            if self.showConcentration:
+                columns.append(('conc', i, None))
+            for j in range(len(recipe.volumes)):
+                columns.append(('volume', i, j))
+            columns.append(('addVolume', i, None))
+        columns.append(('addSolution', None, None))
+        self._columns = columns
+        self.reagentOrder = [name for name in self.db.reagents.names() if name in reagents]
+        self._rows = dict((name, i+2) for i, name in enumerate(self.reagentOrder))
+        self.endResetModel()
+
+    def columnInfo(self, col):
+        """Return (kind, recipe index, volume index) for a column.
+
+        kind is one of 'reagent', 'mw', 'conc', 'volume', 'addVolume' or 'addSolution'.
+        """
+        return self._columns[col]
+
+    def recipeSpans(self):
+        """Return (first column, number of columns) for each recipe.
+        """
+        ends = self._recipeStart[1:] + [len(self._columns) - 1]
+        return [(start, end - start) for start, end in zip(self._recipeStart, ends)]
+
+    def reagentAt(self, row):
+        """Return the name of the reagent shown in *row*, or None.
+        """
+        if 2 <= row < len(self.reagentOrder) + 2:
+            return self.reagentOrder[row-2]
+        return None
+
+    def rowCount(self, parent=qt.QModelIndex()):
+        if parent.isValid() or self.recipeSet is None:
+            return 0
+        return len(self.reagentOrder) + 3
+
+    def columnCount(self, parent=qt.QModelIndex()):
+        if parent.isValid() or self.recipeSet is None:
+            return 0
+        return len(self._columns)
+
+    def flags(self, index):
+        if not index.isValid():
+            return qt.Qt.NoItemFlags
+        flags = qt.Qt.ItemIsEnabled | qt.Qt.ItemIsSelectable
+        if index.row() == 1 and self._columns[index.column()][0] == 'volume':
+            flags |= qt.Qt.ItemIsEditable
+        return flags
+
+    def data(self, index, role=qt.Qt.DisplayRole):
+        row = index.row()
+        col = index.column()
+        if role in (qt.Qt.DisplayRole, qt.Qt.EditRole):
+            return self._text(row, col)
+        elif role == qt.Qt.BackgroundRole:
+            if row < 2:
+                return self._headerBg[row]
+            if row == len(self.reagentOrder) + 2:
+                return None
+            return self._headerBg[1] if col == 0 else self._white
+        elif role == qt.Qt.ForegroundRole:
+            kind, i, j = self._columns[col]
+            if kind == 'volume' and row >= 2:
+                reagent = self.reagentAt(row)
+                if reagent in self.recipeSet.stocks and not np.isnan(self._amount(row, i, j)):
+                    return self._blue
+            return self._black
+        elif role == qt.Qt.TextAlignmentRole:
+            if row == 0 or (row == 1 and self._columns[col][0] == 'addVolume'):
+                return qt.Qt.AlignCenter
+        elif role == qt.Qt.SizeHintRole:
+            # solution names span several columns; don't let them widen the first one
+            if row == 0:
+                return qt.QSize(0, 0)
+        elif role == self.BorderRole:
+            borders = {}
+            if row < 2:
+                borders['bottom'] = self._headerBorder
+            if row < len(self.reagentOrder) + 2 and (col in self._recipeStart or (row == 0 and self._columns[col][0] == 'addSolution')):
+                borders['left'] = self._recipeBorder
+            return borders
+        return None
+
+    def _text(self, row, col):
+        kind, i, j = self._columns[col]
+        if row == 0:
+            if kind == 'addSolution':
+                return '+'
+            if i is not None and col == self._recipeStart[i]:
+                return self._recipes[i].solution.name
+            return ''
+        elif row == 1:
+            if kind == 'volume':
+                return '%d' % self._recipes[i].volumes[j]
+            return {'mw': 'MW', 'conc': 'mM', 'addVolume': '+'}.get(kind, '')
+        reagent = self.reagentAt(row)
+        if reagent is None:
+            return ''
+        if kind == 'reagent':
+            name = reagent
+            if self.showFormulae:
+                formula = self.db.reagents[reagent]['formula']
+                name = reagent if formula == '' else formula
+            stock = self.recipeSet.stocks.get(reagent, None)
+            return name + ('' if stock is None else ' (%sM)'%formatFloat(stock))
+        elif kind == 'mw':
+            return formatFloat(self.db.reagents[reagent]['molweight'])
+        elif kind == 'conc':
+            conc = self._recipes[i].solution[reagent]
+            return '' if conc is None else formatFloat(conc)
+        elif kind == 'volume':
+            amount = self._amount(row, i, j)
+            if np.isnan(amount) and self._recipes[i].solution[reagent] is None:
+                return ''
+            return formatFloat(float(amount))
+        return ''
+
+    def _amount(self, row, i, j):
+        # mass (or stock volume) of the reagent in *row* for volume j of recipe i
+        if self._amounts is None:
+            reagents, columns, self._amounts = self.recipeSet.amounts(self.reagentOrder)
+            self._amountColumns = dict((key, k) for k, key in enumerate(columns))
+        return self._amounts[row-2, self._amountColumns[(i, j)]]
+
+    def setData(self, index, value, role=qt.Qt.EditRole):
+        kind, i, j = self._columns[index.column()]
+        if role != qt.Qt.EditRole or index.row() != 1 or kind != 'volume':
+            return False
+        recipe = self._recipes[i]
+        vols = list(recipe.volumes)
+        t = str(value).strip()
+        if t == '':
+            # clearing a volume removes it
+            del vols[j]
+        else:
+            try:
+                vols[j] = float(t)
+            except ValueError:
+                return False
+        self.setVolumes(recipe, vols)
+        return True
+
+    def setVolumes(self, recipe, volumes):
+        """Set the volumes of *recipe*; the table is updated by volumesChanged.
+        """
+        recipe.setVolumes(volumes)
+
+    def volumesChanged(self, recipe):
+        """Update the columns of *recipe* after its volumes changed, from this
+        model or elsewhere (scripts, journal replay).
+        """
+        if recipe not in self._recipes:
+            return
+        i = self._recipes.index(recipe)
+        old, volumes = self._volumes[i], recipe.volumes
+        if len(volumes) != len(old):
+            self.updateLayout()
+            return
+        self._volumes[i] = list(volumes)
+        for j, (a, b) in enumerate(zip(old, volumes)):
+            if a == b:
+                continue
+            self._amounts = None
+            col = self._columns.index(('volume', i, j))
+            self.dataChanged.emit(self.index(1, col), self.index(len(self.reagentOrder) + 1, col))
+
+    def stocksChanged(self, recipeSet):
+        """Update the rows of reagents whose stock concentration changed.
+        """
+        old, stocks = self._stocks, recipeSet.stocks
+        self._stocks = dict(stocks)
+        for reagent in set(old) | set(stocks):
+            if old.get(reagent) != stocks.get(reagent):
+                self._updateRow(reagent)
+
+    def reagentChanged(self, reagents, name, field):
+        if field == 'molweight' or (field == 'formula' and self.showFormulae):
+            self._updateRow(name)
+
+    def _updateRow(self, reagent):
+        row = self._rows.get(reagent)
+        if row is None:
+            return
+        self._amounts = None
+        self.dataChanged.emit(self.index(row, 0), self.index(row, len(self._columns) - 1))
+
+    def recipeChanged(self, recipe):
+        # the solution of a recipe (or its composition) changed
+        if recipe not in self._recipes:
+            return
+        reagents = set()
+        for r in self._recipes:
+            reagents.update(r.solution.reagentList())
+        if reagents != set(self.reagentOrder):
+            self.updateLayout()
+            return
+        i = self._recipes.index(recipe)
+        self._amounts = None
+        start, ncols = self.recipeSpans()[i]
+        self.dataChanged.emit(self.index(0, start), self.index(len(self.reagentOrder) + 1, start + ncols - 1))
+
+
 class StyleDelegate(qt.QStyledItemDelegate):
     def __init__(self, table):
         qt.QStyledItemDelegate.__init__(self)
@@ -406,21 +625,10 @@ class StyleDelegate(qt.QStyledItemDelegate):
     
     def paint(self, painter, option, index):
         qt.QStyledItemDelegate.paint(self, painter, option, index)
-        item = self.table.item(index.row(), index.column())
-        if hasattr(item, 'paint'):
-            item.paint(painter, option)
-            
-
-class TableWidgetItem(qt.QTableWidgetItem):
-    def __init__(self, *args):
-        qt.QTableWidgetItem.__init__(self, *args)
-        # need this because cells report their background incorrectly
-        # if it hasn't been set
-        self.setBackground(qt.QColor(255, 255, 255))
-        self.borders = {}
-        
-    def paint(self, painter, option):
-        for border, pen in self.borders.items():
+        borders = index.data(RecipeTableModel.BorderRole)
+        if not borders:
+            return
+        for border, pen in borders.items():
             painter.setPen(pen)
             if border == 'left':
                 a,b = option.rect.topLeft(), option.rect.bottomLeft()
@@ -433,135 +641,22 @@ class TableWidgetItem(qt.QTableWidgetItem):
             painter.drawLine(a, b)
 
 
-class SolutionItemGroup(qt.QObject):
-    sigRecipeChanged = qt.Signal(object)  # self
-    sigSolutionChanged = qt.Signal(object, object)  # self, soln
-    
-    def __init__(self, table, recipeSet, recipe, db, showConc=False):
-        qt.QObject.__init__(self)
-        self.db = db
-        self.table = table
-        self.recipe = recipe
-        self.recipeSet = recipeSet
-        self.showConc = showConc
-        
-        self.recipe.sigChanged.connect(lambda: self.sigRecipeChanged.emit(self))
-        
-    def columns(self):
-        return len(self.recipe.volumes) + 1 + int(self.showConc)
-    
-    def setupItems(self, col=None):
-        if col is not None:
-            self.column = col
-        col = self.column
-        
-        self.solutionItem = SolutionItem(self.recipe.solution.name)
-        self.solutionItem.sigChanged.connect(self.solutionChanged)
-        self.table.setSpan(0, col, 1, self.columns())
-        self.table.setItem(0, col, self.solutionItem)
-        self.volumeItems = []
-        self.reagentItems = {r:[] for r in self.reagentOrder}
-
-        if self.showConc:
-            header = TableWidgetItem('mM')
-            self.table.setItem(1, col, header)
-            for row, reagent in enumerate(self.reagentOrder):
-                conc = self.recipe.solution[reagent]
-                conc = '' if conc is None else formatFloat(conc)
-                ritem = TableWidgetItem(conc)
-                self.table.setItem(row+2, col, ritem)
-            col += 1
-            
-        for j, vol in enumerate(self.recipe.volumes):
-            vitem = EditableItem('%d' % vol)
-            #vitem.setBackgroundColor(qt.QColor(240, 240, 240))
-            #vitem.borders['bottom'] = qt.QPen(qt.QColor(50, 50, 50))
-            self.volumeItems.append(vitem)
-            self.table.setItem(1, col+j, vitem)
-            vitem.sigChanged.connect(self.volumeChanged)
-            for row, reagent in enumerate(self.reagentOrder):
-                ritem = TableWidgetItem('')
-                self.reagentItems[reagent].append(ritem)
-                self.table.setItem(row+2, col+j, ritem)
-        
-        self.updateMasses()
-            
-        self.addVolumeItem = TableAdderItem()
-        #self.addVolumeItem.setBackgroundColor(qt.QColor(240, 240, 240))
-        #self.addVolumeItem.borders['bottom'] = qt.QPen(qt.QColor(50, 50, 50))
-        
-        for row in range(len(self.reagentOrder) + 2):
-            item = self.table.item(row, self.column)
-            if item is not None:
-                item.borders['left'] = qt.QPen(qt.QColor(0, 0, 0))
-        
-        self.addVolumeItem.sigClicked.connect(self.addVolumeClicked)
-        self.table.setItem(1, col+len(self.recipe.volumes), self.addVolumeItem)    
-        
-    def updateMasses(self):
-        reagents = self.recipe.solution.reagents
-        for j, vol in enumerate(self.recipe.volumes):
-            for reagent, conc in reagents.items():
-                stock = self.recipeSet.stocks.get(reagent, None)
-                item = self.reagentItems[reagent][j]
-                if stock is None:
-                    mw = self.db.reagents[reagent]['molweight']
-                    mass = float((vol * 1e-3) * (conc * 1e-3) * (mw * 1e3))
-                    item.setText(formatFloat(mass))
-                    item.setForeground(qt.QColor(0, 0, 0))
-                else:
-                    rvol = float((vol * 1e-3) * (conc * 1e-3) / (stock * 1e-3))
-                    item.setText(formatFloat(rvol))
-                    item.setForeground(qt.QColor(0, 0, 200))
-        
-    def addVolumeClicked(self):
-        self.recipe.volumes.append(100)
-        self.sigRecipeChanged.emit(self)
-
-    def volumeChanged(self):
-        vols = []
-        for i, item in enumerate(self.volumeItems):
-            t = str(item.text())
-            if t == '':
-                continue
-            else:
-                try:
-                    v = float(t)
-                except:
-                    v = self.recipe.volumes[i]
-            vols.append(v)
-
-        if len(vols) != self.recipe.volumes:
-            self.recipe.volumes = vols
-            self.sigRecipeChanged.emit(self)
-        else:
-            self.recipe.volumes = vols
-            self.updateMasses()
-        
-    def solutionChanged(self, item, soln):
-        self.sigSolutionChanged.emit(self, soln)
-        
-
-class SolutionItem(TableWidgetItem):
-    def __init__(self, soln='+', removable=True):
+class SolutionMenu(qt.QMenu):
+    """Popup menu listing all solutions, grouped.
+    """
+    def __init__(self, removable=True):
         class SigProxy(qt.QObject):
-            sigChanged = qt.Signal(object, object)
-        self._sigprox = SigProxy()
-        self.sigChanged = self._sigprox.sigChanged
-
+            sigSelected = qt.Signal(object)  # solution name or '[remove]'
+        qt.QMenu.__init__(self)
+        self.__sigprox = SigProxy()
+        self.sigSelected = self.__sigprox.sigSelected
         self.removable = removable
-        TableWidgetItem.__init__(self, soln)
-        self.menu = qt.QMenu()
-        self.setTextAlignment(qt.Qt.AlignCenter)
-        #self.borders['bottom'] = qt.QPen(qt.QColor(50, 50, 50))
-        self.borders['left'] = qt.QPen(qt.QColor(0, 0, 0))
-        #self.setBackgroundColor(qt.QColor(230, 230, 230))
         
     def setAllSolutions(self, solutions):
         # list of solutions to show in dropdown menu
-        self.menu.clear()
+        self.clear()
         if self.removable:
-            self.menu.addAction('[remove]', self.selectionChanged)
+            self.addAction('[remove]', self.selectionChanged)
             
         # sort all solutions into groups
         grps = OrderedDict()
@@ -576,50 +671,16 @@ class SolutionItem(TableWidgetItem):
             font = label.font()
             font.setWeight(font.Bold)
             label.setFont(font)
-            act = qt.QWidgetAction(self.menu)
+            act = qt.QWidgetAction(self)
             act.setDefaultWidget(label)
-            self.menu.addAction(act)
+            self.addAction(act)
             for soln in solns:
-                self.menu.addAction("  " + soln.name, self.selectionChanged)
+                self.addAction("  " + soln.name, self.selectionChanged)
             
     def selectionChanged(self):
-        action = self.tableWidget().sender()
+        action = self.sender()
         text = str(action.text()).strip()
-        self.sigChanged.emit(self, text)
-
-    def itemClicked(self):
-        # popup menu when clicked
-        tw = self.tableWidget()
-        x = tw.verticalHeader().width() + tw.horizontalHeader().sectionPosition(tw.column(self))
-        y = tw.horizontalHeader().height() + tw.visualItemRect(self).bottom()
-        self.menu.popup(tw.mapToGlobal(qt.QPoint(x, y)))
-
-
-class TableAdderItem(TableWidgetItem):
-    def __init__(self):
-        class SigProxy(qt.QObject):
-            sigClicked = qt.Signal(object)
-        self.__sigprox = SigProxy()
-        self.sigClicked = self.__sigprox.sigClicked
-
-        TableWidgetItem.__init__(self, '+')
-        self.setTextAlignment(qt.Qt.AlignCenter)
-        
-    def itemClicked(self):
-        self.sigClicked.emit(self)
-
-
-class EditableItem(TableWidgetItem):
-    def __init__(self, text):
-        class SigProxy(qt.QObject):
-            sigChanged = qt.Signal(object)
-        self.__sigprox = SigProxy()
-        self.sigChanged = self.__sigprox.sigChanged
-
-        TableWidgetItem.__init__(self, text)
-        
-    def itemChanged(self):
-        self.sigChanged.emit(self)
+        self.sigSelected.emit(text)
 
 
 class LabeledLineEdit(qt.QWidget):
@@ -637,47 +698,38 @@ class LabeledLineEdit(qt.QWidget):
         self.editingFinished = self.text.editingFinished
 
 
-class ReagentItem(TableWidgetItem):
-    def __init__(self, reagent, stock):
+class StockMenu(qt.QMenu):
+    """Popup menu for editing the stock concentration of a reagent.
+    """
+    def __init__(self):
         class SigProxy(qt.QObject):
-            sigStockConcentrationChanged = qt.Signal(object, object)
+            sigStockConcentrationChanged = qt.Signal(object, object)  # reagent, conc
+        qt.QMenu.__init__(self)
         self.__sigprox = SigProxy()
         self.sigStockConcentrationChanged = self.__sigprox.sigStockConcentrationChanged
-
-        TableWidgetItem.__init__(self, '')
-        self.reagent = reagent
+        self.reagent = None
         
-        self.menu = qt.QMenu()
-        self.action = qt.QWidgetAction(self.menu)
-        self.concEdit = LabeledLineEdit('Stock concentration:', self.menu)
+        self.action = qt.QWidgetAction(self)
+        self.concEdit = LabeledLineEdit('Stock concentration:', self)
         self.concEdit.text.setPlaceholderText('[ none ]')
-        if stock is not None:
-            self.concEdit.text.setText(formatFloat(stock))
         self.action.setDefaultWidget(self.concEdit)
-        self.menu.addAction(self.action)
+        self.addAction(self.action)
         self.concEdit.editingFinished.connect(self.stockTextChanged)
-        
-        self.updateText(stock)
-        
-    def updateText(self, stock):
-        text = self.reagent + ('' if stock is None else ' (%sM)'%formatFloat(stock))
-        self.setText(text)
-        
-    def itemClicked(self):
-        tw = self.tableWidget()
-        x = tw.verticalHeader().width() + tw.horizontalHeader().sectionPosition(tw.column(self))
-        y = tw.horizontalHeader().height() + tw.visualItemRect(self).bottom()
-        self.menu.popup(tw.mapToGlobal(qt.QPoint(x, y)))
+
+    def setReagent(self, reagent, stock):
+        self.reagent = reagent
+        self.concEdit.text.setText('' if stock is None else formatFloat(stock))
         
     def stockTextChanged(self):
+        if not self.isVisible():
+            return
         t = str(self.concEdit.text.text())
         if t == '':
             conc = None
         else:
             conc = float(t)
-        self.updateText(conc)
-        self.sigStockConcentrationChanged.emit(self, conc)
-        self.menu.hide()
+        self.hide()
+        self.sigStockConcentrationChanged.emit(self.reagent, conc)
 
 
 class RecipeSetItem(qt.QTreeWidgetItem):
@@ -720,9 +772,9 @@ class RecipeNoteItem(pg.TreeWidgetItem):
         
     def textChanged(self):
         if str(self.editor.toPlainText()).strip() == '':
-            self.recipe.notes = None
+            self.recipe.setNotes(None)
         else:
-            self.recipe.notes = str(self.editor.toHtml())
+            self.recipe.setNotes(str(self.editor.toHtml()))
     
     def noteHtml(self):
         if str(self.editor.toPlainText()).strip() == '':
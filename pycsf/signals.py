@@ -0,0 +1,110 @@
+"""Minimal pure-Python replacement for Qt signals.
+
+The core model classes only need QObject/Signal for notifying views of
+changes. When no GUI is running, the classes here are used instead so that
+the core can be imported and used without Qt (see qtActive()).
+
+The interface follows the subset of PyQt signals used by pycsf: connect(),
+disconnect() and emit(). Like PyQt, slots that accept fewer arguments than
+the signal provides are called with only as many arguments as they accept,
+and connections to bound methods do not keep the receiver alive.
+"""
+import os, sys, inspect, weakref
+
+
+def qtActive():
+    """Return True if the core model should use Qt signals.
+
+    The PYCSF_QT environment variable may be set to "1" or "0" to force the
+    choice. Otherwise, Qt is used only if the pycsf.qt wrapper has already been
+    imported, which is the case when the GUI modules are loaded.
+    """
+    env = os.environ.get('PYCSF_QT', '')
+    if env != '':
+        return env not in ('0', 'false', 'no')
+    return 'pycsf.qt' in sys.modules
+
+
+class QObject(object):
+    def __init__(self, parent=None):
+        pass
+
+
+class Signal(object):
+    """Class attribute declaring a signal, as with Qt's Signal.
+    """
+    def __init__(self, *types):
+        self.types = types
+        self.name = None
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        # cache the bound signal in the instance so that the descriptor is
+        # only consulted on first access
+        bound = BoundSignal(self)
+        obj.__dict__[self.name] = bound
+        return bound
+
+
+class BoundSignal(object):
+    def __init__(self, signal):
+        self.signal = signal
+        self._slots = []  # [(ref, nargs), ...]
+
+    def connect(self, slot):
+        if inspect.ismethod(slot):
+            ref = weakref.WeakMethod(slot)
+        else:
+            ref = _StrongRef(slot)
+        self._slots.append((ref, _maxArgs(slot)))
+
+    def disconnect(self, slot=None):
+        live = [(ref, nargs) for ref, nargs in self._slots if ref() is not None]
+        if slot is None:
+            keep = []
+        else:
+            keep = [(ref, nargs) for ref, nargs in live if ref() != slot]
+        if len(keep) == len(live):
+            raise TypeError("disconnect() failed between '%s' and %s" % (self.signal.name, 'all its connections' if slot is None else slot))
+        self._slots = keep
+
+    def emit(self, *args):
+        dead = False
+        for ref, nargs in self._slots[:]:
+            fn = ref()
+            if fn is None:
+                dead = True
+                continue
+            fn(*args[:nargs])
+        if dead:
+            self._slots = [s for s in self._slots if s[0]() is not None]
+
+
+class _StrongRef(object):
+    # same interface as weakref.ref, for slots that must be kept alive
+    def __init__(self, obj):
+        self.obj = obj
+
+    def __call__(self):
+        return self.obj
+
+
+def _maxArgs(fn):
+    """Return the maximum number of positional arguments accepted by fn, or
+    None if there is no limit (or it cannot be determined).
+    """
+    try:
+        sig = inspect.signature(fn)
+    except (TypeError, ValueError):
+        return None
+    n = 0
+    for param in sig.parameters.values():
+        if param.kind == param.VAR_POSITIONAL:
+            return None
+        if param.kind in (param.POSITIONAL_ONLY, param.POSITIONAL_OR_KEYWORD):
+            n += 1
+    return n
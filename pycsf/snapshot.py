@@ -0,0 +1,240 @@
+"""Binary snapshots of a SolutionDatabase.
+
+A snapshot is a directory of ``.npy`` files that can be loaded without any
+parsing, or memory-mapped read-only by any number of processes::
+
+    db.saveSnapshot('lab.snap')
+
+    # later, in another process
+    db = SolutionDatabase()
+    db.loadSnapshot('lab.snap')        # restore the full database
+
+    snap = openSnapshot('lab.snap')    # or map the arrays for analysis
+    ions, osm = snap.calculate()
+
+Contents:
+
+* ``reagents_numeric.npy``: (reagents x fields) float array of the numeric
+  reagent fields (molweight, osmconst and one column per ion)
+* ``reagents_strings.npy``, ``solutions_strings.npy``: indices into the
+  string table for each text field (-1 for None)
+* ``composition_indptr.npy``, ``composition_indices.npy``,
+  ``composition_values.npy``: the (solutions x reagents) concentration
+  matrix in CSR form. Column indices beyond the end of the reagent table
+  refer to reagents that are used by a solution but missing from the table.
+* ``strings.npy``: the string table, as NUL-separated UTF-8 bytes
+* ``meta.json``: field names and the (small) recipe data
+"""
+import os, json, shutil, tempfile
+import numpy as np
+from . import composition
+
+FORMAT = 1
+
+_SOLUTION_FIELDS = ['name', 'group', 'type', 'compareAgainst', 'notes']
+
+
+class _StringTable(object):
+    def __init__(self):
+        self.strings = []
+        self.index = {}
+
+    def add(self, s, field=None):
+        if s is None:
+            return -1
+        if not isinstance(s, str):
+            # storing str(s) would not restore the same value
+            raise TypeError("Cannot store %s value %r%s in a snapshot; only strings and None are supported." %
+                            (type(s).__name__, s, '' if field is None else " (field '%s')" % field))
+        i = self.index.get(s)
+        if i is None:
+            if '\0' in s:
+                raise ValueError("Cannot store string containing NUL character: %r" % s)
+            i = len(self.strings)
+            self.strings.append(s)
+            self.index[s] = i
+        return i
+
+    def toArray(self):
+        return np.frombuffer('\0'.join(self.strings).encode('utf-8'), dtype=np.uint8)
+
+
+def writeSnapshot(db, dirname):
+    """Write a snapshot of *db* to the directory *dirname*.
+
+    The snapshot is written to a temporary directory and then moved into
+    place; processes that have mapped the previous snapshot keep their
+    (unchanged) view of it.
+    """
+    reagents = db.reagents._data
+    fields = reagents.dtype.names
+    numericFields = [f for f in fields if reagents.dtype[f].kind == 'f']
+    stringFields = [f for f in fields if f not in numericFields]
+    strings = _StringTable()
+    arrays = {}
+
+    arrays['reagents_numeric'] = np.column_stack([reagents[f] for f in numericFields]).astype(float).reshape(len(reagents), len(numericFields))
+    arrays['reagents_strings'] = np.array([[strings.add(v, f) for v in reagents[f]] for f in stringFields], dtype=np.int32).T.reshape(len(reagents), len(stringFields))
+
+    solutions = list(db.solutions)
+    arrays['solutions_strings'] = np.array([[strings.add(getattr(s, f), f) for f in _SOLUTION_FIELDS] for s in solutions], dtype=np.int32).reshape(len(solutions), len(_SOLUTION_FIELDS))
+
+    # composition matrix; entries are stored in the same (sorted) order as
+    # in Solution.save(), so sums are computed in the same order after loading
+    index = db.reagents._index
+    extra = {}
+    indptr = [0]
+    indices = []
+    values = []
+    for soln in solutions:
+        reagentState = soln.save()['reagents']
+        for name, conc in reagentState.items():
+            j = index.get(name)
+            if j is None:
+                j = extra.setdefault(name, len(reagents) + len(extra))
+            indices.append(j)
+            values.append(conc)
+        indptr.append(len(indices))
+    arrays['composition_indptr'] = np.array(indptr, dtype=np.int64)
+    arrays['composition_indices'] = np.array(indices, dtype=np.int64)
+    arrays['composition_values'] = np.array(values, dtype=float)
+    arrays['strings'] = strings.toArray()
+
+    meta = {
+        'format': FORMAT,
+        'numericFields': numericFields,
+        'stringFields': stringFields,
+        'solutionFields': _SOLUTION_FIELDS,
+        'extraReagents': sorted(extra, key=extra.get),
+        'recipes': db.recipes.save(),
+    }
+
+    parent = os.path.dirname(os.path.abspath(dirname))
+    tmpdir = tempfile.mkdtemp(dir=parent, prefix='.snapshot-')
+    try:
+        for name, arr in arrays.items():
+            np.save(os.path.join(tmpdir, name + '.npy'), arr)
+        with open(os.path.join(tmpdir, 'meta.json'), 'w') as fh:
+            json.dump(meta, fh)
+        # mkdtemp creates the directory readable only by its owner; give it
+        # the usual permissions so that other users can map the snapshot
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(tmpdir, 0o777 & ~umask)
+        if os.path.exists(dirname):
+            old = tempfile.mkdtemp(dir=parent, prefix='.snapshot-old-')
+            os.rmdir(old)
+            os.rename(dirname, old)
+            os.rename(tmpdir, dirname)
+            shutil.rmtree(old)
+        else:
+            os.rename(tmpdir, dirname)
+    except Exception:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+        raise
+
+
+def openSnapshot(dirname, mmap=True):
+    """Open a snapshot written by SolutionDatabase.saveSnapshot().
+
+    If *mmap* is True, arrays are memory-mapped read-only, so that they are
+    shared between all processes that open the same snapshot.
+    """
+    return Snapshot(dirname, mmap=mmap)
+
+
+class Snapshot(object):
+    """Read-only view of a database snapshot.
+
+    Numeric data are exposed as (optionally memory-mapped) arrays:
+    ``reagentsNumeric``, ``compositionIndptr``, ``compositionIndices`` and
+    ``compositionValues``. Strings are decoded on first access.
+    """
+    def __init__(self, dirname, mmap=True):
+        self.dirname = dirname
+        with open(os.path.join(dirname, 'meta.json')) as fh:
+            self.meta = json.load(fh)
+        if self.meta['format'] != FORMAT:
+            raise ValueError("Unsupported snapshot format %r" % self.meta['format'])
+        mode = 'r' if mmap else None
+        load = lambda name: np.load(os.path.join(dirname, name + '.npy'), mmap_mode=mode)
+        self.reagentsNumeric = load('reagents_numeric')
+        self.reagentsStrings = load('reagents_strings')
+        self.solutionsStrings = load('solutions_strings')
+        self.compositionIndptr = load('composition_indptr')
+        self.compositionIndices = load('composition_indices')
+        self.compositionValues = load('composition_values')
+        self._stringData = load('strings')
+        self._strings = None
+
+    @property
+    def strings(self):
+        """The decoded string table.
+        """
+        if self._strings is None:
+            data = np.asarray(self._stringData).tobytes().decode('utf-8')
+            self._strings = data.split('\0')
+        return self._strings
+
+    def _stringColumn(self, ids):
+        strings = self.strings
+        return [None if i < 0 else strings[i] for i in ids.tolist()]
+
+    def reagentColumns(self):
+        """Return the reagent table as a dict of per-field arrays/lists, as
+        accepted by Reagents.restore().
+        """
+        columns = {}
+        for i, f in enumerate(self.meta['numericFields']):
+            columns[f] = self.reagentsNumeric[:, i]
+        for i, f in enumerate(self.meta['stringFields']):
+            columns[f] = self._stringColumn(self.reagentsStrings[:, i])
+        return columns
+
+    def reagentNames(self):
+        return self._stringColumn(self.reagentsStrings[:, self.meta['stringFields'].index('name')])
+
+    def solutionNames(self):
+        return self._stringColumn(self.solutionsStrings[:, 0])
+
+    def solutionStates(self):
+        """Yield the saved state of each solution, as accepted by Solutions.restore().
+        """
+        names = self.reagentNames() + self.meta['extraReagents']
+        columns = [self._stringColumn(self.solutionsStrings[:, i]) for i in range(len(_SOLUTION_FIELDS))]
+        indptr = self.compositionIndptr.tolist()
+        indices = self.compositionIndices.tolist()
+        values = self.compositionValues.tolist()
+        for i, fields in enumerate(zip(*columns)):
+            state = dict(zip(self.meta['solutionFields'], fields))
+            a, b = indptr[i], indptr[i+1]
+            state['reagents'] = dict(zip([names[j] for j in indices[a:b]], values[a:b]))
+            yield state
+
+    def dissociationMatrix(self):
+        """Return the (reagents x IONS+1) dissociation matrix (see
+        composition.dissociationMatrix).
+        """
+        fields = self.meta['numericFields']
+        ions = [f for f in fields if f not in ('molweight', 'osmconst')]
+        return self.reagentsNumeric[:, [fields.index(f) for f in ions + ['osmconst']]]
+
+    def concentrationMatrix(self):
+        """Return the composition of all solutions as a composition.ConcentrationMatrix.
+
+        Reagents that are missing from the reagent table are left out.
+        """
+        nreagents = len(self.reagentsNumeric)
+        counts = np.diff(self.compositionIndptr)
+        rows = np.repeat(np.arange(len(counts)), counts)
+        cols = np.asarray(self.compositionIndices)
+        mask = cols < nreagents
+        return composition.ConcentrationMatrix.fromArrays(rows[mask], cols[mask], np.asarray(self.compositionValues)[mask],
+                                                          (len(counts), nreagents))
+
+    def calculate(self):
+        """Return the (solutions x IONS) ion concentrations and osmolarity of
+        all solutions, as Solutions.calculate() would.
+        """
+        result = self.concentrationMatrix().dot(self.dissociationMatrix())
+        return result[:, :-1], result[:, -1]
@@ -1,4 +1,5 @@
 import os
+import numpy as np
 import pyqtgraph as pg
 from . import qt
 from .core import IONS
@@ -13,6 +14,11 @@ class SolutionEditorWidget(qt.QWidget):
         self.db = db
         self.selectedSolutions = []
         self.showAllReagents = False
+        self.reagentItems = {}
+        self.reagentGroupItems = {}
+        self.treeStats = {}
+        self._treeLabels = []
+        self._treeShowGroups = None
         
         qt.QWidget.__init__(self, parent)
         self.ui = Ui_solutionEditor()
@@ -81,6 +87,8 @@ class SolutionEditorWidget(qt.QWidget):
         self.reverseAgainstItem.sigChanged.connect(self.recalculate)
         self.ui.notesText.textChanged.connect(self.notesTextChanged)
         self.ui.copyHtmlBtn.clicked.connect(self.copyHtml)
+        self.ui.reversalMatrixBtn.clicked.connect(self.showReversalMatrix)
+        self.reversalMatrixWindow = None
 
         self.ui.solutionTable.itemSelectionChanged.connect(self.selectionChanged)
         self.ui.solutionTable.itemClicked.connect(self.itemClicked)
@@ -89,7 +97,7 @@ class SolutionEditorWidget(qt.QWidget):
         self.db.solutions.solutionListChanged.connect(self.updateSolutionList)
         self.db.reagents.sigReagentListChanged.connect(self.updateSolutionTree)
         self.db.reagents.sigReagentDataChanged.connect(self.updateSolutionTree)
-        self.db.reagents.sigReagentRenamed.connect(self.updateSolutionTree)
+        self.db.reagents.sigReagentRenamed.connect(self.reagentRenamed)
 
         self.updateSolutionList()
 
@@ -114,7 +122,7 @@ class SolutionEditorWidget(qt.QWidget):
         if len(items) == 0:
             return
         item = items[0]
-        item.solution.notes = str(self.ui.notesText.toHtml())
+        item.solution.setField('notes', str(self.ui.notesText.toHtml()))
         
     def selectionChanged(self):
         selection = self.ui.solutionTable.selectionModel().selection().indexes()
@@ -196,7 +204,7 @@ class SolutionEditorWidget(qt.QWidget):
     def solutionListTextChanged(self, item, column):
         if isinstance(item, GroupItem):
             for child in item.childItems():
-                child.solution.group = str(item.text(0))
+                child.solution.setField('group', str(item.text(0)))
         else:
             new = str(item.text(0))
             # Note: disconnect here prevents a segfault. Something to do with
@@ -241,56 +249,110 @@ class SolutionEditorWidget(qt.QWidget):
         self.showAllReagents = not self.showAllReagents
         self.updateSolutionTree()
 
+    def reagentRenamed(self, reagents, old, new):
+        # keep the existing row for a renamed reagent
+        item = self.reagentItems.pop(old, None)
+        if item is not None:
+            item.name = new
+            self.reagentItems[new] = item
+        self.updateSolutionTree()
+
     def updateSolutionTree(self):
+        """Bring the solution tree up to date with the selected solutions and
+        the reagent table.
+
+        Existing rows are kept; only rows for reagents that appeared or
+        disappeared are added or removed, and only cells whose concentration
+        changed are redrawn. The number of rows created, removed and updated is
+        stored in self.treeStats.
+        """
         table = self.ui.solutionTable
         vpos = table.verticalScrollBar().value()
-        table.setColumnCount(len(self.selectedSolutions) + 1)
-        table.setHeaderLabels([''] + [s.name for s in self.selectedSolutions])
+        solutions = self.selectedSolutions
+        labels = [''] + [s.name for s in solutions]
+        resize = set()
+        if labels != self._treeLabels:
+            table.setColumnCount(len(labels))
+            table.setHeaderLabels(labels)
+            old = self._treeLabels
+            resize.update(i for i in range(len(labels)) if i >= len(old) or old[i] != labels[i])
+            self._treeLabels = labels
         
         # collect a list of all reagents in all selected solutions
         reagentTree = self.solnTreeItems['Concentrations (mM)']
-        reagentTree.clear()
-        reagents = set()
-        for soln in self.selectedSolutions:
-            reagents = reagents | set(soln.reagentList())
+        used = set()
+        for soln in solutions:
+            used.update(soln.reagentList())
         # check for unknown reagents
         allReagents = self.db.reagents.names()
-        unknown = [r for r in reagents if r not in allReagents]
+        unknown = used.difference(allReagents)
         # sort
         if self.showAllReagents:
-            reagents = list(allReagents) + unknown
+            reagents = list(allReagents) + sorted(unknown)
             showGroups = True
         else:
-            reagents = [x for x in allReagents if x in reagents] + unknown
+            reagents = [x for x in allReagents if x in used] + sorted(unknown)
             showGroups = False
-        
-        # update reagent list
-        self.reagentItems = {}
-        grpItems = {}
+
+        stats = {'created': 0, 'removed': 0, 'updated': 0}
+        if showGroups != self._treeShowGroups:
+            # switching between flat and grouped layout; start over
+            stats['removed'] = len(self.reagentItems)
+            reagentTree.clear()
+            self.reagentItems = {}
+            self.reagentGroupItems = {}
+            self._treeShowGroups = showGroups
+
+        # remove rows for reagents that are no longer shown
+        wanted = set(reagents)
+        for name in [n for n in self.reagentItems if n not in wanted]:
+            item = self.reagentItems.pop(name)
+            item.parent().removeChild(item)
+            stats['removed'] += 1
+            resize.update(item.filledColumns())
+
+        # add new rows, and move or refresh existing ones
+        positions = {}  # id(parent): number of children placed so far
         for reagent in reagents:
-            #concs = ['%0.1f'%soln.reagents[reagent] if reagent in soln.reagents else '' for soln in self.selectedSolutions]
-            #item = qt.QTreeWidgetItem([reagent] + concs)
-            item = ReagentItem(reagent, self.selectedSolutions)
-            item.sigChanged.connect(self.recalculate)
-            self.reagentItems[reagent] = item
-            if reagent in unknown:
-                item.setForeground(0, qt.QColor(200, 0, 0))
-                
             if showGroups:
                 if reagent in unknown:
                     grp = 'Unknown reagents'
                 else:
                     grp = self.db.reagents[reagent]['group']
-                if grp in grpItems:
-                    grpItems[grp].addChild(item)
-                else:
-                    grpItem = qt.QTreeWidgetItem([grp])
-                    reagentTree.addChild(grpItem)
-                    grpItems[grp] = grpItem
-                    grpItem.addChild(item)
-                    grpItem.setExpanded(True)
+                parent = self.reagentGroupItems.get(grp)
+                if parent is None:
+                    parent = qt.QTreeWidgetItem([grp])
+                    self.reagentGroupItems[grp] = parent
+                    self._placeItem(reagentTree, len(positions), parent)
+                    parent.setExpanded(True)
+                elif id(parent) not in positions:
+                    self._placeItem(reagentTree, len(positions), parent)
             else:
-                reagentTree.addChild(item)
+                parent = reagentTree
+            index = positions.setdefault(id(parent), 0)
+            positions[id(parent)] = index + 1
+
+            item = self.reagentItems.get(reagent)
+            if item is None:
+                item = ReagentItem(reagent, solutions)
+                item.sigChanged.connect(self.recalculate)
+                self.reagentItems[reagent] = item
+                stats['created'] += 1
+                resize.update(item.filledColumns())
+            else:
+                changed = item.refresh(solutions)
+                if len(changed) > 0:
+                    stats['updated'] += 1
+                    resize.update(changed)
+            item.setUnknown(reagent in unknown)
+            self._placeItem(parent, index, item)
+
+        # remove groups that no longer contain any shown reagents
+        for grp, item in list(self.reagentGroupItems.items()):
+            if id(item) not in positions:
+                reagentTree.removeChild(item)
+                del self.reagentGroupItems[grp]
+        self.treeStats = stats
 
         # Set measured ion concentration values
         # (todo)
@@ -300,15 +362,26 @@ class SolutionEditorWidget(qt.QWidget):
         self.recalculate()
         
         # update reversal potential special fields
-        self.solutionTypeItem.setSolutions(self.selectedSolutions)
-        self.reverseAgainstItem.setSolutions(self.selectedSolutions)
+        self.solutionTypeItem.setSolutions(solutions)
+        self.reverseAgainstItem.setSolutions(solutions)
 
-        # resize columns
-        for i in range(len(self.selectedSolutions)+1):
+        # resize only columns whose contents changed
+        for i in sorted(resize):
             table.resizeColumnToContents(i)
 
         table.verticalScrollBar().setValue(vpos)
 
+    def _placeItem(self, parent, index, item):
+        # make *item* the child of *parent* at *index*, moving it if necessary
+        if parent.child(index) is item:
+            return
+        expanded = item.isExpanded()
+        oldParent = item.parent()
+        if oldParent is not None:
+            oldParent.removeChild(item)
+        parent.insertChild(index, item)
+        item.setExpanded(expanded)
+
     def recalculate(self):
         results = self.db.solutions.recalculate(self.selectedSolutions, self.ui.reverseTempSpin.value())
         for i, soln in enumerate(self.selectedSolutions):
@@ -322,6 +395,15 @@ class SolutionEditorWidget(qt.QWidget):
                     
             self.solnTreeItems['Osmolarity (estimated)'].setText(i+1, formatFloat(osm))
 
+    def showReversalMatrix(self):
+        if self.reversalMatrixWindow is None:
+            self.reversalMatrixWindow = ReversalMatrixWindow(self.db)
+            self.ui.reverseTempSpin.valueChanged.connect(self.reversalMatrixWindow.tempSpin.setValue)
+        win = self.reversalMatrixWindow
+        win.tempSpin.setValue(self.ui.reverseTempSpin.value())
+        win.show()
+        win.raise_()
+
     def copyHtml(self):
         txt = '<table>\n'
         txt += self._itemToHtml(self.ui.solutionTable, self.ui.solutionTable.headerItem())
@@ -367,9 +449,45 @@ class ReagentItem(pg.TreeWidgetItem):
 
         self.name = name
         self.solutions = solutions
-        pg.TreeWidgetItem.__init__(self, [name] + [formatFloat(sol[name]) if name in sol.reagentList() else '' for sol in solutions])
+        self._values = [sol[name] for sol in solutions]
+        self._unknown = False
+        pg.TreeWidgetItem.__init__(self, [name] + ['' if v is None else formatFloat(v) for v in self._values])
         self.setFlags(self.flags() | qt.Qt.ItemIsEditable)
 
+    def refresh(self, solutions):
+        """Update the displayed concentrations for a new list of solutions.
+
+        Return the list of columns whose text changed.
+        """
+        self.solutions = solutions
+        values = [sol[self.name] for sol in solutions]
+        old = self._values
+        changed = []
+        if self.text(0) != self.name:
+            self.setText(0, self.name)
+            changed.append(0)
+        for i, v in enumerate(values):
+            if i < len(old) and old[i] == v:
+                continue
+            self.setText(i+1, '' if v is None else formatFloat(v))
+            changed.append(i+1)
+        self._values = values
+        return changed
+
+    def filledColumns(self):
+        """Return the columns that contain text.
+        """
+        return [0] + [i+1 for i, v in enumerate(self._values) if v is not None]
+
+    def setUnknown(self, unknown):
+        if unknown == self._unknown:
+            return
+        self._unknown = unknown
+        if unknown:
+            self.setForeground(0, qt.QColor(200, 0, 0))
+        else:
+            self.setData(0, qt.Qt.ForegroundRole, None)
+
     def createEditor(self, parent, option, col):
         if col == 0:
             return None
@@ -385,6 +503,7 @@ class ReagentItem(pg.TreeWidgetItem):
             sol[self.name] = None
         else:
             sol[self.name] = float(t)
+        self._values[col-1] = sol[self.name]
         self.setText(col, editor.text())
         self.sigChanged.emit(self)
 
@@ -438,7 +557,7 @@ class SolutionTypeItem(pg.TreeWidgetItem):
     def itemClicked(self, col):
         text = 'external' if str(self.text(col)) == 'internal' else 'internal'
         self.setText(col, text)
-        self.solutions[col-1].type = text
+        self.solutions[col-1].setField('type', text)
         self.sigChanged.emit(self)
         return None
 
@@ -486,7 +605,7 @@ class ReverseAgainstItem(pg.TreeWidgetItem):
         action = self.treeWidget().sender()
         text = str(action.text()).strip()
         self.setText(self._activeColumn, text)
-        self.solutions[self._activeColumn-1].compareAgainst = text
+        self.solutions[self._activeColumn-1].setField('compareAgainst', text)
         self.sigChanged.emit(self)
             
     def itemClicked(self, col):
@@ -499,3 +618,107 @@ class ReverseAgainstItem(pg.TreeWidgetItem):
         return None
 
 
+
+
+class ReversalMatrixWindow(qt.QWidget):
+    """Reversal potentials of one ion for every pair of internal (rows) and
+    external (columns) solutions.
+
+    The matrix is recomputed (see Solutions.reversalMatrix) when the window
+    is shown, when the temperature changes, and when any of the listed
+    solutions change.
+    """
+    def __init__(self, db, parent=None):
+        self.db = db
+        self._solutions = []
+        qt.QWidget.__init__(self, parent)
+        self.setWindowTitle('Reversal potentials')
+        self.resize(800, 600)
+
+        self.layout = qt.QGridLayout()
+        self.setLayout(self.layout)
+        self.ionCombo = qt.QComboBox()
+        self.ionCombo.addItems(list(IONS))
+        self.tempSpin = qt.QSpinBox()
+        self.tempSpin.setSuffix('C')
+        self.tempSpin.setValue(34)
+        self.layout.addWidget(qt.QLabel('Ion'), 0, 0)
+        self.layout.addWidget(self.ionCombo, 0, 1)
+        self.layout.addWidget(qt.QLabel('Temperature'), 0, 2)
+        self.layout.addWidget(self.tempSpin, 0, 3)
+        self.layout.setColumnStretch(4, 1)
+        self.model = ReversalMatrixModel()
+        self.table = qt.QTableView()
+        self.table.setModel(self.model)
+        self.layout.addWidget(self.table, 1, 0, 1, 5)
+
+        # recompute at most once per event loop iteration
+        self.refreshTimer = qt.QTimer()
+        self.refreshTimer.setSingleShot(True)
+        self.refreshTimer.timeout.connect(self.refresh)
+
+        self.ionCombo.currentIndexChanged.connect(self.model.setIon)
+        self.tempSpin.valueChanged.connect(self.refresh)
+        self.db.solutions.solutionListChanged.connect(self.solutionsChanged)
+
+    def showEvent(self, ev):
+        self.refresh()
+        qt.QWidget.showEvent(self, ev)
+
+    def solutionsChanged(self):
+        if self.isVisible():
+            self.refreshTimer.start(0)
+
+    def refresh(self):
+        for soln in self._solutions:
+            qt.disconnect(soln.sigSolutionChanged, self.solutionsChanged)
+        internal, external, revs = self.db.solutions.reversalMatrix(temperature=self.tempSpin.value())
+        self._solutions = internal + external
+        for soln in self._solutions:
+            soln.sigSolutionChanged.connect(self.solutionsChanged)
+        self.model.setMatrix([s.name for s in internal], [s.name for s in external], revs)
+
+
+class ReversalMatrixModel(qt.QAbstractTableModel):
+    """Table of (internal x external) reversal potentials for one ion.
+    """
+    def __init__(self, parent=None):
+        qt.QAbstractTableModel.__init__(self, parent)
+        self.internal = []
+        self.external = []
+        self.revs = np.empty((0, 0, len(IONS)))
+        self.ion = 0
+
+    def setMatrix(self, internal, external, revs):
+        self.beginResetModel()
+        self.internal = internal
+        self.external = external
+        self.revs = revs
+        self.endResetModel()
+
+    def setIon(self, ion):
+        self.ion = ion
+        if len(self.internal) > 0 and len(self.external) > 0:
+            self.dataChanged.emit(self.index(0, 0), self.index(len(self.internal) - 1, len(self.external) - 1))
+
+    def rowCount(self, parent=qt.QModelIndex()):
+        return 0 if parent.isValid() else len(self.internal)
+
+    def columnCount(self, parent=qt.QModelIndex()):
+        return 0 if parent.isValid() else len(self.external)
+
+    def data(self, index, role=qt.Qt.DisplayRole):
+        if role == qt.Qt.DisplayRole:
+            rev = self.revs[index.row(), index.column(), self.ion]
+            return '' if np.isnan(rev) else formatFloat(float(rev))
+        elif role == qt.Qt.TextAlignmentRole:
+            return qt.Qt.AlignRight | qt.Qt.AlignVCenter
+        elif role == qt.Qt.ToolTipRole:
+            return '%s / %s' % (self.internal[index.row()], self.external[index.column()])
+        return None
+
+    def headerData(self, section, orientation, role=qt.Qt.DisplayRole):
+        if role != qt.Qt.DisplayRole:
+            return None
+        names = self.external if orientation == qt.Qt.Horizontal else self.internal
+        return names[section] if section < len(names) else None
@@ -0,0 +1,233 @@
+"""SQLite storage for SolutionDatabase.
+
+The database is stored in five tables:
+
+* ``reagents``: one row per reagent, one column per field of the reagent table
+* ``solutions``: name, group, type, compareAgainst and notes of each solution
+* ``solution_reagents``: (solution, reagent, concentration) triplets
+* ``recipe_sets`` and ``recipes``
+
+Names and groups are indexed, so single solutions can be read without loading
+the rest of the database. SQLiteStore also acts as the storage backend used
+by Solutions and RecipeBook to load solutions and recipe sets lazily (see
+SolutionDatabase.openSQLite)::
+
+    db = SolutionDatabase()
+    db.openSQLite('lab.sqlite')    # loads only the reagent table
+    ions, osm = db.solutions['ACSF'].recalculate()
+
+Use importJson() and exportJson() to convert from and to the JSON file format.
+"""
+import json, sqlite3
+from collections import OrderedDict
+
+
+_SCHEMA = [
+"""CREATE TABLE IF NOT EXISTS solutions (
+    id INTEGER PRIMARY KEY,
+    name TEXT UNIQUE,
+    "group" TEXT,
+    type TEXT,
+    compareAgainst TEXT,
+    notes TEXT
+)""",
+'CREATE INDEX IF NOT EXISTS solutions_group ON solutions ("group")',
+"""CREATE TABLE IF NOT EXISTS solution_reagents (
+    solution INTEGER,
+    reagent TEXT,
+    concentration,
+    PRIMARY KEY (solution, reagent)
+) WITHOUT ROWID""",
+'CREATE INDEX IF NOT EXISTS solution_reagents_reagent ON solution_reagents (reagent)',
+"""CREATE TABLE IF NOT EXISTS recipe_sets (
+    id INTEGER PRIMARY KEY,
+    name TEXT,
+    reagentOrder TEXT,
+    stocks TEXT,
+    showMW INTEGER,
+    showConcentration INTEGER
+)""",
+'CREATE INDEX IF NOT EXISTS recipe_sets_name ON recipe_sets (name)',
+"""CREATE TABLE IF NOT EXISTS recipes (
+    recipeSet INTEGER,
+    position INTEGER,
+    solution TEXT,
+    volumes TEXT,
+    notes TEXT,
+    PRIMARY KEY (recipeSet, position)
+)""",
+]
+
+_SOLUTION_FIELDS = ('name', 'group', 'type', 'compareAgainst', 'notes')
+
+
+def _quote(name):
+    return '"%s"' % name.replace('"', '""')
+
+
+class SQLiteStore(object):
+    """Reads and writes SolutionDatabase state in an SQLite file.
+
+    State is exchanged in the same form as SolutionDatabase.save() /
+    restore(), except that the reagent table is always columnar.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        # transactions are managed explicitly in save()
+        self.conn = sqlite3.connect(filename, isolation_level=None)
+        for stmt in _SCHEMA:
+            self.conn.execute(stmt)
+
+    def close(self):
+        self.conn.close()
+
+    def save(self, state):
+        """Replace the contents of the store with *state*, as returned by
+        ``SolutionDatabase.save(columnar=True)``.
+        """
+        c = self.conn
+        c.execute('BEGIN')
+        try:
+            self._save(state)
+        except Exception:
+            c.execute('ROLLBACK')
+            raise
+        c.execute('COMMIT')
+
+    def _save(self, state):
+        c = self.conn
+        for table in ('reagents', 'solutions', 'solution_reagents', 'recipe_sets', 'recipes'):
+            c.execute('DROP TABLE IF EXISTS %s' % table)
+        for stmt in _SCHEMA:
+            c.execute(stmt)
+
+        reagents = state['reagents']
+        fields = list(reagents.keys())
+        c.execute('CREATE TABLE reagents (row INTEGER PRIMARY KEY, %s)' % ', '.join(map(_quote, fields)))
+        c.execute('CREATE INDEX reagents_name ON reagents ("name")')
+        c.execute('CREATE INDEX reagents_group ON reagents ("group")')
+        c.executemany('INSERT INTO reagents (%s) VALUES (%s)' % (', '.join(map(_quote, fields)), ', '.join('?' * len(fields))),
+                      zip(*[_toPython(reagents[f]) for f in fields]))
+
+        for i, soln in enumerate(state['solutions']):
+            c.execute('INSERT INTO solutions (id, name, "group", type, compareAgainst, notes) VALUES (?, ?, ?, ?, ?, ?)',
+                      (i,) + tuple(soln[f] for f in _SOLUTION_FIELDS))
+            c.executemany('INSERT INTO solution_reagents VALUES (?, ?, ?)',
+                          [(i, name, conc) for name, conc in soln['reagents'].items()])
+
+        for i, rset in enumerate(state['recipes']):
+            c.execute('INSERT INTO recipe_sets VALUES (?, ?, ?, ?, ?, ?)',
+                      (i, rset['name'], json.dumps(rset['order']), json.dumps(rset['stocks']),
+                       rset['showMW'], rset['showConcentration']))
+            c.executemany('INSERT INTO recipes VALUES (?, ?, ?, ?, ?)',
+                          [(i, j, r['solution'], json.dumps(r['volumes']), r['notes']) for j, r in enumerate(rset['recipes'])])
+
+    def load(self):
+        """Return the complete state stored in this file.
+        """
+        return {
+            'reagents': self.loadReagents(),
+            'solutions': self.loadSolutions(),
+            'recipes': self.loadRecipeSets(),
+        }
+
+    def loadReagents(self):
+        """Return the reagent table as a dict of per-field lists (or an empty
+        list if no reagents have been stored).
+        """
+        fields = [row[1] for row in self.conn.execute('PRAGMA table_info(reagents)') if row[1] != 'row']
+        if len(fields) == 0:
+            return []
+        columns = OrderedDict([(f, []) for f in fields])
+        rows = self.conn.execute('SELECT %s FROM reagents ORDER BY row' % ', '.join(map(_quote, fields))).fetchall()
+        for f, column in zip(fields, zip(*rows)):
+            columns[f] = list(column)
+        return columns
+
+    def solutionNames(self, group=None):
+        """Return the names of all stored solutions (optionally, only those in *group*).
+        """
+        if group is None:
+            rows = self.conn.execute('SELECT name FROM solutions ORDER BY id')
+        else:
+            rows = self.conn.execute('SELECT name FROM solutions WHERE "group" = ? ORDER BY id', (group,))
+        return [row[0] for row in rows]
+
+    def solutionsUsing(self, reagent):
+        """Return the names of stored solutions that contain *reagent*.
+        """
+        rows = self.conn.execute('SELECT s.name FROM solution_reagents r JOIN solutions s ON s.id = r.solution '
+                                 'WHERE r.reagent = ? ORDER BY s.id', (reagent,))
+        return [row[0] for row in rows]
+
+    def loadSolution(self, name):
+        """Return the saved state of one solution, or None if there is no
+        solution with this name.
+        """
+        states = self._loadSolutions('WHERE name = ?', (name,))
+        return states[0] if len(states) > 0 else None
+
+    def loadSolutions(self, names=None):
+        """Return the saved states of the named solutions (or all solutions),
+        in the order they were stored.
+        """
+        if names is None:
+            return self._loadSolutions('', ())
+        states = []
+        names = list(names)
+        # stay below SQLite's limit on the number of query parameters
+        for i in range(0, len(names), 500):
+            chunk = names[i:i+500]
+            states.extend(self._loadSolutions('WHERE name IN (%s)' % ', '.join('?' * len(chunk)), chunk))
+        return states
+
+    def _loadSolutions(self, where, args):
+        c = self.conn
+        rows = c.execute('SELECT id, name, "group", type, compareAgainst, notes FROM solutions %s ORDER BY id' % where, args).fetchall()
+        states = OrderedDict()
+        for row in rows:
+            state = dict(zip(_SOLUTION_FIELDS, row[1:]))
+            state['reagents'] = OrderedDict()
+            states[row[0]] = state
+        if len(states) == 0:
+            return []
+        query = ('SELECT solution, reagent, concentration FROM solution_reagents WHERE solution IN '
+                 '(SELECT id FROM solutions %s) ORDER BY solution, reagent' % where)
+        for soln, reagent, conc in c.execute(query, args):
+            states[soln]['reagents'][reagent] = conc
+        return list(states.values())
+
+    def loadRecipeSets(self):
+        """Return the saved states of all recipe sets.
+        """
+        c = self.conn
+        sets = OrderedDict()
+        for i, name, order, stocks, showMW, showConc in c.execute('SELECT * FROM recipe_sets ORDER BY id'):
+            sets[i] = {'name': name, 'order': json.loads(order), 'stocks': json.loads(stocks),
+                       'showMW': bool(showMW), 'showConcentration': bool(showConc), 'recipes': []}
+        for i, j, soln, volumes, notes in c.execute('SELECT * FROM recipes ORDER BY recipeSet, position'):
+            sets[i]['recipes'].append({'solution': soln, 'volumes': json.loads(volumes), 'notes': notes})
+        return list(sets.values())
+
+
+def _toPython(column):
+    # convert numpy arrays / scalars to values sqlite3 accepts
+    return column.tolist() if hasattr(column, 'tolist') else [v.item() if hasattr(v, 'item') else v for v in column]
+
+
+def importJson(jsonFile, sqliteFile):
+    """Convert a JSON database file to SQLite.
+    """
+    from .core import SolutionDatabase
+    db = SolutionDatabase()
+    db.loadFile(jsonFile)
+    db.saveSQLite(sqliteFile)
+
+
+def exportJson(sqliteFile, jsonFile):
+    """Convert an SQLite database file to JSON.
+    """
+    from .core import SolutionDatabase
+    db = SolutionDatabase()
+    db.openSQLite(sqliteFile, lazy=False)
+    db.saveFile(jsonFile)
@@ -0,0 +1,117 @@
+"""Ion concentrations, osmolarity and reversal potentials over a grid of
+parameters.
+
+sweep() evaluates every combination of internal solution, external
+solution, temperature and reagent concentrations in one broadcast
+computation. Each parameter given as a list or array adds one axis to the
+results, in the order internal, external, concentrations (in the order
+given), temperature::
+
+    result = sweep(db, internals, db.solutions['ACSF'],
+                   temperature=np.linspace(20, 37, 100),
+                   concentrations={('external', 'potassium chloride'): np.linspace(1, 10, 100)})
+    result.axes            # OrderedDict([('internal', [...]), ('external potassium chloride', ...), ('temperature', ...)])
+    result.reversal.shape  # (len(internals), 100, 100, len(IONS))
+
+Since ion concentrations and osmolarity are linear in the reagent
+concentrations, changing the concentration of one reagent adds a multiple of
+its row of the dissociation matrix to the properties of each solution.
+"""
+from collections import OrderedDict
+import numpy as np
+from . import composition
+from .core import IONS, Solution
+
+
+class SweepResult(object):
+    """Results of sweep().
+
+    Attributes:
+
+    * ``axes``: OrderedDict mapping the name of each axis to its values
+      (solution names, concentrations in mM, or temperatures in degrees C)
+    * ``internalIons``, ``externalIons``: ion concentrations (mM), with shape
+      ``shape + (len(IONS),)``
+    * ``internalOsmolarity``, ``externalOsmolarity``: estimated osmolarity,
+      with shape ``shape``
+    * ``reversal``: reversal potentials (mV), with shape ``shape + (len(IONS),)``;
+      nan for ions that are absent on both sides
+    * ``shape``: the lengths of all axes
+    """
+    def __init__(self, axes, internal, external, reversal):
+        self.axes = axes
+        self.shape = tuple(len(v) for v in axes.values())
+        n = len(IONS)
+        self.internalIons = np.broadcast_to(internal[..., :n], self.shape + (n,))
+        self.externalIons = np.broadcast_to(external[..., :n], self.shape + (n,))
+        self.internalOsmolarity = np.broadcast_to(internal[..., n], self.shape)
+        self.externalOsmolarity = np.broadcast_to(external[..., n], self.shape)
+        self.reversal = reversal
+
+
+def sweep(db, internal, external, temperature=25.0, concentrations=None):
+    """Compute ion concentrations, osmolarity and reversal potentials for all
+    combinations of the given parameters.
+
+    *internal* and *external* are Solutions, or lists of Solutions.
+    *temperature* is a number or a 1D array (degrees C). *concentrations*
+    maps ('internal' | 'external', reagent name) to a 1D array of
+    concentrations (mM) that replace the reagent's concentration in the
+    solutions on that side. Returns a SweepResult.
+    """
+    concentrations = OrderedDict() if concentrations is None else OrderedDict(concentrations)
+    sides = OrderedDict([('internal', internal), ('external', external)])
+
+    axes = OrderedDict()
+    for side, solutions in sides.items():
+        if not isinstance(solutions, Solution):
+            axes[side] = [soln.name for soln in solutions]
+    for (side, reagent), values in concentrations.items():
+        if side not in sides:
+            raise ValueError("Concentration axis side must be 'internal' or 'external', not %r" % side)
+        axes['%s %s' % (side, reagent)] = np.asarray(values, dtype=float)
+    if np.ndim(temperature) > 0:
+        axes['temperature'] = np.asarray(temperature, dtype=float)
+    names = list(axes)
+    ndim = len(names)
+
+    def along(values, name):
+        # reshape an array so that its first dimension lies along one axis of
+        # the result (any other dimensions are kept at the end)
+        values = np.asarray(values)
+        shape = [1] * ndim + list(values.shape[1:])
+        shape[names.index(name)] = len(values)
+        return values.reshape(shape)
+
+    index = db.reagents._index
+    data = db.reagents._data
+    props = {}
+    for side, solutions in sides.items():
+        single = isinstance(solutions, Solution)
+        solutions = [solutions] if single else list(solutions)
+        ions, osm = db.solutions.calculate(solutions)
+        p = np.column_stack([ions, osm])
+        p = p[0].reshape((1,) * ndim + p.shape[1:]) if single else along(p, side)
+
+        # replace reagent concentrations: add (new - old) x dissociation row
+        for (s, reagent), values in concentrations.items():
+            if s != side:
+                continue
+            if reagent not in index:
+                raise KeyError('No reagent named "%s"' % reagent)
+            row = composition.dissociationMatrix(data[[index[reagent]]], IONS)[0]
+            old = np.array([soln[reagent] or 0.0 for soln in solutions])
+            old = old.reshape((1,) * ndim) if single else along(old, side)
+            delta = along(axes['%s %s' % (side, reagent)], '%s %s' % (side, reagent)) - old
+            p = p + delta[..., None] * row
+        props[side] = p
+
+    T = along(axes['temperature'], 'temperature')[..., None] if 'temperature' in axes else temperature
+    valence = np.array(list(IONS.values()), dtype=float)
+    n = len(IONS)
+    internalIons = props['internal'][..., :n]
+    externalIons = props['external'][..., :n]
+    reversal = composition.reversalPotentials(internalIons, externalIons, valence, T)
+    shape = tuple(len(v) for v in axes.values()) + (n,)
+    reversal = np.where((internalIons == 0) & (externalIons == 0), np.nan, np.broadcast_to(reversal, shape))
+    return SweepResult(axes, props['internal'], props['external'], reversal)
@@ -0,0 +1,134 @@
+import os, sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import pytest
+from pycsf.core import Solution, Recipe, RecipeSet, SolutionDatabase
+
+
+class Recorder(object):
+    """Collects (signal name, args) for each emitted signal, in order.
+    """
+    def __init__(self):
+        self.calls = []
+
+    def listen(self, obj, *signals):
+        for name in signals:
+            getattr(obj, name).connect(lambda *args, name=name: self.calls.append((name, args)))
+
+    def names(self):
+        return [name for name, args in self.calls]
+
+
+def mkDatabase():
+    db = SolutionDatabase()
+    db.loadDefault()
+    for name in ('acsf', 'internal'):
+        db.solutions.add(Solution(name=name))
+    return db
+
+
+def test_signals_are_deferred_and_coalesced():
+    db = mkDatabase()
+    acsf = db.solutions['acsf']
+    rec = Recorder()
+    rec.listen(db.solutions, 'solutionListChanged')
+    rec.listen(acsf, 'sigSolutionChanged')
+    rec.listen(db.reagents, 'sigReagentChanged', 'sigReagentDataChanged')
+
+    with db.batch():
+        for i in range(5):
+            acsf['glucose'] = i
+        db.solutions.add(Solution(name='new'))
+        db.solutions.add(Solution(name='new2'))
+        for i in range(3):
+            db.reagents.setData('glucose', 'molweight', 180. + i)
+            db.reagents.setData('glucose', 'formula', 'C6H12O6')
+        assert rec.calls == []
+
+    # one signal per object (and per reagent field), in the order first emitted
+    assert rec.names() == ['sigSolutionChanged', 'solutionListChanged', 'sigReagentChanged',
+                           'sigReagentDataChanged', 'sigReagentChanged']
+    assert rec.calls[0] == ('sigSolutionChanged', (acsf,))
+    assert rec.calls[2][1][1:] == ('glucose', 'molweight')
+    assert rec.calls[4][1][1:] == ('glucose', 'formula')
+    assert acsf['glucose'] == 4
+
+    # outside a batch, signals are emitted immediately
+    rec.calls = []
+    acsf['glucose'] = 1
+    acsf['glucose'] = 2
+    assert rec.names() == ['sigSolutionChanged', 'sigSolutionChanged']
+
+
+def test_nested_batches_flush_at_outermost_exit():
+    db = mkDatabase()
+    rec = Recorder()
+    rec.listen(db.solutions, 'solutionListChanged')
+    with db.batch():
+        with db.batch():
+            db.solutions.add(Solution(name='new'))
+        assert rec.calls == []
+        with db.batch():
+            db.solutions.remove(db.solutions['new'])
+        assert rec.calls == []
+    assert rec.names() == ['solutionListChanged']
+    assert db._batchDepth == 0
+
+
+def test_signals_are_flushed_when_batch_raises():
+    db = mkDatabase()
+    rec = Recorder()
+    rec.listen(db.solutions, 'solutionListChanged')
+    with pytest.raises(RuntimeError):
+        with db.batch():
+            db.solutions.add(Solution(name='new'))
+            raise RuntimeError('failed')
+    assert rec.names() == ['solutionListChanged']
+    assert db._batchDepth == 0
+    assert db._pendingSignals == {}
+
+    # later batches still work
+    with db.batch():
+        db.solutions.add(Solution(name='new2'))
+    assert rec.names() == ['solutionListChanged', 'solutionListChanged']
+
+
+def test_renames_are_chained():
+    db = mkDatabase()
+    rec = Recorder()
+    rec.listen(db.reagents, 'sigReagentRenamed')
+    acsf = db.solutions['acsf']
+    rec.listen(acsf, 'sigRenamed')
+
+    with db.batch():
+        db.reagents.rename('glucose', 'glc')
+        db.reagents.rename('glc', 'dextrose')
+        db.reagents.rename('sucrose', 'suc')
+        db.reagents.rename('suc', 'sucrose')
+        acsf.setName('a')
+        acsf.setName('b')
+    assert rec.calls == [('sigReagentRenamed', (db.reagents, 'glucose', 'dextrose')),
+                         ('sigRenamed', (acsf, 'acsf'))]
+
+
+def test_recipe_volume_and_stock_edits_are_signalled():
+    db = mkDatabase()
+    recipe = Recipe(solution=db.solutions['acsf'], volumes=[1000])
+    rset = RecipeSet(name='set', recipes=[recipe])
+    db.recipes.add(rset)
+    rec = Recorder()
+    rec.listen(recipe, 'sigVolumesChanged')
+    rec.listen(rset, 'sigStocksChanged')
+
+    recipe.setVolumes([1000, 500])
+    rset.setStock('glucose', 1000)
+    assert rec.calls == [('sigVolumesChanged', (recipe,)), ('sigStocksChanged', (rset,))]
+
+    rec.calls = []
+    with db.batch():
+        recipe.setVolumes([250])
+        recipe.setVolumes([100])
+        rset.setStock('glucose', None)
+        rset.setStock('NaCl', 2000)
+        assert rec.calls == []
+    assert rec.names() == ['sigVolumesChanged', 'sigStocksChanged']
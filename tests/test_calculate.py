@@ -0,0 +1,110 @@
+import os, sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import numpy as np
+from pycsf import composition
+from pycsf.core import Solution, SolutionDatabase, IONS
+
+
+def mkDatabase():
+    db = SolutionDatabase()
+    db.loadDefault()
+    for name, reagents in [('acsf', {'sodium chloride': 123, 'potassium chloride': 3, 'glucose': 10}),
+                           ('internal', {'potassium gluconate': 130, 'potassium chloride': 4}),
+                           ('sucrose', {'sucrose': 200, 'sodium chloride': 50})]:
+        sol = Solution(name=name)
+        for reagent, conc in reagents.items():
+            sol[reagent] = conc
+        db.solutions.add(sol)
+    return db
+
+
+def expected(db, solutions):
+    # (solutions x IONS+1) ions and osmolarity, computed without the cache
+    rows = []
+    for soln in solutions:
+        names = [n for n in soln.reagentList() if n in db.reagents._index]
+        D = composition.dissociationMatrix(db.reagents.getRecArray(names), IONS)
+        rows.append(np.array([soln[n] for n in names], dtype=float).dot(D))
+    return np.array(rows)
+
+
+def calculate(db, solutions):
+    ions, osm = db.solutions.calculate(solutions)
+    return np.column_stack([ions, osm])
+
+
+def check(db, hits, misses):
+    solutions = list(db.solutions)
+    db.solutions.cacheStats(reset=True)
+    assert np.allclose(calculate(db, solutions), expected(db, solutions))
+    stats = db.solutions.cacheStats()
+    assert (stats['hits'], stats['misses']) == (hits, misses)
+
+
+def test_calculate_is_cached():
+    db = mkDatabase()
+    check(db, hits=0, misses=3)
+    check(db, hits=3, misses=0)
+    assert db.solutions.cacheStats()['size'] == 3
+    stats = db.solutions.cacheStats(reset=True)
+    assert stats['hits'] == 3
+    assert db.solutions.cacheStats()['hits'] == 0
+
+    # solutions outside the list are computed but never cached
+    other = Solution(name='other')
+    other['sodium chloride'] = 10
+    for i in range(2):
+        assert np.allclose(calculate(db, [other]), expected(db, [other]))
+    assert db.solutions.cacheStats()['misses'] == 2
+
+
+def test_reagent_changes_invalidate_users():
+    db = mkDatabase()
+    check(db, hits=0, misses=3)
+
+    # only solutions containing the reagent are recalculated
+    db.reagents.setData('potassium chloride', 'K', 2.0)
+    check(db, hits=1, misses=2)
+    db.reagents.setData('sodium chloride', 'osmconst', 1.5)
+    check(db, hits=1, misses=2)
+    # fields that do not affect the results keep the cache
+    db.reagents.setData('glucose', 'molweight', 200.0)
+    check(db, hits=3, misses=0)
+
+    db.reagents.rename('potassium chloride', 'KCl')
+    assert db.solutions['acsf']['KCl'] == 3
+    check(db, hits=1, misses=2)
+    db.reagents.setData('KCl', 'name', 'potassium chloride')
+    check(db, hits=1, misses=2)
+
+    before = calculate(db, [db.solutions['internal']])
+    db.reagents.removeMany(name for name in ['potassium chloride'])
+    check(db, hits=1, misses=2)
+    after = calculate(db, [db.solutions['internal']])
+    k = list(IONS).index('K')
+    # 4 mM potassium chloride, with 2 K each (set above)
+    assert after[0, k] == before[0, k] - 8
+
+
+def test_solution_edits_invalidate():
+    db = mkDatabase()
+    check(db, hits=0, misses=3)
+    db.solutions['acsf']['potassium chloride'] = 5
+    check(db, hits=2, misses=1)
+    db.solutions['sucrose']['sucrose'] = 100
+    check(db, hits=2, misses=1)
+    db.solutions['internal'].setName('int')
+    check(db, hits=3, misses=0)
+    db.solutions['int'].restore(dict(db.solutions['acsf'].save(), name='int'))
+    check(db, hits=2, misses=1)
+
+    # a solution that starts using a reagent is invalidated when it changes
+    db.solutions['sucrose']['calcium chloride dihydrate'] = 2
+    check(db, hits=2, misses=1)
+    db.reagents.setData('calcium chloride dihydrate', 'Ca', 2.0)
+    check(db, hits=2, misses=1)
+
+    # removed solutions are dropped from the cache
+    db.solutions.remove(db.solutions['sucrose'])
+    assert db.solutions.cacheStats()['size'] == 2
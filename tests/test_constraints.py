@@ -0,0 +1,163 @@
+import os, sys, itertools
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import numpy as np
+import pytest
+from pycsf.constraints import nnls, ConstraintProblem, solveSolutions, changeTable
+from pycsf.core import Solution, SolutionDatabase
+
+
+def bruteForce(A, b):
+    # best least squares solution over all sets of nonnegative variables
+    m, n = A.shape
+    best = np.zeros(n), np.linalg.norm(b)
+    for k in range(1, n + 1):
+        for cols in itertools.combinations(range(n), k):
+            x = np.zeros(n)
+            x[list(cols)] = np.linalg.lstsq(A[:, cols], b, rcond=None)[0]
+            if x.min() >= 0:
+                r = np.linalg.norm(A.dot(x) - b)
+                if r < best[1]:
+                    best = x, r
+    return best
+
+
+def checkOptimal(A, b, x, tol=1e-8):
+    # Karush-Kuhn-Tucker conditions for min ||Ax - b|| with x >= 0
+    w = A.T.dot(b - A.dot(x))
+    scale = max(1.0, np.abs(A).max() * np.abs(b).max())
+    assert x.min() >= 0
+    assert w.max() <= tol * scale
+    assert np.all(np.abs(w[x > 0]) <= tol * scale)
+
+
+def test_nnls_known_solutions():
+    x, r = nnls(np.eye(3), [1., -2., 3.])
+    assert np.allclose(x, [1, 0, 3]) and np.isclose(r, 2)
+
+    A = np.array([[1., 2.], [3., 4.], [5., 7.]])
+    x, r = nnls(A, A.dot([0.5, 2.0]))
+    assert np.allclose(x, [0.5, 2.0]) and r < 1e-10
+
+    x, r = nnls(A, [0., 0., 0.])
+    assert np.all(x == 0) and r == 0
+
+    x, r = nnls(-A, [1., 1., 1.])
+    assert np.all(x == 0) and np.isclose(r, np.sqrt(3))
+
+
+def test_nnls_rank_deficient():
+    # duplicated and zero columns
+    A = np.array([[1., 1., 0., 2.], [1., 1., 0., 0.]])
+    x, r = nnls(A, [2., 2.])
+    assert r < 1e-10
+    assert np.allclose(A.dot(x), [2., 2.])
+    checkOptimal(A, np.array([2., 2.]), x)
+
+    # more unknowns than equations
+    rng = np.random.RandomState(0)
+    A = rng.uniform(0, 1, (3, 8))
+    b = A.dot(rng.uniform(0, 1, 8))
+    x, r = nnls(A, b)
+    assert r < 1e-10
+    checkOptimal(A, b, x)
+
+
+def test_nnls_matches_brute_force():
+    rng = np.random.RandomState(1)
+    for i in range(200):
+        m, n = rng.randint(1, 6), rng.randint(1, 7)
+        A = rng.normal(size=(m, n))
+        b = rng.normal(size=m)
+        x, r = nnls(A, b)
+        checkOptimal(A, b, x)
+        assert np.isclose(r, bruteForce(A, b)[1], atol=1e-9)
+
+
+def test_nnls_degenerate_problems_converge():
+    # problems with exact solutions and more unknowns than equations used to
+    # cycle once the residual reached roundoff level
+    rng = np.random.RandomState(0)
+    for i in range(2000):
+        m, n = rng.randint(1, 16), rng.randint(1, 26)
+        A = rng.normal(size=(m, n))
+        b = rng.normal(size=m)
+        x, r = nnls(A, b)
+        checkOptimal(A, b, x)
+
+
+def mkDatabase():
+    db = SolutionDatabase()
+    db.loadDefault()
+    acsf = Solution(name='acsf', against='internal')
+    for name, conc in [('sodium chloride', 123), ('potassium chloride', 3), ('glucose', 10)]:
+        acsf[name] = conc
+    db.solutions.add(acsf)
+    internal = Solution(name='internal', against='acsf')
+    internal.type = 'internal'
+    internal['potassium gluconate'] = 130
+    internal['potassium chloride'] = 4
+    db.solutions.add(internal)
+    return db
+
+
+def test_problem_meets_ion_and_osmolarity_targets():
+    db = mkDatabase()
+    acsf = db.solutions['acsf']
+    problem = ConstraintProblem(db, acsf, ['sodium chloride', 'potassium chloride', 'glucose'],
+                                {'K': 5.0, 'Na': 130.0, 'osmolarity': 300.0}, temperature=34.)
+    result = problem.solve()
+    assert result.residual < 1e-9
+    for key, value in [('K', 5.0), ('Na', 130.0), ('osmolarity', 300.0)]:
+        assert np.isclose(result.achieved[key], value)
+    assert np.isclose(result.changes['potassium chloride'], result.concentrations['potassium chloride'] - 3)
+
+    # applying the result gives the same properties
+    for name, conc in result.concentrations.items():
+        acsf[name] = conc
+    ions, osm, revs = db.solutions.recalculate([acsf], 34.)['acsf']
+    assert np.isclose(ions['K'], 5.0) and np.isclose(osm, 300.0)
+
+
+def test_problem_meets_reversal_target():
+    db = mkDatabase()
+    acsf = db.solutions['acsf']
+    result = ConstraintProblem(db, acsf, ['potassium chloride'], {'E_K': -80.0}, temperature=34.).solve()
+    assert np.isclose(result.achieved['E_K'], -80.0)
+    acsf['potassium chloride'] = result.concentrations['potassium chloride']
+    ions, osm, revs = db.solutions.recalculate([acsf], 34.)['acsf']
+    assert np.isclose(revs['K'], -80.0)
+
+
+def test_problem_errors():
+    db = mkDatabase()
+    acsf = db.solutions['acsf']
+    with pytest.raises(KeyError):
+        ConstraintProblem(db, acsf, ['sodium chloride'], {'bogus': 1.0})
+    with pytest.raises(KeyError):
+        ConstraintProblem(db, acsf, ['unobtainium'], {'Na': 1.0})
+    acsf.compareAgainst = None
+    with pytest.raises(ValueError):
+        ConstraintProblem(db, acsf, ['potassium chloride'], {'E_K': -80.0})
+
+
+def test_solve_many_in_worker_processes():
+    db = mkDatabase()
+    names = db.reagents.names()
+    jobs = []
+    for i in range(12):
+        sol = Solution(name='variant %d' % i, against='internal')
+        sol['sodium chloride'] = 100 + i
+        sol['potassium chloride'] = 2 + 0.5 * i
+        sol[str(names[i])] = 5
+        db.solutions.add(sol)
+        jobs.append((sol, ['sodium chloride', 'potassium chloride', str(names[i])],
+                     {'Na': 120.0, 'osmolarity': 290.0 + i, 'E_K': -85.0}))
+    serial = solveSolutions(db, jobs, temperature=34., workers=0)
+    pooled = solveSolutions(db, jobs, temperature=34., workers=2, chunksize=5)
+    assert [r.problem.solution for r in pooled] == ['variant %d' % i for i in range(12)]
+    for a, b in zip(serial, pooled):
+        assert a.concentrations == b.concentrations
+        assert a.achieved == b.achieved
+        assert a.residual == b.residual
+    assert np.array_equal(changeTable(serial)['proposed'], changeTable(pooled)['proposed'])
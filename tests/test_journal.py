@@ -0,0 +1,155 @@
+import os, sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import pytest
+from pycsf.core import Solution, Recipe, RecipeSet, SolutionDatabase
+
+
+def mkDatabase():
+    db = SolutionDatabase()
+    sol = Solution(name='Standard ACSF', group='ACSF')
+    sol['sodium chloride'] = 123
+    sol['potassium chloride'] = 3
+    db.solutions.add(sol)
+    sol = Solution(name='Diss. ACSF', group='ACSF')
+    sol['n-methyl-d-glucamine'] = 123
+    db.solutions.add(sol)
+    return db
+
+
+def test_recipe_edits_round_trip(tmp_path):
+    filename = str(tmp_path / 'db.json')
+    db = mkDatabase()
+    solns = db.solutions
+    r1 = Recipe(solution=solns['Standard ACSF'], volumes=[1000])
+    db.recipes.add(RecipeSet(name='Standard recipes', recipes=[r1]))
+    db.saveFile(filename, journal=True)
+
+    # recipes created without a database, as the recipe editor does
+    r2 = Recipe(solution=solns['Diss. ACSF'], volumes=[100])
+    db.recipes[0].add(r2)
+    db.saveFile(filename, journal=True)
+    assert not os.path.exists(filename + '.journal')
+
+    r1.setVolumes([1000, 500])
+    r2.setVolumes([100, 250])
+    for i in range(1, 6):
+        r2.setNotes('notes'[:i])
+    db.recipes[0].setStock('potassium chloride', 1000.0)
+    solns['Diss. ACSF']['potassium chloride'] = 2.5
+    db.saveFile(filename, journal=True)
+    assert os.path.exists(filename + '.journal')
+
+    db2 = SolutionDatabase()
+    db2.loadFile(filename)
+    rs = db2.recipes[0]
+    assert [r.volumes for r in rs] == [[1000, 500], [100, 250]]
+    assert rs[1].notes == 'notes'
+    assert rs.stocks['potassium chloride'] == 1000.0
+    assert db2.solutions['Diss. ACSF']['potassium chloride'] == 2.5
+    assert db2.save() == db.save()
+
+
+def test_unjournaled_edits_force_snapshot(tmp_path):
+    filename = str(tmp_path / 'db.json')
+    db = mkDatabase()
+    db.recipes.add(RecipeSet(name='Standard recipes'))
+    db.saveFile(filename, journal=True)
+
+    # a recipe that is not in the recipe book cannot be journaled
+    r = Recipe(solution=db.solutions['Standard ACSF'], volumes=[100], db=db)
+    r.setVolumes([100, 200])
+    db.recipes[0].add(r)
+    db.saveFile(filename, journal=True)
+
+    db2 = SolutionDatabase()
+    db2.loadFile(filename)
+    assert db2.recipes[0][0].volumes == [100, 200]
+
+
+def test_pending_records_are_bounded(tmp_path):
+    filename = str(tmp_path / 'db.json')
+    db = mkDatabase()
+    r = Recipe(solution=db.solutions['Standard ACSF'], volumes=[100])
+    db.recipes.add(RecipeSet(name='Standard recipes', recipes=[r]))
+    db.saveFile(filename)
+    journal = db._journal
+
+    # repeated edits of one field are coalesced
+    for i in range(5000):
+        r.setNotes('x' * i)
+    assert len(journal.pending) == 1
+
+    # other edits stop being collected once the journal would be too long
+    for i in range(5000):
+        db.solutions['Standard ACSF']['sodium chloride'] = 100 + i
+        db.solutions['Standard ACSF']['glucose'] = i
+    assert len(journal.pending) <= journal.limit
+
+
+def test_torn_journal_tail_is_overwritten(tmp_path):
+    filename = str(tmp_path / 'db.json')
+    db = mkDatabase()
+    db.saveFile(filename, journal=True)
+    db.solutions['Standard ACSF']['glucose'] = 10
+    db.saveFile(filename, journal=True)
+
+    # a crash while appending leaves an incomplete final line
+    with open(filename + '.journal', 'a') as fh:
+        fh.write('["concentration","Standard ACSF","glu')
+
+    db2 = SolutionDatabase()
+    db2.loadFile(filename)
+    assert db2.solutions['Standard ACSF']['glucose'] == 10
+    db2.solutions['Standard ACSF']['glucose'] = 13
+    db2.saveFile(filename, journal=True)
+    db2.solutions['Diss. ACSF']['glucose'] = 5
+    db2.saveFile(filename, journal=True)
+
+    db3 = SolutionDatabase()
+    db3.loadFile(filename)
+    assert db3.solutions['Standard ACSF']['glucose'] == 13
+    assert db3.solutions['Diss. ACSF']['glucose'] == 5
+    assert db3.save() == db2.save()
+
+
+def test_journal_follows_snapshot_contents(tmp_path):
+    filename = str(tmp_path / 'db.json')
+    db = mkDatabase()
+    db.saveFile(filename, journal=True)
+    db.solutions['Standard ACSF']['glucose'] = 10
+    db.saveFile(filename, journal=True)
+
+    # copying the files without their modification times keeps the journal
+    os.utime(filename, (0, 0))
+    db2 = SolutionDatabase()
+    db2.loadFile(filename)
+    assert db2.solutions['Standard ACSF']['glucose'] == 10
+
+    # a journal for different contents is ignored, with a warning
+    with open(filename, 'a') as fh:
+        fh.write('\n')
+    db3 = SolutionDatabase()
+    with pytest.warns(UserWarning):
+        db3.loadFile(filename)
+    assert db3.solutions['Standard ACSF']['glucose'] is None
+
+
+def test_shared_recipe_edits_round_trip(tmp_path):
+    filename = str(tmp_path / 'db.json')
+    db = mkDatabase()
+    r1 = Recipe(solution=db.solutions['Standard ACSF'], volumes=[1000, 500])
+    db.recipes.add(RecipeSet(name='Standard recipes', recipes=[r1]))
+    db.recipes.add(RecipeSet(name='Recording ACSF', recipes=[r1]))
+    db.saveFile(filename, journal=True)
+
+    r1.setVolumes([250])
+    r1.setNotes('shared')
+    db.saveFile(filename, journal=True)
+    assert os.path.exists(filename + '.journal')
+
+    db2 = SolutionDatabase()
+    db2.loadFile(filename)
+    assert [[r.volumes for r in rs] for rs in db2.recipes] == [[[250]], [[250]]]
+    assert [[r.notes for r in rs] for rs in db2.recipes] == [['shared'], ['shared']]
+    assert db2.save() == db.save()
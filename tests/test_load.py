@@ -0,0 +1,63 @@
+import os, sys, io, json
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import pytest
+from pycsf.core import Solution, SolutionDatabase
+
+
+def test_bad_file_leaves_database_unchanged(tmp_path):
+    filename = str(tmp_path / 'db.json')
+    db = SolutionDatabase()
+    db.loadDefault()
+    for i in range(30):
+        sol = Solution(name='solution %d' % i)
+        sol['sodium chloride'] = 100 + i
+        db.solutions.add(sol)
+    db.saveFile(filename)
+    state = db.save()
+
+    text = open(filename).read()
+    bad = str(tmp_path / 'bad.json')
+    with open(bad, 'w') as fh:
+        fh.write(text[:len(text) * 2 // 3])
+    with pytest.raises(json.JSONDecodeError) as exc:
+        db.loadFile(bad)
+    assert db.save() == state
+
+    # the error is reported at the same position as the json module would
+    with pytest.raises(json.JSONDecodeError) as ref:
+        json.loads(text[:len(text) * 2 // 3])
+    assert (exc.value.pos, exc.value.lineno, exc.value.colno) == (ref.value.pos, ref.value.lineno, ref.value.colno)
+
+
+def test_corrupt_data_is_reported_when_read():
+    from pycsf import jsonio
+    db = SolutionDatabase()
+    db.loadDefault()
+    for i in range(300):
+        sol = Solution(name='solution %d' % i)
+        sol['sodium chloride'] = 100 + i
+        db.solutions.add(sol)
+    text = jsonio.dumps(db.save())
+    pos = text.index('"solution 10"')
+    bad = (text[:pos] + '"solution 10" ]] ' + text[pos + 13:]).encode()
+
+    fh = io.BytesIO(bad)
+    with pytest.raises(json.JSONDecodeError) as exc:
+        list(jsonio.iterload(fh, chunkSize=1024))
+    # the error is found without reading the rest of the file
+    assert fh.tell() < pos + 4096 < len(bad) // 2
+    with pytest.raises(json.JSONDecodeError) as ref:
+        json.loads(bad.decode())
+    assert exc.value.pos == ref.value.pos
+
+
+def test_values_split_across_reads():
+    from pycsf import jsonio
+    obj = {'a': ['ü\\"\n\t€\U0001f600' * 5, -float('inf'), float('inf'), True, False, None,
+                 1.5e-3, -12345678901234, -0.25, 'ab\\u', 12, 1e+200, -3.5e-7],
+           'b': {'x': 'y' * 50}, 'c': [], 'd': 7, 'e': 0.5}
+    text = jsonio.dumps(obj)
+    expected = [('a', i, v) for i, v in enumerate(obj['a'])] + [('b', None, obj['b']), ('d', None, 7), ('e', None, 0.5)]
+    for chunkSize in range(1, 40):
+        assert list(jsonio.iterload(io.BytesIO(text.encode()), chunkSize=chunkSize)) == expected
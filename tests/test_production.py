@@ -0,0 +1,32 @@
+import os, sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import numpy as np
+from pycsf.core import Solution, Recipe, RecipeSet, SolutionDatabase
+
+
+def test_shared_recipe_uses_stocks_of_ordered_set():
+    db = SolutionDatabase()
+    db.loadDefault()
+    sol = Solution(name='Standard ACSF', group='ACSF')
+    sol['sodium chloride'] = 123
+    sol['potassium chloride'] = 3
+    db.solutions.add(sol)
+    r1 = Recipe(solution=sol, volumes=[1000, 500])
+    rs1 = RecipeSet(name='Standard recipes', recipes=[r1])
+    rs1.stocks['potassium chloride'] = 1.0
+    db.recipes.add(rs1)
+    rs2 = RecipeSet(name='Recording ACSF', recipes=[r1])
+    db.recipes.add(rs2)
+
+    plan = db.recipes.plan([(rs2, r1, 1000, 1)])
+    assert plan.reagents == ['sodium chloride', 'potassium chloride']
+    assert plan.stocks == []
+
+    plan = db.recipes.plan([(rs1, r1, 1000, 1), (rs2, r1, 1000, 2)])
+    assert plan.reagents == ['sodium chloride', 'potassium chloride']
+    assert plan.stocks == [('potassium chloride', 1.0)]
+    # 3 mM in 1 l from a 1 M stock
+    assert np.allclose(plan.stockVolumes, [3.0])
+    kcl = db.reagents['potassium chloride']['molweight']
+    assert np.allclose(plan.grams[1], 2 * 3e-3 * kcl)
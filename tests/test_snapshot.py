@@ -0,0 +1,82 @@
+import os, sys, stat
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import numpy as np
+import pytest
+from pycsf.core import Solution, Recipe, RecipeSet, SolutionDatabase, IONS
+from pycsf.snapshot import openSnapshot
+
+
+def mkDatabase():
+    db = SolutionDatabase()
+    db.loadDefault()
+    names = db.reagents.names()
+    rng = np.random.RandomState(0)
+    for i in range(20):
+        sol = Solution(name='solution %d' % i, group='group %d' % (i % 3), against='solution %d' % ((i + 1) % 20))
+        sol.type = 'internal' if i % 2 else 'external'
+        for j in rng.choice(len(names), 6, replace=False):
+            sol[str(names[j])] = float(rng.uniform(0.1, 150))
+        db.solutions.add(sol)
+    # a reagent that is not in the reagent table
+    db.solutions['solution 0']['unobtainium'] = 1.0
+    db.solutions['solution 1'].notes = 'notes\nwith ünïcode'
+    db.recipes.add(RecipeSet(name='set', recipes=[Recipe(solution=db.solutions['solution 2'], volumes=[100, 250])]))
+    return db
+
+
+def test_snapshot_round_trip(tmp_path):
+    dirname = str(tmp_path / 'db.snap')
+    db = mkDatabase()
+    db.saveSnapshot(dirname)
+    db2 = SolutionDatabase()
+    db2.loadSnapshot(dirname)
+    assert db2.save() == db.save()
+
+
+def test_snapshot_calculate_matches_recalculate(tmp_path):
+    dirname = str(tmp_path / 'db.snap')
+    db = mkDatabase()
+    db.saveSnapshot(dirname)
+    snap = openSnapshot(dirname)
+    ions, osm = snap.calculate()
+    results = db.solutions.recalculate(list(db.solutions), 25.)
+    for i, name in enumerate(snap.solutionNames()):
+        expectIons, expectOsm, revs = results[name]
+        assert np.allclose(ions[i], [expectIons[ion] for ion in IONS])
+        assert np.isclose(osm[i], expectOsm)
+
+
+def test_snapshot_replaces_existing_directory(tmp_path):
+    dirname = str(tmp_path / 'db.snap')
+    db = mkDatabase()
+    db.saveSnapshot(dirname)
+    old = openSnapshot(dirname, mmap=False)
+
+    db.solutions.remove(db.solutions['solution 3'])
+    db.solutions['solution 4']['glucose'] = 12.5
+    db.saveSnapshot(dirname)
+    db2 = SolutionDatabase()
+    db2.loadSnapshot(dirname)
+    assert db2.save() == db.save()
+    assert len(old.solutionNames()) == 20
+    # no temporary directories are left behind
+    assert os.listdir(str(tmp_path)) == ['db.snap']
+
+
+def test_snapshot_is_readable_by_others(tmp_path):
+    dirname = str(tmp_path / 'db.snap')
+    umask = os.umask(0o022)
+    try:
+        mkDatabase().saveSnapshot(dirname)
+    finally:
+        os.umask(umask)
+    assert stat.S_IMODE(os.stat(dirname).st_mode) == 0o755
+
+
+def test_snapshot_rejects_non_string_fields(tmp_path):
+    db = mkDatabase()
+    db.solutions['solution 5'].group = 5
+    with pytest.raises(TypeError, match="field 'group'"):
+        db.saveSnapshot(str(tmp_path / 'db.snap'))
+    assert os.listdir(str(tmp_path)) == []
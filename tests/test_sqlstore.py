@@ -0,0 +1,99 @@
+import os, sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from pycsf import sqlstore
+from pycsf.core import Solution, Recipe, RecipeSet, SolutionDatabase
+
+
+def mkDatabase():
+    db = SolutionDatabase()
+    db.loadDefault()
+    for i in range(10):
+        sol = Solution(name='acsf %d' % i, group='ACSF', against='internal')
+        sol['sodium chloride'] = 120 + i
+        sol['glucose'] = 10
+        if i % 2:
+            sol['potassium chloride'] = 3
+        db.solutions.add(sol)
+    sol = Solution(name='internal', group='Internal', against='acsf 0')
+    sol.type = 'internal'
+    sol['potassium gluconate'] = 130
+    sol['potassium chloride'] = 4
+    sol.notes = 'notes'
+    db.solutions.add(sol)
+    rs = RecipeSet(name='set', recipes=[Recipe(solution=db.solutions['acsf 1'], volumes=[1000, 500])])
+    rs.stocks['potassium chloride'] = 1000.0
+    db.recipes.add(rs)
+    return db
+
+
+def test_json_sqlite_round_trip(tmp_path):
+    jsonFile = str(tmp_path / 'db.json')
+    sqlFile = str(tmp_path / 'db.sqlite')
+    jsonFile2 = str(tmp_path / 'db2.json')
+    db = mkDatabase()
+    db.saveFile(jsonFile)
+    sqlstore.importJson(jsonFile, sqlFile)
+    sqlstore.exportJson(sqlFile, jsonFile2)
+    assert open(jsonFile, 'rb').read() == open(jsonFile2, 'rb').read()
+
+    db2 = SolutionDatabase()
+    db2.openSQLite(sqlFile)
+    assert db2.save() == db.save()
+
+
+def test_lazy_open_then_save_to_same_file(tmp_path):
+    sqlFile = str(tmp_path / 'db.sqlite')
+    db = mkDatabase()
+    db.saveSQLite(sqlFile)
+
+    db2 = SolutionDatabase()
+    db2.openSQLite(sqlFile)
+    assert db2.solutions.names() == db.solutions.names()
+    assert len(db2.solutions._data) == 0
+    db2.solutions['acsf 3']['glucose'] = 25
+    assert len(db2.solutions._data) == 1
+    db2.saveSQLite(sqlFile)
+
+    db.solutions['acsf 3']['glucose'] = 25
+    db3 = SolutionDatabase()
+    db3.openSQLite(sqlFile, lazy=False)
+    assert db3.save() == db.save()
+    # solutions keep their stored order
+    assert [s.name for s in db3.solutions] == [s.name for s in db.solutions]
+
+
+def test_lazy_where_used(tmp_path):
+    sqlFile = str(tmp_path / 'db.sqlite')
+    db = mkDatabase()
+    db.saveSQLite(sqlFile)
+
+    db2 = SolutionDatabase()
+    db2.openSQLite(sqlFile)
+    users = db2.solutions.whereUsed('potassium chloride')
+    assert [s.name for s in users] == [s.name for s in db.solutions.whereUsed('potassium chloride')]
+    # only the solutions using the reagent were loaded
+    assert len(db2.solutions._data) == len(users)
+    assert [rs.name for rs in db2.recipes.whereUsed('potassium chloride')] == ['set']
+    assert db2.save() == db.save()
+
+
+def test_rename_while_lazy(tmp_path):
+    sqlFile = str(tmp_path / 'db.sqlite')
+    db = mkDatabase()
+    db.saveSQLite(sqlFile)
+
+    db2 = SolutionDatabase()
+    db2.openSQLite(sqlFile)
+    # unloaded solutions refer to 'internal' and use 'glucose'
+    db2.solutions['internal'].setName('pipette')
+    db2.reagents.rename('glucose', 'dextrose')
+    db2.saveSQLite(sqlFile)
+
+    db3 = SolutionDatabase()
+    db3.openSQLite(sqlFile, lazy=False)
+    for i in range(10):
+        sol = db3.solutions['acsf %d' % i]
+        assert sol.compareAgainst == 'pipette'
+        assert sol['dextrose'] == 10 and sol['glucose'] is None
+    assert db3.solutions['pipette'].compareAgainst == 'acsf 0'
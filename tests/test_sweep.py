@@ -0,0 +1,105 @@
+import os, sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import numpy as np
+import pytest
+from pycsf.core import Solution, SolutionDatabase, IONS
+from pycsf.sweep import sweep
+
+
+def mkDatabase():
+    db = SolutionDatabase()
+    db.loadDefault()
+    for i in range(3):
+        sol = Solution(name='acsf %d' % i, against='internal 0')
+        sol['sodium chloride'] = 120 + i
+        sol['potassium chloride'] = 2.5 + i
+        sol['glucose'] = 10
+        db.solutions.add(sol)
+    for i in range(2):
+        sol = Solution(name='internal %d' % i, against='acsf 0')
+        sol.type = 'internal'
+        sol['potassium gluconate'] = 130 - 5 * i
+        sol['potassium chloride'] = 4
+        db.solutions.add(sol)
+    return db
+
+
+def pointResult(db, internal, external, temperature):
+    # ions, osmolarity and reversal potentials for one pair, via recalculate()
+    internal.compareAgainst = external.name
+    ions, osm, revs = db.solutions.recalculate([internal], temperature)[internal.name]
+    extIons, extOsm, extRevs = db.solutions.recalculate([external], temperature)[external.name]
+    return ([ions[ion] for ion in IONS], osm, [extIons[ion] for ion in IONS], extOsm,
+            [np.nan if revs[ion] is None else revs[ion] for ion in IONS])
+
+
+def test_sweep_shapes():
+    db = mkDatabase()
+    internals = [db.solutions['internal 0'], db.solutions['internal 1']]
+    externals = [db.solutions['acsf %d' % i] for i in range(3)]
+    n = len(IONS)
+
+    result = sweep(db, internals[0], externals[0], temperature=25.0)
+    assert result.shape == ()
+    assert result.reversal.shape == (n,)
+    assert result.internalOsmolarity.shape == ()
+
+    result = sweep(db, internals, externals, temperature=np.linspace(20, 37, 4),
+                   concentrations={('external', 'potassium chloride'): np.linspace(1, 10, 5)})
+    assert list(result.axes) == ['internal', 'external', 'external potassium chloride', 'temperature']
+    assert result.axes['internal'] == ['internal 0', 'internal 1']
+    assert result.shape == (2, 3, 5, 4)
+    assert result.reversal.shape == (2, 3, 5, 4, n)
+    assert result.internalIons.shape == (2, 3, 5, 4, n)
+    assert result.externalIons.shape == (2, 3, 5, 4, n)
+    assert result.internalOsmolarity.shape == (2, 3, 5, 4)
+    assert result.externalOsmolarity.shape == (2, 3, 5, 4)
+
+    with pytest.raises(ValueError):
+        sweep(db, internals, externals, concentrations={('inside', 'glucose'): [1, 2]})
+    with pytest.raises(KeyError):
+        sweep(db, internals, externals, concentrations={('internal', 'unobtainium'): [1, 2]})
+
+
+def test_sweep_matches_recalculate():
+    db = mkDatabase()
+    internals = [db.solutions['internal 0'], db.solutions['internal 1']]
+    externals = [db.solutions['acsf %d' % i] for i in range(3)]
+    temps = np.array([20.0, 34.0])
+    kcl = np.array([0.0, 3.0, 7.5])
+    result = sweep(db, internals, externals, temperature=temps,
+                   concentrations={('external', 'potassium chloride'): kcl})
+
+    for i, internal in enumerate(internals):
+        for j, external in enumerate(externals):
+            for k, conc in enumerate(kcl):
+                # set the concentration on a copy of the external solution
+                copy = Solution(name='copy')
+                copy.restore(dict(external.save(), name='copy'))
+                copy['potassium chloride'] = conc
+                db.solutions.add(copy)
+                for t, temp in enumerate(temps):
+                    ions, osm, extIons, extOsm, revs = pointResult(db, internal, copy, temp)
+                    index = (i, j, k, t)
+                    assert np.allclose(result.internalIons[index], ions)
+                    assert np.isclose(result.internalOsmolarity[index], osm)
+                    assert np.allclose(result.externalIons[index], extIons)
+                    assert np.isclose(result.externalOsmolarity[index], extOsm)
+                    assert np.allclose(result.reversal[index], revs, equal_nan=True)
+                db.solutions.remove(copy)
+
+
+def test_internal_concentration_axis():
+    db = mkDatabase()
+    internal = db.solutions['internal 0']
+    external = db.solutions['acsf 0']
+    conc = np.array([1.0, 4.0, 20.0])
+    result = sweep(db, internal, external, temperature=34.0,
+                   concentrations={('internal', 'potassium chloride'): conc})
+    assert result.shape == (3,)
+    for k, c in enumerate(conc):
+        internal['potassium chloride'] = c
+        ions, osm, extIons, extOsm, revs = pointResult(db, internal, external, 34.0)
+        assert np.allclose(result.internalIons[k], ions)
+        assert np.allclose(result.reversal[k], revs, equal_nan=True)